@@ -0,0 +1,56 @@
+import importlib
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Common'))
+from payload_codec import CODECS, PayloadCodec
+
+# =============================================================================
+# PAYLOAD CODEC MICRO-BENCHMARK
+# =============================================================================
+# Encode and decode cost and bytes on the wire per message for every codec,
+# with one representative message per topic. Codecs whose package is not
+# installed (msgpack, cbor2) are skipped.
+
+SAMPLES = 50000
+
+MESSAGES = {
+    "edge/outside/data": {"timestamp": "2025-06-01T12:34:56.789012", "light": 512, "sound": "No", "temperature": 24},
+    "edge/inside/data": {"time": "2025-06-01T12:34:56.789012", "led": "on", "fan": "off", "door": "close",
+                         "mode": "auto"},
+    "edge/outside/status": {"sensors": "active"},
+    "cloud/control/led": {"led": "on", "id": 1234},
+    "cloud/suggestion": {"message": "☀️ It's nice out! Go outside!", "temp": 22.5, "weather condition": "clear",
+                         "temp threshold": 25.0},
+}
+
+REQUIRES = {"msgpack": "msgpack", "cbor": "cbor2"}
+
+def per_call_us(fn, n=SAMPLES):
+    start = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter() - start) / n * 1e6
+
+def main():
+    print(f"[BENCH] {'topic':<22}{'codec':<9}{'bytes':>6}{'encode µs':>11}{'decode µs':>11}")
+    for codec in CODECS:
+        if codec in REQUIRES:
+            try:
+                importlib.import_module(REQUIRES[codec])
+            except ImportError:
+                print(f"[BENCH] {codec}: skipped ({REQUIRES[codec]} not installed)")
+                continue
+        payloads = PayloadCodec(codec)
+        for topic, message in MESSAGES.items():
+            payload = payloads.encode(topic, message)
+            raw = payload.encode() if isinstance(payload, str) else payload  # As paho delivers it
+            if payloads.decode(topic, raw) != message:
+                print(f"[BENCH] {topic} {codec}: round trip changed the message")
+            encode = per_call_us(lambda: payloads.encode(topic, message))
+            decode = per_call_us(lambda: payloads.decode(topic, raw))
+            print(f"[BENCH] {topic:<22}{codec:<9}{len(raw):>6}{encode:>11.2f}{decode:>11.2f}")
+
+if __name__ == "__main__":
+    main()
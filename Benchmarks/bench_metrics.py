@@ -0,0 +1,55 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Common'))
+from metrics import Registry
+
+# =============================================================================
+# METRICS OVERHEAD MICRO-BENCHMARK
+# =============================================================================
+# Cost of one histogram sample on the hot path, with and without the
+# context manager, and of rendering a scrape.
+
+SAMPLES = 200000
+
+def per_call_ns(fn, n=SAMPLES):
+    start = time.perf_counter()
+    fn(n)
+    return (time.perf_counter() - start) / n * 1e9
+
+def main():
+    registry = Registry()
+    stage = registry.stage("bench.observe")
+    timed = registry.stage("bench.time")
+    for i in range(20):
+        registry.stage(f"bench.extra{i}").observe(0.001)
+
+    def baseline(n):
+        perf = time.perf_counter
+        for _ in range(n):
+            start = perf()
+            perf() - start
+
+    def observe(n):
+        perf = time.perf_counter
+        for _ in range(n):
+            start = perf()
+            stage.observe(perf() - start)
+
+    def context(n):
+        for _ in range(n):
+            with timed.time():
+                pass
+
+    base = per_call_ns(baseline)
+    print(f"[BENCH] perf_counter pair only:   {base:8.1f} ns")
+    print(f"[BENCH] observe() per sample:     {per_call_ns(observe) - base:8.1f} ns (excluding timing)")
+    print(f"[BENCH] 'with stage.time()':      {per_call_ns(context):8.1f} ns")
+
+    start = time.perf_counter()
+    text = registry.render()
+    print(f"[BENCH] render {len(text.splitlines())} lines:        {(time.perf_counter() - start) * 1e3:8.2f} ms")
+
+if __name__ == "__main__":
+    main()
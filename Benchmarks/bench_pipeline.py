@@ -0,0 +1,204 @@
+import argparse
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import paho.mqtt.client as mqtt
+
+from fake_arduino import LIGHT_RANGE, FakeInsideArduino, FakeOutsideArduino
+from mini_broker import MiniBroker
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Common'))
+from payload_codec import PayloadCodec
+
+# =============================================================================
+# END-TO-END PIPELINE BENCHMARK
+# =============================================================================
+# Runs outside_edge, inside_edge and cloud_server as separate processes
+# against pty-backed fake Arduinos and a local broker, then ramps the sensor
+# rate and reports per-hop latency:
+#
+#   serial -> outside edge -> broker     (fake write  -> edge/outside/data)
+#   broker -> inside edge -> serial      (edge/outside/data -> inside pty)
+#   broker -> cloud_server -> telemetry  (edge/outside/data -> v1/devices/me/telemetry)
+#
+# The light value carries a sequence number so each hop can be matched.
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+RUNNER = os.path.join(HERE, "run_component.py")
+
+DEFAULT_RATES = [1, 5, 10, 25, 50, 100, 200]  # Readings per second
+DEFAULT_DURATION = 10.0   # Seconds per rate step
+DRAIN_TIME = 2.0          # Seconds to wait for stragglers after each step
+LOSS_TOLERANCE = 0.01     # Max fraction of readings allowed to go missing
+P99_BUDGET_MS = 500.0     # Max end-to-end p99 for a rate to count as sustainable
+
+class HopTimes:
+    # Thread-safe record of when each sequence number reached each hop
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hops = {"sent": {}, "edge": {}, "inside": {}, "cloud": {}}
+
+    def mark(self, hop, seq, at):
+        with self.lock:
+            self.hops[hop].setdefault(seq, at)
+
+    def reset(self):
+        with self.lock:
+            for times in self.hops.values():
+                times.clear()
+
+    def deltas(self, start, end):
+        with self.lock:
+            a, b = self.hops[start], self.hops[end]
+            return [(b[seq] - a[seq]) * 1000.0 for seq in b if seq in a]
+
+def percentile(values, pct):
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))]
+
+def spawn(component, broker_port, log, serial=None, protocol="text", db=False, tb_window=None, codec="json"):
+    cmd = [sys.executable, "-u", RUNNER, component, "--port", str(broker_port), "--protocol", protocol,
+           "--codec", codec]
+    if serial:
+        cmd += ["--serial", serial]
+    if db:
+        cmd.append("--db")
+    if tb_window is not None:
+        cmd += ["--tb-window", str(tb_window)]
+    return subprocess.Popen(cmd, stdout=log, stderr=subprocess.STDOUT)
+
+def make_observer(broker_port, times):
+    payloads = PayloadCodec()
+
+    def on_message(client, userdata, msg):
+        received_at = time.perf_counter()
+        try:
+            # Edge data in any codec; telemetry is always JSON
+            data = payloads.decode(msg.topic, msg.payload)
+        except Exception:
+            return
+        if msg.topic == "edge/outside/data":
+            times.mark("edge", int(data["light"]), received_at)
+        else:
+            # Telemetry is either a flat dict or a list of {ts, values}
+            entries = data if isinstance(data, list) else [{"values": data}]
+            for entry in entries:
+                values = entry.get("values", entry)
+                if "light" in values:
+                    times.mark("cloud", int(values["light"]), received_at)
+
+    client = mqtt.Client(client_id="bench-observer")
+    client.on_message = on_message
+    client.connect("127.0.0.1", broker_port)
+    client.subscribe([("edge/outside/data", 0), ("v1/devices/me/telemetry", 0)])
+    client.loop_start()
+    return client
+
+def run_step(outside, times, rate, duration, seq_start):
+    times.reset()
+    interval = 1.0 / rate
+    count = int(rate * duration)
+    start = time.perf_counter()
+    for i in range(count):
+        # Absolute schedule so slow writes do not lower the offered rate
+        delay = start + i * interval - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        seq = (seq_start + i) % LIGHT_RANGE
+        times.mark("sent", seq, time.perf_counter())
+        outside.send_reading(seq)
+    time.sleep(DRAIN_TIME)
+    return count
+
+def report_hop(name, values):
+    return f"{name} p50={percentile(values, 50):7.2f}ms p99={percentile(values, 99):7.2f}ms n={len(values)}"
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end latency and throughput benchmark")
+    parser.add_argument("--rates", type=float, nargs="+", default=DEFAULT_RATES, help="Readings per second to try")
+    parser.add_argument("--duration", type=float, default=DEFAULT_DURATION, help="Seconds per rate step")
+    parser.add_argument("--protocol", default="text", choices=["text", "framed"], help="Serial protocol")
+    parser.add_argument("--db", action="store_true", help="Write to the local MySQL database")
+    parser.add_argument("--tb-window", type=float, default=None, help="Telemetry coalescing window (s)")
+    parser.add_argument("--codec", default="json", choices=["json", "struct", "msgpack", "cbor"],
+                        help="MQTT payload codec")
+    parser.add_argument("--budget-ms", type=float, default=P99_BUDGET_MS, help="End-to-end p99 budget")
+    parser.add_argument("--log", default=os.devnull, help="File for component output")
+    args = parser.parse_args()
+
+    times = HopTimes()
+    broker = MiniBroker()
+    port = broker.start_in_thread()
+    print(f"[BENCH] Broker on 127.0.0.1:{port}")
+
+    outside = FakeOutsideArduino(args.protocol)
+    inside = FakeInsideArduino(args.protocol, on_sensor=lambda seq, at: times.mark("inside", seq, at))
+
+    log = open(args.log, "a")
+    procs = [
+        spawn("inside", port, log, inside.port, args.protocol, args.db, codec=args.codec),
+        spawn("outside", port, log, outside.port, args.protocol, args.db, codec=args.codec),
+        spawn("cloud", port, log, tb_window=args.tb_window, codec=args.codec),
+    ]
+    observer = make_observer(port, times)
+
+    # Wait until both edges, both cloud clients and the observer are connected
+    deadline = time.monotonic() + 15
+    while len(broker.sessions) < 5 and time.monotonic() < deadline:
+        time.sleep(0.1)
+    if len(broker.sessions) < 5:
+        print(f"[ERROR] Only {len(broker.sessions)} of 5 MQTT clients connected; see --log output")
+    time.sleep(1.0)
+
+    sustainable = None
+    seq = 0
+    try:
+        for rate in args.rates:
+            sent = run_step(outside, times, rate, args.duration, seq)
+            seq += sent
+
+            serial_to_broker = times.deltas("sent", "edge")
+            broker_to_inside = times.deltas("edge", "inside")
+            broker_to_cloud = times.deltas("edge", "cloud")
+            end_to_end = times.deltas("sent", "inside")
+            delivered = len(end_to_end) / sent if sent else 0.0
+
+            print(f"\n[BENCH] rate={rate:g}/s sent={sent} delivered={delivered * 100:.1f}%")
+            print("  " + report_hop("serial -> outside edge -> broker ", serial_to_broker))
+            print("  " + report_hop("broker -> inside edge -> serial  ", broker_to_inside))
+            print("  " + report_hop("broker -> cloud -> telemetry     ", broker_to_cloud))
+            print("  " + report_hop("end to end                       ", end_to_end))
+
+            if delivered >= 1.0 - LOSS_TOLERANCE and percentile(end_to_end, 99) <= args.budget_ms:
+                sustainable = rate
+            else:
+                print(f"[BENCH] {rate:g}/s is not sustainable; stopping ramp")
+                break
+    finally:
+        observer.loop_stop()
+        observer.disconnect()
+        for proc in procs:
+            proc.terminate()
+        for proc in procs:
+            try:
+                proc.wait(10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        outside.close()
+        inside.close()
+        broker.stop()
+        log.close()
+
+    if sustainable is None:
+        print("\n[BENCH] No tested rate was sustainable")
+    else:
+        print(f"\n[BENCH] Max sustainable rate: {sustainable:g} readings/s "
+              f"(loss <= {LOSS_TOLERANCE * 100:g}%, end-to-end p99 <= {args.budget_ms:g}ms)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'Edge_Layer'))
+sys.path.insert(0, os.path.join(ROOT, 'Common'))
+
+import outside_edge as edge
+from db_writer import DBWriter
+from history import HistoryRing, HistoryStore
+from storage import MySQLBackend, SQLiteBackend
+
+# =============================================================================
+# STORAGE BACKEND BENCHMARK
+# =============================================================================
+# Writes the outside edge's logs table through DBWriter on each backend and
+# reports insert throughput per batch size, then the latency of the queries
+# reports and the history API run against a day of readings:
+#
+#   report scan      one day of raw rows aggregated (report without daily_summary)
+#   history raw      one hour of raw readings (ring empty, all from the database)
+#   history bucket   one day in 10-minute buckets, aggregated by the database
+#
+# MySQL runs only when the server is reachable; its tables are dropped first.
+
+DEFAULT_ROWS = 20000          # Rows per insert run
+DEFAULT_BATCHES = [1, 50, 200]  # DBWriter batch sizes to try
+DAY_ROWS = 86400              # Readings in the query data set (1 Hz for a day)
+QUERY_REPEATS = 20
+
+REPORT_SQL = (f"SELECT COUNT(*), SUM(light > {edge.LIGHT_THRESHOLD}), SUM(sound = 'Yes'), "
+              f"SUM(temperature > {edge.TEMP_THRESHOLD}) FROM logs WHERE time >= %s AND time < %s")
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))]
+
+def reading(i, start):
+    return (start + timedelta(seconds=i), 300 + i % 700, "Yes" if i % 10 == 0 else "No", 20 + i % 15)
+
+def make_writer(backend, batch_size):
+    writer = DBWriter(
+        backend.connect,
+        schema=edge.SENSORS_SCHEMA,
+        max_queue=DAY_ROWS + DEFAULT_ROWS,
+        batch_size=batch_size,
+        flush_interval=0.05,
+        stats_interval=0,
+        name=f"DB {backend.name}",
+        backend=backend
+    )
+    return writer.start()
+
+def reset(backend):
+    conn = backend.connect()
+    cur = conn.cursor()
+    for table in ("logs", "daily_summary", "sensor_rollup_minute", "sensor_rollup_hour"):
+        cur.execute(f"DROP TABLE IF EXISTS {table}")
+    conn.commit()
+    conn.close()
+
+def wait_flushed(writer, rows, timeout=300.0):
+    deadline = time.monotonic() + timeout
+    while writer.stats()["flushed_rows"] < rows and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+def bench_inserts(backend, rows, batch_size):
+    reset(backend)
+    writer = make_writer(backend, batch_size)
+    start_ts = datetime.now() - timedelta(seconds=rows)
+    start = time.perf_counter()
+    for i in range(rows):
+        writer.submit(edge.SENSORS_INSERT, reading(i, start_ts))
+    wait_flushed(writer, rows)
+    elapsed = time.perf_counter() - start
+    stats = writer.stats()
+    writer.stop()
+    print(f"[BENCH] {backend.name:6} batch {batch_size:4}: {stats['flushed_rows'] / elapsed:9.0f} rows/s  "
+          f"flush avg {stats['avg_flush_ms']:6.2f} ms  max {stats['max_flush_ms']:7.2f} ms")
+
+def timed(fn, repeats=QUERY_REPEATS):
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000.0)
+    return percentile(samples, 50), percentile(samples, 99)
+
+def bench_queries(backend):
+    reset(backend)
+    writer = make_writer(backend, 200)
+    end = datetime.now().replace(microsecond=0)
+    start_ts = end - timedelta(seconds=DAY_ROWS)
+    for i in range(DAY_ROWS):
+        writer.submit(edge.SENSORS_INSERT, reading(i, start_ts))
+    wait_flushed(writer, DAY_ROWS)
+
+    # A one-slot ring keeps every query on the database
+    history = HistoryStore(
+        f"bench.{backend.name}",
+        HistoryRing(("light", "temperature", "loud"), 1),
+        writer,
+        "logs",
+        {"light": "light", "temperature": "temperature", "loud": "sound = 'Yes'"}
+    )
+    history.ring.covered_from = end.timestamp()
+
+    def report_scan():
+        with writer.pool.connection() as conn:
+            cur = conn.cursor()
+            cur.execute(REPORT_SQL, (start_ts, end))
+            cur.fetchall()
+            cur.close()
+
+    t_end = end.timestamp()
+    queries = [
+        ("report scan", report_scan),
+        ("history raw", lambda: history.query(t_end - 3600, t_end)),
+        ("history bucket", lambda: history.query(t_end - DAY_ROWS, t_end, bucket=600)),
+    ]
+    for name, fn in queries:
+        p50, p99 = timed(fn)
+        print(f"[BENCH] {backend.name:6} {name:15} p50 {p50:8.2f} ms  p99 {p99:8.2f} ms")
+    writer.stop()
+
+def mysql_available(backend):
+    # Creates the benchmark database if the server is reachable
+    try:
+        import pymysql
+        conn = pymysql.connect(host=backend.host, user=backend.user, password=backend.password)
+        conn.cursor().execute(f"CREATE DATABASE IF NOT EXISTS {backend.database}")
+        conn.close()
+        return True
+    except Exception as e:
+        print(f"[BENCH] MySQL skipped: {e}")
+        return False
+
+def main():
+    parser = argparse.ArgumentParser(description="Insert throughput and query latency per storage backend")
+    parser.add_argument("--rows", type=int, default=DEFAULT_ROWS, help="Rows per insert run")
+    parser.add_argument("--batches", type=int, nargs="+", default=DEFAULT_BATCHES, help="Batch sizes to try")
+    parser.add_argument("--sqlite-path", default=None, help="SQLite file (default: a temporary file)")
+    parser.add_argument("--mysql-host", default=edge.DB_HOST)
+    parser.add_argument("--mysql-user", default=edge.DB_USER)
+    parser.add_argument("--mysql-password", default=edge.DB_PASSWORD)
+    parser.add_argument("--mysql-database", default="storage_bench")
+    parser.add_argument("--no-mysql", action="store_true", help="Only benchmark SQLite")
+    args = parser.parse_args()
+
+    backends = [SQLiteBackend(args.sqlite_path or os.path.join(tempfile.mkdtemp(prefix="bench-storage-"), "bench.db"))]
+    mysql = MySQLBackend(args.mysql_host, args.mysql_user, args.mysql_password, args.mysql_database)
+    if not args.no_mysql and mysql_available(mysql):
+        backends.append(mysql)
+
+    for backend in backends:
+        for batch_size in args.batches:
+            bench_inserts(backend, args.rows, batch_size)
+    for backend in backends:
+        bench_queries(backend)
+
+if __name__ == "__main__":
+    main()
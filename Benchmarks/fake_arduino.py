@@ -0,0 +1,120 @@
+import os
+import sys
+import threading
+import time
+import tty
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Edge_Layer'))
+from serial_protocol import (COMMAND_ACK_LAYOUT, FLAG_DOOR, FLAG_FAN, FLAG_LIGHT, FLAG_MANUAL, FRAME_ACK,
+                             FRAME_ACTUATORS, FRAME_COMMAND_ACK, FRAME_SENSORS, SENSORS_LAYOUT, encode_frame)
+
+# =============================================================================
+# PTY-BACKED FAKE ARDUINOS
+# =============================================================================
+# Each fake owns the master side of a pseudo-terminal; the edge script opens
+# the slave path (e.g. /dev/pts/7) exactly like /dev/ttyACM0. Readings carry
+# a sequence number in the light value so every hop can be matched up.
+
+LIGHT_RANGE = 6000  # Sequence numbers wrap at the sensor's lux range
+
+class FakeArduino:
+    def __init__(self, protocol="text"):
+        self.protocol = protocol
+        self.master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        self._write_lock = threading.Lock()
+        self._stop = threading.Event()
+        threading.Thread(target=self._read_loop, daemon=True).start()
+
+    def write(self, data):
+        with self._write_lock:
+            os.write(self.master, data)
+
+    def close(self):
+        self._stop.set()
+        for fd in (self.master, self._slave):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    def _read_loop(self):
+        buffer = bytearray()
+        while not self._stop.is_set():
+            try:
+                data = os.read(self.master, 4096)
+            except OSError:
+                return
+            received_at = time.perf_counter()
+            buffer += data
+            while True:
+                end = buffer.find(b'\n')
+                if end < 0:
+                    break
+                line = buffer[:end].decode(errors='replace').strip()
+                del buffer[:end + 1]
+                self.on_line(line, received_at)
+
+    def on_line(self, line, received_at):
+        pass
+
+class FakeOutsideArduino(FakeArduino):
+    # Emits sensor readings; status acknowledgements from the edge are read
+    # and discarded so the pty buffer never fills up
+    def send_reading(self, seq, temp=24, loud=False):
+        light = seq % LIGHT_RANGE
+        if self.protocol == "framed":
+            self.write(encode_frame(FRAME_SENSORS, SENSORS_LAYOUT.pack(light, temp, 1 if loud else 0)))
+        else:
+            sound = "Yes" if loud else "No"
+            self.write(f"Light:{light}, Sound:{sound}, Temperature:{temp}\r\n".encode())
+        return light
+
+class FakeInsideArduino(FakeArduino):
+    # Acknowledges every command like the real sketch, applies manual
+    # commands and answers those carrying ";id:<n>" with an ACK, reports
+    # actuator status every status_interval seconds and calls
+    # on_sensor(light, t) for each forwarded outside reading
+    def __init__(self, protocol="text", on_sensor=None, status_interval=3.0):
+        self.on_sensor = on_sensor
+        self.status_interval = status_interval
+        self.state = {"mode": "auto", "led": "on", "fan": "off", "door": "close"}
+        super().__init__(protocol)
+        threading.Thread(target=self._status_loop, daemon=True).start()
+
+    def on_line(self, line, received_at):
+        if self.protocol == "framed":
+            self.write(encode_frame(FRAME_ACK, b'\x01'))
+        else:
+            self.write(b"SENSORS|status: active\r\n")
+
+        if line.startswith("sensor:") and self.on_sensor:
+            for pair in line.split(','):
+                key, _, value = pair.partition(':')
+                if key == "light":
+                    self.on_sensor(int(value), received_at)
+            return
+
+        command, _, command_id = line.partition(";id:")
+        key, _, value = command.partition(':')
+        if key in self.state:
+            self.state[key] = value
+        if command_id:
+            self.write(self._encode("ACK", int(command_id)))
+
+    def _encode(self, kind, command_id=None):
+        state = self.state
+        if self.protocol == "framed":
+            flags = ((FLAG_MANUAL if state["mode"] == "manual" else 0) | (FLAG_LIGHT if state["led"] == "on" else 0) |
+                     (FLAG_FAN if state["fan"] == "on" else 0) | (FLAG_DOOR if state["door"] == "open" else 0))
+            if kind == "ACK":
+                return encode_frame(FRAME_COMMAND_ACK, COMMAND_ACK_LAYOUT.pack(command_id, flags))
+            return encode_frame(FRAME_ACTUATORS, bytes([flags]))
+        header = f"ACK|id: {command_id}, " if kind == "ACK" else "ACTUATORS|"
+        return (f"{header}Mode: {state['mode']}, Light: {state['led']}, "
+                f"Fan: {state['fan']}, Door: {state['door']}\r\n").encode()
+
+    def _status_loop(self):
+        while not self._stop.wait(self.status_interval):
+            self.write(self._encode("ACTUATORS"))
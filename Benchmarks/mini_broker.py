@@ -0,0 +1,196 @@
+import argparse
+import asyncio
+import struct
+import threading
+
+# =============================================================================
+# MINIMAL MQTT 3.1.1 BROKER
+# =============================================================================
+# Local stand-in for the MQTT broker used by the benchmarks. Supports
+# CONNECT, PUBLISH (QoS 0/1/2), SUBSCRIBE/UNSUBSCRIBE with + and # wildcards,
+# retained messages, PINGREQ and DISCONNECT. No authentication, no
+# persistence, no will messages.
+
+CONNECT, CONNACK, PUBLISH, PUBACK, PUBREC, PUBREL, PUBCOMP = 1, 2, 3, 4, 5, 6, 7
+SUBSCRIBE, SUBACK, UNSUBSCRIBE, UNSUBACK, PINGREQ, PINGRESP, DISCONNECT = 8, 9, 10, 11, 12, 13, 14
+
+def encode_length(length):
+    out = bytearray()
+    while True:
+        byte = length % 128
+        length //= 128
+        out.append(byte | 0x80 if length else byte)
+        if not length:
+            return bytes(out)
+
+def packet(ptype, flags, body):
+    return bytes([(ptype << 4) | flags]) + encode_length(len(body)) + body
+
+def topic_matches(pattern, topic):
+    p_parts = pattern.split('/')
+    t_parts = topic.split('/')
+    for i, p in enumerate(p_parts):
+        if p == '#':
+            return True
+        if i >= len(t_parts) or (p != '+' and p != t_parts[i]):
+            return False
+    return len(p_parts) == len(t_parts)
+
+class Session:
+    def __init__(self, writer):
+        self.writer = writer
+        self.subscriptions = {}  # topic filter -> granted QoS
+        self.next_id = 0
+
+    def packet_id(self):
+        self.next_id = self.next_id % 65535 + 1
+        return self.next_id
+
+class MiniBroker:
+    def __init__(self, host="127.0.0.1", port=0):
+        self.host = host
+        self.port = port
+        self.sessions = set()
+        self.retained = {}
+        self.loop = None
+        self._server = None
+        self._ready = threading.Event()
+
+        # Statistics
+        self.received = 0
+        self.delivered = 0
+
+    # ---------- lifecycle ----------
+
+    def start_in_thread(self):
+        threading.Thread(target=self._thread_main, name="mini-broker", daemon=True).start()
+        self._ready.wait(5)
+        return self.port
+
+    def stop(self):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+
+    def _thread_main(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(self.serve())
+        self.loop.run_forever()
+
+    async def serve(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._ready.set()
+
+    # ---------- connection handling ----------
+
+    async def _handle(self, reader, writer):
+        session = Session(writer)
+        try:
+            while True:
+                header = await reader.readexactly(1)
+                length = 0
+                multiplier = 1
+                while True:
+                    byte = (await reader.readexactly(1))[0]
+                    length += (byte & 0x7F) * multiplier
+                    multiplier *= 128
+                    if not byte & 0x80:
+                        break
+                body = await reader.readexactly(length) if length else b''
+                if not self._dispatch(session, header[0] >> 4, header[0] & 0x0F, body):
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.sessions.discard(session)
+            writer.close()
+
+    def _dispatch(self, session, ptype, flags, body):
+        writer = session.writer
+        if ptype == CONNECT:
+            self.sessions.add(session)
+            writer.write(packet(CONNACK, 0, b'\x00\x00'))
+        elif ptype == PUBLISH:
+            qos = (flags >> 1) & 0x03
+            (topic_len,) = struct.unpack_from('!H', body, 0)
+            topic = body[2:2 + topic_len].decode()
+            pos = 2 + topic_len
+            if qos:
+                (pid,) = struct.unpack_from('!H', body, pos)
+                pos += 2
+                writer.write(packet(PUBACK if qos == 1 else PUBREC, 0, struct.pack('!H', pid)))
+            payload = body[pos:]
+            if flags & 0x01:
+                if payload:
+                    self.retained[topic] = (payload, qos)
+                else:
+                    self.retained.pop(topic, None)
+            self.received += 1
+            self.publish(topic, payload, qos)
+        elif ptype == PUBREL:
+            writer.write(packet(PUBCOMP, 0, body[:2]))
+        elif ptype == SUBSCRIBE:
+            pid = body[:2]
+            pos = 2
+            granted = bytearray()
+            new_filters = []
+            while pos < len(body):
+                (flen,) = struct.unpack_from('!H', body, pos)
+                topic_filter = body[pos + 2:pos + 2 + flen].decode()
+                qos = min(body[pos + 2 + flen], 1)
+                pos += 3 + flen
+                session.subscriptions[topic_filter] = qos
+                granted.append(qos)
+                new_filters.append(topic_filter)
+            writer.write(packet(SUBACK, 0, pid + bytes(granted)))
+            for topic, (payload, qos) in self.retained.items():
+                if any(topic_matches(f, topic) for f in new_filters):
+                    self._deliver(session, topic, payload, qos, retain=True)
+        elif ptype == UNSUBSCRIBE:
+            pos = 2
+            while pos < len(body):
+                (flen,) = struct.unpack_from('!H', body, pos)
+                session.subscriptions.pop(body[pos + 2:pos + 2 + flen].decode(), None)
+                pos += 2 + flen
+            writer.write(packet(UNSUBACK, 0, body[:2]))
+        elif ptype == PINGREQ:
+            writer.write(packet(PINGRESP, 0, b''))
+        elif ptype == DISCONNECT:
+            return False
+        # PUBACK/PUBREC/PUBCOMP from subscribers need no action here
+        return True
+
+    def publish(self, topic, payload, qos=0):
+        for session in list(self.sessions):
+            granted = None
+            for topic_filter, sub_qos in session.subscriptions.items():
+                if topic_matches(topic_filter, topic):
+                    granted = sub_qos if granted is None else max(granted, sub_qos)
+            if granted is not None:
+                self._deliver(session, topic, payload, min(qos, granted))
+
+    def _deliver(self, session, topic, payload, qos, retain=False):
+        encoded = topic.encode()
+        body = struct.pack('!H', len(encoded)) + encoded
+        if qos:
+            body += struct.pack('!H', session.packet_id())
+        flags = (qos << 1) | (1 if retain else 0)
+        session.writer.write(packet(PUBLISH, flags, body + payload))
+        self.delivered += 1
+
+def main():
+    parser = argparse.ArgumentParser(description="Minimal local MQTT broker for benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1883)
+    args = parser.parse_args()
+
+    broker = MiniBroker(args.host, args.port)
+    print(f"[BROKER] Listening on {args.host}:{broker.start_in_thread()}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        broker.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+import argparse
+import os
+import signal
+import sys
+import tempfile
+import threading
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'Edge_Layer'))
+sys.path.insert(0, os.path.join(ROOT, 'Cloud_Layer'))
+
+# =============================================================================
+# BENCHMARK COMPONENT RUNNER
+# =============================================================================
+# Starts one of the pipeline scripts against a fake serial port and a local
+# broker, with Discord and the weather API disabled. Stops on SIGTERM.
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a pipeline component for benchmarking")
+    parser.add_argument("component", choices=["outside", "inside", "cloud"])
+    parser.add_argument("--serial", help="Serial port (edges only)")
+    parser.add_argument("--broker", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--protocol", default="text", choices=["text", "framed"])
+    parser.add_argument("--db", action="store_true", help="Write to the local database")
+    parser.add_argument("--tb-window", type=float, default=None, help="Telemetry coalescing window (s)")
+    parser.add_argument("--codec", default="json", help="MQTT payload codec")
+    args = parser.parse_args()
+
+    if args.component == "cloud":
+        import cloud_server as module
+        from weather_provider import make_provider
+        module.weather_provider = make_provider("stub")
+        module.PAYLOAD_CODEC = args.codec
+        if args.tb_window is not None:
+            module.TELEMETRY.coalesce_window = args.tb_window
+        module.start(args.broker, args.port, args.broker, args.port)
+    else:
+        module = __import__(f"{args.component}_edge")
+        module.SPOOL_DIR = tempfile.mkdtemp(prefix=f"spool-{args.component}-")
+        module.SERIAL_PROTOCOL = args.protocol
+        module.PAYLOAD_CODEC = args.codec
+        module.DISCORD.webhook_url = ""
+        if hasattr(module, "DEADBAND"):
+            # Every reading carries a sequence number the benchmark tracks
+            module.DEADBAND.heartbeat = 0.0
+        module.start(args.serial, args.broker, args.port, db_enabled=args.db)
+
+    stopped = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopped.set())
+    signal.signal(signal.SIGINT, lambda *_: stopped.set())
+    stopped.wait()
+    module.stop()
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,24 @@
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Common'))
+import asyncio
+import itertools
 import json
+import signal
 import time
 import threading
-import requests
 import paho.mqtt.client as mqtt
+from concurrent.futures import Future
 from datetime import datetime
+from log import configure_logging, get_logger, stop_logging
+from metrics import serve_metrics, stage
+from mqtt_asyncio import MQTTLoop
+from mqtt_publisher import BoundedPublisher
+from payload_codec import PayloadCodec
+from room_state import RoomStateStore
+from scheduler import AsyncScheduler
+from telemetry_publisher import TelemetryPublisher
+from weather_provider import make_provider
 
 # =============================================================================
 # CONFIGURATION SECTION
@@ -17,46 +32,127 @@ THINGSBOARD_TOKEN = "Edgeserver" # Device token for authentication
 # ThingsBoard MQTT Topics
 MQTT_SUBS_TB_TOPIC = "v1/devices/me/rpc/request/+"
 MQTT_PUBS_TB_TOPIC = "v1/devices/me/telemetry"
+MQTT_PUBS_TB_RPC_RESPONSE = "v1/devices/me/rpc/response/{id}"
+
+# ThingsBoard Gateway API: rooms other than the default one are sent as
+# separate devices through the Edgeserver device (must be a gateway)
+MQTT_TB_GATEWAY_CONNECT = "v1/gateway/connect"
+MQTT_TB_GATEWAY_TELEMETRY = "v1/gateway/telemetry"
+MQTT_TB_GATEWAY_RPC = "v1/gateway/rpc"
+
+# Telemetry publishing: changes are sent after a short coalescing window,
+# the full state is resent only when nothing changed for a heartbeat interval
+TB_COALESCE_WINDOW = 0.2    # Seconds
+TB_HEARTBEAT_INTERVAL = 60  # Seconds
 
 # Local Edge Network Configuration
-MQTT_SUBS_EDGE_TOPIC = ["edge/outside/data", "edge/inside/data"]
+# Single-room topics (edge/outside/data) belong to DEFAULT_ROOM, per-room
+# topics (edge/<room>/outside/data) come from the multi-room edge daemon
+MQTT_SUBS_EDGE_TOPIC = ["edge/outside/data", "edge/inside/data", "edge/+/outside/data", "edge/+/inside/data",
+                        "edge/inside/ack", "edge/+/inside/ack"]
 MQTT_PUBS_CLOUD_TOPIC_CONTROL = "cloud/control"
+MQTT_PUBS_ROOM_TOPIC_CONTROL = "cloud/{room}/control"
 MQTT_PUBS_CLOUD_TOPIC_SUGGESTION = "cloud/suggestion"
 
+# Rooms and ThingsBoard devices
+DEFAULT_ROOM = "default"        # Published as the Edgeserver device itself
+ROOM_DEVICES = {}               # Room ID -> ThingsBoard device name
+ROOM_DEVICE_NAME = "Room {room}"  # Device name for rooms not listed above
+
+# Commands: RPCs still unanswered after this many seconds are forgotten
+# (the edge reports its own timeouts well before this)
+RPC_TIMEOUT = 10.0
+
 LOCAL_BROKER = "172.20.10.14" # Change to cloud VM server address
 LOCAL_PORT = 1883
 
+# Outbound MQTT queues: QoS and overflow policy per topic filter (see
+# Common/mqtt_publisher.py). Telemetry drops its oldest message when full;
+# commands, RPC responses and device announcements wait for room
+TB_TOPIC_POLICIES = {
+    MQTT_PUBS_TB_TOPIC: (0, "drop_oldest"),
+    MQTT_TB_GATEWAY_TELEMETRY: (0, "drop_oldest"),
+    MQTT_PUBS_TB_RPC_RESPONSE.format(id="+"): (1, "block"),
+    MQTT_TB_GATEWAY_RPC: (1, "block"),
+    MQTT_TB_GATEWAY_CONNECT: (1, "block"),
+}
+LOCAL_TOPIC_POLICIES = {
+    MQTT_PUBS_CLOUD_TOPIC_SUGGESTION: (0, "drop_oldest"),
+    f"{MQTT_PUBS_CLOUD_TOPIC_CONTROL}/#": (1, "block"),
+    f"{MQTT_PUBS_ROOM_TOPIC_CONTROL.format(room='+')}/#": (1, "block"),
+}
+MQTT_QUEUE_SIZE = 1000    # Messages waiting for each broker
+MQTT_MAX_INFLIGHT = 20    # Messages sent and not yet acknowledged
+MQTT_BLOCK_TIMEOUT = 2.0  # Seconds a "block" publish waits for room
+
+# Payload encoding of messages to the edges: "json", "struct" (compact
+# binary with a fixed schema per topic), "msgpack" or "cbor". Edge messages
+# are decoded whatever their encoding (see Common/payload_codec.py);
+# ThingsBoard always gets JSON
+PAYLOAD_CODEC = "json"
+
 # Weather API Configuration
 OPENWEATHER_API_KEY = "your_api_key" # Replace with actual API key
 LOCATION = "melbourne,au"
+WEATHER_PROVIDER = "openweathermap"  # "openweathermap" or "stub" (offline)
+WEATHER_FETCH_INTERVAL = 120         # Seconds between weather updates
+WEATHER_PUBLISH_INTERVAL = 120       # Seconds between suggestions to the edges
+WEATHER_TIMEOUT = (3.05, 5.0)        # Connect/read timeouts in seconds
+WEATHER_MAX_STALE = 3600             # Seconds the last good value may be served
+
+# Metrics Endpoint (Prometheus text format; port 0 disables it)
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9103
+
+# Logging: lines are written by a background thread (see Common/log.py).
+# Levels per category, e.g. {"local.received": "WARNING"}; per-message
+# categories are sampled to LOG_SAMPLE_RATE lines per second
+LOG_LEVEL = "INFO"
+LOG_LEVELS = {}
+LOG_SAMPLE_RATE = 5
 
 # =============================================================================
 # GLOBAL STATE VARIABLES
 # =============================================================================
 
 # Inside environment state (actuators)
-inside = {
+INSIDE_KEYS = ["fan", "door", "led", "mode"]
+INSIDE_DEFAULTS = {
     "fan": "off",
-    "door": "close", 
+    "door": "close",
     "led": "off",
     "mode": "auto"
 }
 
 # Outside environment state (sensors)
-outside = {
-    "temperature": None, 
-    "light": None, 
-    "sound": None
-}
+OUTSIDE_KEYS = ["temperature", "light", "sound"]
 
-# Weather information and decision parameters
-weather = {
+# Weather information and decision parameters (shared by all rooms)
+WEATHER_DEFAULTS = {
     "message": "",
     "temp": 0.0,
     "weather condition": "",
     "temp threshold": 30.0, # Default threshold
 }
 
+# Per-room state; readers take lock-free snapshots
+STATE = RoomStateStore(INSIDE_DEFAULTS)
+STATE.update_shared(WEATHER_DEFAULTS)
+
+# Commands forwarded to the edge and awaiting its result:
+# command ID -> (room, ThingsBoard reply target, received at). Only touched
+# from the event loop, like everything below
+PENDING_COMMANDS = {}
+COMMAND_IDS = itertools.count(1)
+
+# Loggers per category (see LOG_LEVELS); per-message lines are sampled
+LOG = get_logger("cloud")
+TB_LOG = get_logger("tb")
+TB_PUBLISHED_LOG = get_logger("tb.published", rate=LOG_SAMPLE_RATE)
+LOCAL_LOG = get_logger("local")
+LOCAL_RECEIVED_LOG = get_logger("local.received", rate=LOG_SAMPLE_RATE)
+WEATHER_LOG = get_logger("weather")
+
 # =============================================================================
 # MQTT CLIENT INITIALIZATION
 # =============================================================================
@@ -68,173 +164,380 @@ tb_client.username_pw_set(THINGSBOARD_TOKEN)
 # Local MQTT client setup
 local_client = mqtt.Client()
 
+# Bounded outbound queues; every publish goes through these
+tb_out = BoundedPublisher(tb_client, TB_TOPIC_POLICIES, max_queue=MQTT_QUEUE_SIZE,
+                          max_inflight=MQTT_MAX_INFLIGHT, block_timeout=MQTT_BLOCK_TIMEOUT, name="MQTT tb")
+local_out = BoundedPublisher(local_client, LOCAL_TOPIC_POLICIES, max_queue=MQTT_QUEUE_SIZE,
+                             max_inflight=MQTT_MAX_INFLIGHT, block_timeout=MQTT_BLOCK_TIMEOUT, name="MQTT local")
+
+# Edge payload codec, created by run() from PAYLOAD_CODEC
+PAYLOAD = None
+
 # =============================================================================
 # WEATHER DATA PROCESSING
 # =============================================================================
 
-def fetch_weather_loop():
-    while True:
-        try:
-            # Fetch current weather data
-            res = requests.get(
-                f"http://api.openweathermap.org/data/2.5/weather?q={LOCATION}&appid={OPENWEATHER_API_KEY}&units=metric"
-            )
-            data = res.json()
-
-            # Extract temperature and weather condition
-            temp = data["main"]["temp"]
-            condition = data["weather"][0]["main"].lower()
-
-            # Determine user message and temperature threshold based on weather
-            if condition in ["clear", "clouds"]:
-                message = "☀️ It's nice out! Go outside!"
-                temp_threshold = 25.0
-            elif condition in ["rain", "thunderstorm", "snow"]:
-                message = "🌧️ Weather's bad. Stay indoors!"
-                temp_threshold = 35.0
-            else:
-                message = "🤔 Mixed weather. Stay safe!"
-                temp_threshold = 30.0
-
-            # Update global weather state
-            weather["message"] = message
-            weather["temp"] = temp
-            weather["weather condition"] = condition
-            weather["temp threshold"] = temp_threshold
-
-            print(f"[WEATHER] {message} | Outdoor Temp: {temp}°C, Condition: {condition}")
-            print(f"[DECISIONS] Temperature Threshold: {temp_threshold}")
-
-        except Exception as e:
-            print("[ERROR] Weather fetch failed:", e)
+def create_weather_provider():
+    if WEATHER_PROVIDER == "openweathermap":
+        return make_provider(
+            WEATHER_PROVIDER,
+            api_key=OPENWEATHER_API_KEY,
+            location=LOCATION,
+            ttl=WEATHER_FETCH_INTERVAL,
+            max_stale=WEATHER_MAX_STALE,
+            timeout=WEATHER_TIMEOUT
+        )
+    return make_provider(WEATHER_PROVIDER)
+
+weather_provider = create_weather_provider()
+
+async def fetch_weather():
+    # Scheduled every WEATHER_FETCH_INTERVAL
+    try:
+        # Fetch current weather data (cached, timeout-bounded). requests has
+        # no asyncio interface, so the HTTP call runs in the loop's executor
+        reading = await asyncio.to_thread(weather_provider.current)
+        temp = reading["temp"]
+        condition = reading["condition"]
+
+        # Determine user message and temperature threshold based on weather
+        message, temp_threshold = weather_provider.decide(reading)
+
+        # Update the shared weather state and send changes to every room
+        changes = STATE.update_shared({
+            "message": message,
+            "temp": temp,
+            "weather condition": condition,
+            "temp threshold": temp_threshold
+        })
+        for room in STATE.rooms():
+            TELEMETRY.update(room, changes)
+
+        WEATHER_LOG.info("%s | Outdoor Temp: %s°C, Condition: %s", message, temp, condition)
+        WEATHER_LOG.info("Decision: temperature threshold %s", temp_threshold)
 
-        # Wait 2 minutes before next fetch
-        time.sleep(120)
+    except Exception as e:
+        WEATHER_LOG.error("Weather fetch failed: %s", e)
 
 # =============================================================================
 # DATA PUBLISHING FUNCTIONS
 # =============================================================================
 
-def publish_to_thingsboard():
-    while True:
-        # Create combined telemetry payload
-        payload = {
-            "timestamp": datetime.now().isoformat(),
-            **inside,
-            **outside,
-            **weather
-        }
-
-        try:
-            tb_client.publish(MQTT_PUBS_TB_TOPIC, json.dumps(payload))
-            print("[TB] Published:", payload)
-        except Exception as e:
-            print("[TB ERROR] Publish failed:", e)
-
-        # Publish every 10 seconds
-        time.sleep(10)
+# Per-stage timings exported on the metrics endpoint
+TB_PUBLISH_STAGE = stage("cloud.tb_publish")
+TB_ON_MESSAGE_STAGE = stage("cloud.tb_on_message")
+LOCAL_ON_MESSAGE_STAGE = stage("cloud.local_on_message")
+JSON_DECODE_STAGE = stage("cloud.json_decode")
+PAYLOAD_DECODE_STAGE = stage("cloud.payload_decode")
+COMMAND_RTT_STAGE = stage("cloud.command_rtt")
+
+def device_name(room):
+    return ROOM_DEVICES.get(room) or ROOM_DEVICE_NAME.format(room=room)
+
+# Reverse lookup for gateway RPCs, filled as rooms are connected
+DEVICE_ROOMS = {}
+
+def connect_room_device(room):
+    # Announce a new room's device to the gateway so it receives RPCs
+    name = device_name(room)
+    DEVICE_ROOMS[name] = room
+    tb_out.publish(MQTT_TB_GATEWAY_CONNECT, json.dumps({"device": name}))
+    TB_LOG.info("Gateway connected device '%s' for room %s", name, room)
+
+def publish_to_thingsboard(batch):
+    # batch: {room: [{"ts": <epoch ms>, "values": {<changed keys>}}, ...]}
+    try:
+        with TB_PUBLISH_STAGE.time():
+            entries = batch.pop(DEFAULT_ROOM, None)
+            if entries:
+                payload = json.dumps(entries)
+                tb_out.publish(MQTT_PUBS_TB_TOPIC, payload)
+                TB_PUBLISHED_LOG.info("Published: %s", payload)
+
+            # All other rooms go out in one gateway message keyed by device name
+            if batch:
+                payload = json.dumps({device_name(room): entries for room, entries in batch.items()})
+                tb_out.publish(MQTT_TB_GATEWAY_TELEMETRY, payload)
+                TB_PUBLISHED_LOG.info("Gateway published %d rooms", len(batch))
+    except Exception as e:
+        TB_LOG.error("Publish failed: %s", e)
+
+def room_snapshot(room):
+    # Full state for heartbeats: shared weather plus the room's own values
+    return {**STATE.shared(), **STATE.snapshot(room)}
+
+# Change-driven publisher feeding publish_to_thingsboard
+TELEMETRY = TelemetryPublisher(
+    publish_to_thingsboard,
+    room_snapshot,
+    coalesce_window=TB_COALESCE_WINDOW,
+    heartbeat_interval=TB_HEARTBEAT_INTERVAL
+)
+
+def update_room(room, values, ts=None):
+    is_new = room not in STATE
+    changes = STATE.update(room, values)
+    if is_new:
+        if room != DEFAULT_ROOM:
+            connect_room_device(room)
+        changes = {**STATE.shared(), **changes}
+    TELEMETRY.update(room, changes, ts)
+
+def source_ts(data):
+    # Edge payloads carry ISO timestamps ("timestamp" outside, "time" inside)
+    stamp = data.get("timestamp") or data.get("time")
+    try:
+        return int(datetime.fromisoformat(stamp).timestamp() * 1000)
+    except (TypeError, ValueError):
+        return None
     
 def publish_weather():
-    while True:
-        try:
-            weather_payload = json.dumps(weather)
-            local_client.publish(MQTT_PUBS_CLOUD_TOPIC_SUGGESTION, weather_payload)
-            print(f"[FORWARD] Pubslished to {MQTT_PUBS_CLOUD_TOPIC_SUGGESTION}:", weather_payload)
-
-        except Exception as e:
-            print("[ERROR] publish_weather failed:", e)
+    # Scheduled every WEATHER_PUBLISH_INTERVAL
+    try:
+        weather = dict(STATE.shared())
+        local_out.publish(MQTT_PUBS_CLOUD_TOPIC_SUGGESTION, PAYLOAD.encode(MQTT_PUBS_CLOUD_TOPIC_SUGGESTION, weather))
+        LOCAL_LOG.info("Published to %s: %s", MQTT_PUBS_CLOUD_TOPIC_SUGGESTION, weather)
 
-        # Publish every 2 minutes
-        time.sleep(120)
+    except Exception as e:
+        LOG.error("publish_weather failed: %s", e)
 
 # =============================================================================
 # THINGSBOARD MQTT HANDLERS
 # =============================================================================
 
 def tb_on_connect(client, userdata, flags, rc):
-    print("[TB] Connected")
+    TB_LOG.info("Connected")
     client.subscribe(MQTT_SUBS_TB_TOPIC)
+    client.subscribe(MQTT_TB_GATEWAY_RPC)
 
-def tb_on_message(client, userdata, msg):
-    try:
-        payload = json.loads(msg.payload.decode())
-        print("[TB] RPC received:", payload)
+    # Devices must be announced again after a reconnect
+    for room in STATE.rooms():
+        if room != DEFAULT_ROOM:
+            connect_room_device(room)
 
-        # Extract RPC method and parameters
-        method = payload.get("method")
-        params = payload.get("params")
+def decode_json(raw):
+    with JSON_DECODE_STAGE.time():
+        return json.loads(raw.decode())
 
-        if method:
-            # Update local state
-            inside[method] = params
-            print(f"[RPC] {method} set to {params}")
+def decode_payload(topic, raw):
+    # Edge messages in any codec; the first byte tells which
+    with PAYLOAD_DECODE_STAGE.time():
+        return PAYLOAD.decode(topic, raw)
 
-            # Forward command to edge layer via local MQTT
-            command_payload = json.dumps({method: params}) # e.g. {"led" : "on"}
-            command_topic = f"{MQTT_PUBS_CLOUD_TOPIC_CONTROL}/{method}" # e.g. "cloud/control/led"
-            local_client.publish(command_topic, command_payload)
-            print(f"[FORWARD] Pubslished to {command_topic}:", command_payload)
+def tb_on_message(client, userdata, msg):
+    try:
+        with TB_ON_MESSAGE_STAGE.time():
+            payload = decode_json(msg.payload)
+            TB_LOG.info("RPC received: %s", payload)
+
+            # Gateway RPCs name the device: {"device": ..., "data": {"id", "method", "params"}}
+            if msg.topic == MQTT_TB_GATEWAY_RPC:
+                room = DEVICE_ROOMS.get(payload.get("device"))
+                if room is None:
+                    TB_LOG.error("RPC for unknown device %s", payload.get("device"))
+                    return
+                payload = payload.get("data", {})
+                reply_to = (device_name(room), payload.get("id"))
+            else:
+                room = DEFAULT_ROOM
+                reply_to = (None, msg.topic.rsplit('/', 1)[-1])  # v1/devices/me/rpc/request/<id>
+
+            # Extract RPC method and parameters
+            method = payload.get("method")
+            params = payload.get("params")
+
+            if method:
+                # Update local state
+                update_room(room, {method: params})
+                TB_LOG.info("RPC %s %s set to %s", room, method, params)
+
+                # Forward command to edge layer via local MQTT; the ID comes back
+                # with the edge's result and is answered on the RPC response topic
+                command_id = track_command(room, reply_to)
+                command = {method: params, "id": command_id} # e.g. {"led" : "on", "id": 7}
+                if room == DEFAULT_ROOM:
+                    command_topic = f"{MQTT_PUBS_CLOUD_TOPIC_CONTROL}/{method}" # e.g. "cloud/control/led"
+                else:
+                    command_topic = f"{MQTT_PUBS_ROOM_TOPIC_CONTROL.format(room=room)}/{method}"
+                command_payload = PAYLOAD.encode(command_topic, command)
+                if local_out.publish(command_topic, command_payload).rc != mqtt.MQTT_ERR_SUCCESS:
+                    # The edge never sees it: answer the RPC now instead of letting it time out
+                    PENDING_COMMANDS.pop(command_id, None)
+                    respond_rpc(reply_to, {"status": "rejected", "actuator": method, "value": params})
+                    return
+                LOCAL_LOG.info("Published to %s: %s", command_topic, command)
 
     except Exception as e:
-        print("[TB ERROR] on_message:", e)
+        TB_LOG.error("on_message: %s", e)
+
+def track_command(room, reply_to):
+    now = time.monotonic()
+    command_id = next(COMMAND_IDS)
+    # Forget commands whose RPC has long since timed out
+    for stale in [cid for cid, (_, _, at) in PENDING_COMMANDS.items() if now - at > RPC_TIMEOUT]:
+        del PENDING_COMMANDS[stale]
+    PENDING_COMMANDS[command_id] = (room, reply_to, now)
+    return command_id
+
+def respond_rpc(reply_to, result):
+    device, request_id = reply_to
+    if device is None:
+        topic = MQTT_PUBS_TB_RPC_RESPONSE.format(id=request_id)
+        tb_out.publish(topic, json.dumps(result))
+    else:
+        # Gateway devices are answered on the gateway RPC topic
+        tb_out.publish(MQTT_TB_GATEWAY_RPC, json.dumps({"device": device, "id": request_id, "data": result}))
+    TB_LOG.info("RPC %s answered: %s", request_id, result.get("status"))
+
+def handle_command_result(room, data):
+    pending = PENDING_COMMANDS.pop(data.get("id"), None)
+    if pending is None:
+        return  # Unknown, superseded twice or already forgotten
+    _, reply_to, received_at = pending
+    COMMAND_RTT_STAGE.observe(time.monotonic() - received_at)
+    if data.get("status") != "ok":
+        COMMAND_RTT_STAGE.error()
+
+    # The sketch reports its actual actuator states with the ACK
+    state = data.get("state")
+    if state:
+        update_room(room, {key: state[key] for key in INSIDE_KEYS if key in state})
+
+    result = {key: data[key] for key in ("status", "actuator", "value", "state") if key in data}
+    respond_rpc(reply_to, result)
 
 # =============================================================================
 # LOCAL MQTT HANDLERS
 # =============================================================================
 
 def local_on_connect(client, userdata, flags, rc):
-    print("[LOCAL] Connected")
+    LOCAL_LOG.info("Connected")
     for topic in MQTT_SUBS_EDGE_TOPIC:
         client.subscribe(topic)
 
+def room_of(topic):
+    # "edge/outside/data" -> (DEFAULT_ROOM, "outside"), "edge/lab/inside/data" -> ("lab", "inside")
+    parts = topic.split('/')
+    if len(parts) == 3:
+        return DEFAULT_ROOM, parts[1]
+    return parts[1], parts[2]
+
 def local_on_message(client, userdata, msg):
     topic = msg.topic
     try:
-        data = json.loads(msg.payload.decode())
-        print(f"[LOCAL] {topic} -> {data}")
-
-        # Update inside actuator states
-        if "inside" in topic:
-            for key in ["fan", "door", "led", "mode"]:
-                if key in data:
-                    inside[key] = data[key]
-
-        # Update outside sensor readings
-        elif "outside" in topic:
-            for key in ["temperature", "light", "sound"]:
-                if key in data:
-                    outside[key] = data[key]
+        with LOCAL_ON_MESSAGE_STAGE.time():
+            data = decode_payload(topic, msg.payload)
+            LOCAL_RECEIVED_LOG.info("%s -> %s", topic, data)
+            room, role = room_of(topic)
+
+            # Command results answer the pending ThingsBoard RPC
+            if topic.endswith("/ack"):
+                handle_command_result(room, data)
+                return
+
+            # Update inside actuator states or outside sensor readings
+            keys = INSIDE_KEYS if role == "inside" else OUTSIDE_KEYS
+            update_room(room, {key: data[key] for key in keys if key in data}, source_ts(data))
     except Exception as e:
-        print("[LOCAL ERROR]", e)
+        LOCAL_LOG.error("on_message: %s", e)
 
 # =============================================================================
 # MAIN EXECUTION
 # =============================================================================
 
-# Configure MQTT client callbacks
-tb_client.on_connect = tb_on_connect
-tb_client.on_message = tb_on_message
-
-local_client.on_connect = local_on_connect
-local_client.on_message = local_on_message
+# Everything runs on one asyncio event loop: both MQTT clients' sockets,
+# the metrics endpoint and the timers of the scheduled jobs. Only the
+# weather HTTP call leaves it (see fetch_weather)
+LOOP = None
+STOP_EVENT = None  # asyncio.Event; set on SIGINT/SIGTERM or by stop()
+
+async def run(tb_broker=THINGSBOARD_BROKER, tb_port=THINGSBOARD_PORT,
+              local_broker=LOCAL_BROKER, local_port=LOCAL_PORT, started=None):
+    # started: Future completed once connected (used by start())
+    global LOOP, STOP_EVENT, PAYLOAD
+    configure_logging(LOG_LEVEL, LOG_LEVELS)
+    PAYLOAD = PayloadCodec(PAYLOAD_CODEC, name="Payload cloud")
+    LOOP = asyncio.get_running_loop()
+    STOP_EVENT = asyncio.Event()
+    scheduler = AsyncScheduler(LOOP, name="Cloud")
 
-# Establish MQTT connections
-tb_client.connect(THINGSBOARD_BROKER, THINGSBOARD_PORT, 60)
-tb_client.loop_start()
-
-local_client.connect(LOCAL_BROKER, LOCAL_PORT, 60)
-local_client.loop_start()
-
-# Start background threads
-threading.Thread(target=fetch_weather_loop, daemon=True).start()
-threading.Thread(target=publish_to_thingsboard, daemon=True).start()
-threading.Thread(target=publish_weather, daemon=True).start()
-
-# Keep main thread alive
-try:
-    while True:
-        time.sleep(1)
-except KeyboardInterrupt:
-    tb_client.loop_stop()
-    local_client.loop_stop()
-    print("Stopped.")
\ No newline at end of file
+    try:
+        # Configure MQTT client callbacks
+        tb_client.on_connect = tb_on_connect
+        tb_client.on_message = tb_on_message
+
+        local_client.on_connect = local_on_connect
+        local_client.on_message = local_on_message
+
+        # Establish MQTT connections
+        tb_link = MQTTLoop(tb_client, LOOP, name="MQTT tb")
+        local_link = MQTTLoop(local_client, LOOP, name="MQTT local")
+        await tb_link.connect(tb_broker, tb_port, 60)
+        await local_link.connect(local_broker, local_port, 60)
+        tb_out.start(LOOP)
+        local_out.start(LOOP)
+
+        # Start telemetry publisher with the default room's initial state and the periodic jobs
+        TELEMETRY.start(scheduler)
+        update_room(DEFAULT_ROOM, {})
+        metrics_server = await serve_metrics(METRICS_HOST, METRICS_PORT)
+        scheduler.every(WEATHER_FETCH_INTERVAL, fetch_weather, first=0)
+        scheduler.every(WEATHER_PUBLISH_INTERVAL, publish_weather, first=0)
+
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                LOOP.add_signal_handler(sig, STOP_EVENT.set)
+            except (ValueError, RuntimeError):
+                pass  # Not the main thread: start() was used, stop() ends it
+    except BaseException as e:
+        if started is not None:
+            started.set_exception(e)
+        raise
+    if started is not None:
+        started.set_result(None)
+
+    await STOP_EVENT.wait()
+
+    # Timers first, then send what is pending before disconnecting
+    scheduler.stop()
+    TELEMETRY.stop()
+    await asyncio.gather(tb_out.drain(), local_out.drain())
+    tb_out.stop()
+    local_out.stop()
+    await asyncio.gather(tb_link.disconnect(), local_link.disconnect())
+    if metrics_server is not None:
+        metrics_server.close()
+        await metrics_server.wait_closed()
+    weather_provider.close()
+    stop_logging()
+
+_LOOP_THREAD = None
+
+def start(tb_broker=THINGSBOARD_BROKER, tb_port=THINGSBOARD_PORT,
+          local_broker=LOCAL_BROKER, local_port=LOCAL_PORT):
+    # Runs the server loop on a background thread and returns once it is
+    # connected (Benchmarks/run_component.py); main() runs it in the foreground
+    global _LOOP_THREAD
+    started = Future()
+    _LOOP_THREAD = threading.Thread(
+        target=asyncio.run,
+        args=(run(tb_broker, tb_port, local_broker, local_port, started),),
+        name="cloud-loop",
+        daemon=True
+    )
+    _LOOP_THREAD.start()
+    started.result()
+
+def stop():
+    if LOOP is not None and STOP_EVENT is not None:
+        LOOP.call_soon_threadsafe(STOP_EVENT.set)
+    if _LOOP_THREAD is not None:
+        _LOOP_THREAD.join(10)
+
+def main():
+    # Returns after SIGINT/SIGTERM once everything pending is sent
+    asyncio.run(run())
+    print("Stopped.")
+
+if __name__ == "__main__":
+    main()
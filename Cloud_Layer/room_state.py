@@ -0,0 +1,67 @@
+import threading
+from types import MappingProxyType
+
+# =============================================================================
+# PER-ROOM STATE STORE
+# =============================================================================
+
+EMPTY_STATE = MappingProxyType({})
+
+class RoomStateStore:
+    # Latest known values per room, stored copy-on-write: an update builds a
+    # new dict and swaps the room's reference, and published dicts are never
+    # modified again. Readers take the current reference without locking and
+    # always see one complete state, never a half-applied update. Writers
+    # (MQTT threads, weather thread) serialise on a small lock. Shared
+    # values such as the weather are kept once for all rooms.
+    def __init__(self, defaults=None):
+        self.defaults = MappingProxyType(dict(defaults or {}))
+        self._rooms = {}  # room -> read-only state; replaced whole when a room is added
+        self._shared = EMPTY_STATE
+        self._write_lock = threading.Lock()
+
+    def update(self, room, values):
+        # Apply values to a room and return the keys that changed. A room
+        # seen for the first time returns its full state.
+        with self._write_lock:
+            current = self._rooms.get(room)
+            base = self.defaults if current is None else current
+            changes = {k: v for k, v in values.items() if v is not None and base.get(k) != v}
+            if current is not None and not changes:
+                return {}
+
+            state = dict(base)
+            state.update(changes)
+            state = MappingProxyType(state)
+            if current is None:
+                # New room: publish a new mapping so iterating readers are safe
+                rooms = dict(self._rooms)
+                rooms[room] = state
+                self._rooms = rooms
+                return dict(state)
+            self._rooms[room] = state
+            return changes
+
+    def update_shared(self, values):
+        with self._write_lock:
+            changes = {k: v for k, v in values.items() if v is not None and self._shared.get(k) != v}
+            if changes:
+                state = dict(self._shared)
+                state.update(changes)
+                self._shared = MappingProxyType(state)
+            return changes
+
+    def snapshot(self, room):
+        return self._rooms.get(room, EMPTY_STATE)
+
+    def shared(self):
+        return self._shared
+
+    def rooms(self):
+        return tuple(self._rooms)
+
+    def __contains__(self, room):
+        return room in self._rooms
+
+    def __len__(self):
+        return len(self._rooms)
@@ -0,0 +1,113 @@
+import threading
+import time
+from scheduler import TimerScheduler
+
+# =============================================================================
+# CHANGE-DRIVEN TELEMETRY PUBLISHER
+# =============================================================================
+
+def now_ms():
+    return int(time.time() * 1000)
+
+class TelemetryPublisher:
+    # Sends only changed keys, a short coalescing window after the first
+    # change, for any number of rooms with one coalescing timer and one
+    # heartbeat job on a shared scheduler (Common/scheduler.py). Every room
+    # with pending changes goes out in one call, in ThingsBoard's
+    # timestamped array form per room:
+    #   publish({"lab": [{"ts": 1700000000000, "values": {"led": "on"}}], ...})
+    # Each value keeps the timestamp reported by its source. Rooms with
+    # nothing sent for heartbeat_interval seconds get their full state from
+    # snapshot(room) so their devices keep looking alive.
+    def __init__(self, publish, snapshot, coalesce_window=0.2, heartbeat_interval=60.0, name="TB"):
+        self.publish = publish
+        self.snapshot = snapshot
+        self.coalesce_window = coalesce_window
+        self.heartbeat_interval = heartbeat_interval
+        self.name = name
+
+        self._pending = {}       # room -> {key: (ts, value)} waiting to be sent
+        self._last_publish = {}  # room -> monotonic time of the last send
+        self._timer = None       # Pending flush job
+        self._heartbeat_job = None
+        self._scheduler = None
+        self._own_scheduler = None
+        self._lock = threading.Lock()
+
+        # Statistics
+        self.updates = 0
+        self.published = 0
+        self.heartbeats = 0
+
+    def start(self, scheduler=None):
+        # scheduler: TimerScheduler or AsyncScheduler to run on (flushes and
+        # heartbeats then run on its thread or loop); default: an own one
+        if scheduler is None:
+            scheduler = self._own_scheduler = TimerScheduler(f"{self.name}-telemetry").start()
+        self._scheduler = scheduler
+        self._heartbeat_job = scheduler.every(min(self.heartbeat_interval, 5.0), self._heartbeat)
+        return self
+
+    def stop(self):
+        if self._heartbeat_job is not None:
+            self._heartbeat_job.cancel()
+        with self._lock:
+            timer, self._timer = self._timer, None
+        if timer is not None:
+            timer.cancel()
+        if self._own_scheduler is not None:
+            self._own_scheduler.stop()
+        self.flush()
+
+    def update(self, room, changes, ts=None):
+        # Queue already-changed values; later changes to a key replace it
+        if not changes:
+            return
+        ts = ts or now_ms()
+        with self._lock:
+            self.updates += 1
+            pending = self._pending.setdefault(room, {})
+            for key, value in changes.items():
+                pending[key] = (ts, value)
+            self._last_publish.setdefault(room, 0.0)
+
+            if self._timer is None and self._scheduler is not None:
+                self._timer = self._scheduler.call_later(self.coalesce_window, self.flush)
+
+    def flush(self):
+        with self._lock:
+            self._timer = None
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+
+        # Group each room's changed keys by their source timestamp
+        batch = {}
+        for room, keys in pending.items():
+            by_ts = {}
+            for key, (ts, value) in keys.items():
+                by_ts.setdefault(ts, {})[key] = value
+            batch[room] = [{"ts": ts, "values": values} for ts, values in sorted(by_ts.items())]
+        self._send(batch)
+
+    def _send(self, batch):
+        now = time.monotonic()
+        with self._lock:
+            for room in batch:
+                self._last_publish[room] = now
+        self.published += 1
+        self.publish(batch)
+
+    def _heartbeat(self):
+        now = time.monotonic()
+        with self._lock:
+            idle = [room for room, last in self._last_publish.items()
+                    if now - last >= self.heartbeat_interval]
+        batch = {}
+        for room in idle:
+            state = self.snapshot(room)
+            if state:
+                batch[room] = [{"ts": now_ms(), "values": dict(state)}]
+        if batch:
+            self.heartbeats += 1
+            self._send(batch)
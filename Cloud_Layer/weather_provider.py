@@ -0,0 +1,123 @@
+import abc
+import itertools
+import logging
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+
+LOG = logging.getLogger("weather")
+
+# =============================================================================
+# WEATHER DECISIONS
+# =============================================================================
+
+def decide_threshold(condition):
+    # Determine user message and temperature threshold based on weather
+    if condition in ["clear", "clouds"]:
+        return "☀️ It's nice out! Go outside!", 25.0
+    elif condition in ["rain", "thunderstorm", "snow"]:
+        return "🌧️ Weather's bad. Stay indoors!", 35.0
+    return "🤔 Mixed weather. Stay safe!", 30.0
+
+# =============================================================================
+# PROVIDERS
+# =============================================================================
+
+class WeatherProvider(abc.ABC):
+    # Base for providers: current() returns {"temp": float, "condition": str,
+    # "fetched_at": epoch seconds, "stale": bool} or raises when no value
+    # is available at all. decide() maps a reading to (message, threshold)
+    # and can be overridden per provider.
+    name = "weather"
+
+    @abc.abstractmethod
+    def current(self):
+        ...
+
+    def decide(self, reading):
+        return decide_threshold(reading["condition"])
+
+    def close(self):
+        pass
+
+class OpenWeatherMapProvider(WeatherProvider):
+    # Pooled session with strict timeouts and a TTL cache. Within the TTL
+    # the cached value is returned without a request; when a fetch fails
+    # the last good value is served (marked stale) for up to max_stale.
+    name = "openweathermap"
+    URL = "http://api.openweathermap.org/data/2.5/weather"
+
+    def __init__(self, api_key, location, ttl=120.0, max_stale=3600.0, timeout=(3.05, 5.0)):
+        self.api_key = api_key
+        self.location = location
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=2, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._cached = None
+        self._lock = threading.Lock()
+
+        # Statistics
+        self.fetches = 0
+        self.failures = 0
+        self.cache_hits = 0
+
+    def current(self):
+        with self._lock:
+            now = time.time()
+            if self._cached and now - self._cached["fetched_at"] < self.ttl:
+                self.cache_hits += 1
+                return dict(self._cached)
+
+            try:
+                self.fetches += 1
+                self._cached = self._fetch()
+                return dict(self._cached)
+            except Exception as e:
+                self.failures += 1
+                if self._cached and now - self._cached["fetched_at"] < self.max_stale:
+                    LOG.warning("Fetch failed, serving cached value: %s", e)
+                    return dict(self._cached, stale=True)
+                raise
+
+    def close(self):
+        self.session.close()
+
+    def _fetch(self):
+        res = self.session.get(
+            self.URL,
+            params={"q": self.location, "appid": self.api_key, "units": "metric"},
+            timeout=self.timeout
+        )
+        res.raise_for_status()
+        data = res.json()
+        return {
+            "temp": data["main"]["temp"],
+            "condition": data["weather"][0]["main"].lower(),
+            "fetched_at": time.time(),
+            "stale": False,
+        }
+
+class StubWeatherProvider(WeatherProvider):
+    # Offline provider for tests and benchmarks: cycles through a fixed list
+    # of (temp, condition) readings without touching the network.
+    name = "stub"
+
+    def __init__(self, readings=((22.0, "clear"), (18.0, "rain"), (20.0, "mist"))):
+        self._readings = itertools.cycle(list(readings))
+
+    def current(self):
+        temp, condition = next(self._readings)
+        return {"temp": temp, "condition": condition, "fetched_at": time.time(), "stale": False}
+
+def make_provider(kind, **options):
+    providers = {cls.name: cls for cls in (OpenWeatherMapProvider, StubWeatherProvider)}
+    if kind not in providers:
+        raise ValueError(f"Unknown weather provider: {kind}")
+    return providers[kind](**options)
@@ -0,0 +1,148 @@
+import logging
+import logging.handlers
+import queue
+import sys
+import time
+from metrics import counter
+
+# =============================================================================
+# BACKGROUND CATEGORY LOGGING
+# =============================================================================
+
+# Log lines are formatted and written by one listener thread. The calling
+# thread only checks the category's level (and sampling budget) and queues
+# the record with its arguments unformatted, so a disabled or sampled-out
+# message costs a comparison and an enabled one never waits on stdout.
+#
+#   LOG = get_logger("mqtt", rate=5)                   # at most 5 lines/s
+#   LOG.info("Published: %s to %s", payload, topic)    # %-formatted later
+#
+# Arguments are formatted after the call returns: pass values that are not
+# mutated afterwards (strings, numbers, freshly built dicts).
+
+LOG_FORMAT = "%(asctime)s %(levelname)s [%(name)s] %(message)s"
+LOG_QUEUE_SIZE = 10000  # Records waiting for the listener; newer ones are dropped beyond this
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    # SimpleQueue puts without taking a lock; the bound is checked
+    # approximately through qsize() instead
+    def __init__(self, log_queue, max_size):
+        super().__init__(log_queue)
+        self.max_size = max_size
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Formatting is left to the listener thread
+        return record
+
+    def enqueue(self, record):
+        if self.queue.qsize() >= self.max_size:
+            self.dropped += 1
+            return
+        self.queue.put_nowait(record)
+
+_HANDLER = None
+_LISTENER = None
+
+def configure_logging(level="INFO", levels=None, stream=None, fmt=LOG_FORMAT, queue_size=LOG_QUEUE_SIZE):
+    # level: default for every category; levels: category -> level
+    global _HANDLER, _LISTENER
+    # Records skip the caller lookup and the process/thread details the
+    # format does not use (the logging docs' "Optimization" settings)
+    logging._srcfile = None
+    logging.logThreads = False
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    for category, category_level in (levels or {}).items():
+        logging.getLogger(category).setLevel(category_level)
+    if _LISTENER is not None:
+        return  # Already running; levels above still apply
+
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(logging.Formatter(fmt))
+    _HANDLER = _QueueHandler(queue.SimpleQueue(), queue_size)
+    root.handlers[:] = [_HANDLER]
+    _LISTENER = logging.handlers.QueueListener(_HANDLER.queue, output)
+    _LISTENER.start()
+    counter("log_dropped_total", "Log records dropped because the log queue was full",
+            lambda: _HANDLER.dropped)
+
+def stop_logging():
+    # Writes out what is queued
+    global _LISTENER
+    if _LISTENER is not None:
+        _LISTENER.stop()
+        _LISTENER = None
+
+# =============================================================================
+# SAMPLED LOGGER
+# =============================================================================
+
+class SampledLogger:
+    # Thin wrapper over a logging.Logger. With rate set, debug/info/warning
+    # lines beyond rate per second are skipped and summarized once the
+    # second is over; errors are never sampled. The budget is not locked:
+    # concurrent callers may let a line or two more through.
+    def __init__(self, category, rate=None):
+        self.logger = logging.getLogger(category)
+        self.rate = rate
+        self._window = 0.0
+        self._count = 0
+        self._skipped = 0
+
+        # Statistics
+        self.suppressed = 0
+
+        if rate is not None:
+            counter("log_suppressed_total", "Log lines skipped by sampling",
+                    lambda: self.suppressed, category=category)
+
+    def debug(self, msg, *args):
+        if self.logger.isEnabledFor(logging.DEBUG) and self._take():
+            self.logger.debug(msg, *args)
+
+    def info(self, msg, *args):
+        if self.logger.isEnabledFor(logging.INFO) and self._take():
+            self.logger.info(msg, *args)
+
+    def warning(self, msg, *args):
+        if self.logger.isEnabledFor(logging.WARNING) and self._take():
+            self.logger.warning(msg, *args)
+
+    def error(self, msg, *args):
+        self.logger.error(msg, *args)
+
+    def exception(self, msg, *args):
+        self.logger.exception(msg, *args)
+
+    def enabled(self, level=logging.DEBUG):
+        # For callers that build an expensive argument only when it is logged
+        return self.logger.isEnabledFor(level)
+
+    def _take(self):
+        if self.rate is None:
+            return True
+        now = time.monotonic()
+        if now - self._window >= 1.0:
+            skipped, self._skipped = self._skipped, 0
+            self._window, self._count = now, 0
+            if skipped:
+                self.logger.info("%d lines skipped by sampling", skipped)
+        if self._count < self.rate:
+            self._count += 1
+            return True
+        self._skipped += 1
+        self.suppressed += 1
+        return False
+
+_LOGGERS = {}
+
+def get_logger(category, rate=None):
+    # Same category returns the same logger (its sampling budget is shared)
+    logger = _LOGGERS.get(category)
+    if logger is None:
+        logger = _LOGGERS[category] = SampledLogger(category, rate)
+    return logger
@@ -0,0 +1,206 @@
+import asyncio
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LOG = logging.getLogger("metrics")  # log.py imports this module, so no get_logger here
+
+# =============================================================================
+# STAGE METRICS
+# =============================================================================
+
+# Latency bucket upper bounds in seconds (50 µs .. 5 s); fixed so observing
+# a sample is one bisect and three additions
+DEFAULT_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+                   0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+METRIC_PREFIX = "smartroom"
+
+class Stage:
+    # Counters and a fixed-bucket latency histogram for one pipeline stage
+    # (e.g. "outside.mqtt_publish"). Time with observe(seconds) on hot paths
+    # or "with stage.time():" elsewhere.
+    def __init__(self, name, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.bounds = tuple(buckets)
+        self.buckets = [0] * (len(self.bounds) + 1)  # Last bucket is +Inf
+        self.count = 0
+        self.total = 0.0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        i = bisect_left(self.bounds, seconds)
+        with self._lock:
+            self.buckets[i] += 1
+            self.count += 1
+            self.total += seconds
+
+    def error(self):
+        with self._lock:
+            self.errors += 1
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.error()
+            raise
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def read(self):
+        with self._lock:
+            return list(self.buckets), self.count, self.total, self.errors
+
+class Registry:
+    def __init__(self, prefix=METRIC_PREFIX):
+        self.prefix = prefix
+        self._stages = {}
+        self._values = {}  # metric -> (type, help, [(labels, read), ...])
+        self._lock = threading.Lock()
+
+    def stage(self, name, buckets=DEFAULT_BUCKETS):
+        # Same name returns the same stage, so modules can share one
+        with self._lock:
+            stage = self._stages.get(name)
+            if stage is None:
+                stage = self._stages[name] = Stage(name, buckets)
+            return stage
+
+    def value(self, metric, kind, help_text, read, **labels):
+        # Gauge or counter read from read() at scrape time, so the owner
+        # keeps plain attributes and pays nothing per update
+        with self._lock:
+            entry = self._values.setdefault(metric, (kind, help_text, []))
+            entry[2].append((labels, read))
+
+    def render(self):
+        # Prometheus text exposition format
+        p = self.prefix
+        lines = [
+            f"# HELP {p}_stage_duration_seconds Time spent per call in each pipeline stage",
+            f"# TYPE {p}_stage_duration_seconds histogram",
+        ]
+        counts = []
+        with self._lock:
+            stages = sorted(self._stages.items())
+        for name, stage in stages:
+            buckets, count, total, errors = stage.read()
+            label = f'stage="{name}"'
+            cumulative = 0
+            for bound, n in zip(stage.bounds, buckets):
+                cumulative += n
+                lines.append(f'{p}_stage_duration_seconds_bucket{{{label},le="{bound:g}"}} {cumulative}')
+            lines.append(f'{p}_stage_duration_seconds_bucket{{{label},le="+Inf"}} {count}')
+            lines.append(f"{p}_stage_duration_seconds_sum{{{label}}} {total:.9f}")
+            lines.append(f"{p}_stage_duration_seconds_count{{{label}}} {count}")
+            counts.append((label, count, errors))
+
+        lines.append(f"# HELP {p}_stage_calls_total Calls handled by each pipeline stage")
+        lines.append(f"# TYPE {p}_stage_calls_total counter")
+        lines.extend(f"{p}_stage_calls_total{{{label}}} {count}" for label, count, _ in counts)
+        lines.append(f"# HELP {p}_stage_errors_total Calls that raised in each pipeline stage")
+        lines.append(f"# TYPE {p}_stage_errors_total counter")
+        lines.extend(f"{p}_stage_errors_total{{{label}}} {errors}" for label, _, errors in counts)
+
+        with self._lock:
+            values = sorted((metric, kind, help_text, list(series))
+                            for metric, (kind, help_text, series) in self._values.items())
+        for metric, kind, help_text, series in values:
+            lines.append(f"# HELP {p}_{metric} {help_text}")
+            lines.append(f"# TYPE {p}_{metric} {kind}")
+            for labels, read in series:
+                try:
+                    value = read()
+                except Exception:
+                    continue
+                label = ",".join(f'{k}="{v}"' for k, v in sorted(labels.items()))
+                lines.append(f"{p}_{metric}{{{label}}} {value:g}" if label else f"{p}_{metric} {value:g}")
+        return "\n".join(lines) + "\n"
+
+# Process-wide registry used by every module
+METRICS = Registry()
+
+def stage(name):
+    return METRICS.stage(name)
+
+def gauge(metric, help_text, read, **labels):
+    METRICS.value(metric, "gauge", help_text, read, **labels)
+
+def counter(metric, help_text, read, **labels):
+    METRICS.value(metric, "counter", help_text, read, **labels)
+
+# =============================================================================
+# HTTP ENDPOINT
+# =============================================================================
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = METRICS
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Scrapes every few seconds would flood the console
+
+def start_metrics_server(host="127.0.0.1", port=9100, registry=METRICS):
+    # Serves GET /metrics from a daemon thread; port 0 or None disables it
+    if not port:
+        return None
+    handler = type("MetricsHandler", (_MetricsHandler,), {"registry": registry})
+    try:
+        server = ThreadingHTTPServer((host, port), handler)
+    except OSError as e:
+        LOG.error("Metrics endpoint on %s:%s failed: %s", host, port, e)
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    LOG.info("Metrics at http://%s:%s/metrics", host, port)
+    return server
+
+async def serve_metrics(host="127.0.0.1", port=9100, registry=METRICS):
+    # start_metrics_server() for asyncio programs: scrapes are answered on
+    # the running loop instead of a server thread. Returns the
+    # asyncio.Server (close() it on shutdown); port 0 or None disables it
+    if not port:
+        return None
+
+    async def handle(reader, writer):
+        try:
+            request = (await reader.readline()).decode("latin-1").split()
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass  # Headers are not needed
+            if len(request) >= 2 and request[0] == "GET" and request[1].split('?')[0] in ("/", "/metrics"):
+                status, body = "200 OK", registry.render().encode()
+            else:
+                status, body = "404 Not Found", b"Not Found\n"
+            writer.write(f"HTTP/1.1 {status}\r\n"
+                         f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                         f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    try:
+        server = await asyncio.start_server(handle, host, port)
+    except OSError as e:
+        LOG.error("Metrics endpoint on %s:%s failed: %s", host, port, e)
+        return None
+    LOG.info("Metrics at http://%s:%s/metrics", host, port)
+    return server
@@ -0,0 +1,117 @@
+import asyncio
+import threading
+import paho.mqtt.client as mqtt
+from log import get_logger
+
+LOG = get_logger("mqtt")
+
+# =============================================================================
+# PAHO CLIENT ON AN ASYNCIO LOOP
+# =============================================================================
+
+MISC_INTERVAL = 2.0    # Seconds between keepalive checks (loop_misc)
+RECONNECT_MIN = 1.0    # Reconnect backoff in seconds, doubling up to RECONNECT_MAX
+RECONNECT_MAX = 30.0
+
+class MQTTLoop:
+    # Runs a paho client on an asyncio event loop instead of loop_start()'s
+    # network thread, through paho's socket callbacks: the socket is watched
+    # with add_reader/add_writer, keepalives run on a timer and a lost
+    # connection is retried with backoff. The client's callbacks
+    # (on_message, on_publish, ...) run on the loop. The blocking part of
+    # connecting (DNS, TCP handshake) runs in the loop's default executor.
+    def __init__(self, client, loop, name="MQTT"):
+        self.client = client
+        self.loop = loop
+        self.name = name
+        self._loop_thread = None
+        self._misc = None
+        self._retry = None
+        self._delay = RECONNECT_MIN
+        self._stopping = False
+        self._closed = asyncio.Event()
+
+        client.on_socket_open = self._on_socket_open
+        client.on_socket_close = self._on_socket_close
+        client.on_socket_register_write = self._on_socket_register_write
+        client.on_socket_unregister_write = self._on_socket_unregister_write
+
+    async def connect(self, host, port=1883, keepalive=60):
+        # Raises like client.connect() if the first attempt fails
+        self._loop_thread = threading.get_ident()
+        self.client.connect_async(host, port, keepalive)
+        await self.loop.run_in_executor(None, self.client.reconnect)
+
+    async def disconnect(self, timeout=1.0):
+        # Sends DISCONNECT and waits for the socket to close
+        self._stopping = True
+        if self._retry is not None:
+            self._retry.cancel()
+        if self.client.socket() is None:
+            return
+        self._closed.clear()
+        self.client.disconnect()
+        try:
+            await asyncio.wait_for(self._closed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def is_connected(self):
+        return self.client.is_connected()
+
+    # ---------- socket callbacks ----------
+
+    def _call(self, fn, *args):
+        # Called from the loop, or from the executor while reconnecting
+        if threading.get_ident() == self._loop_thread:
+            fn(*args)
+        else:
+            self.loop.call_soon_threadsafe(fn, *args)
+
+    def _on_socket_open(self, client, userdata, sock):
+        self._call(self._opened, sock)
+
+    def _on_socket_close(self, client, userdata, sock):
+        # Paho closes the socket as soon as this returns; always on the loop
+        self.loop.remove_reader(sock)
+        self.loop.remove_writer(sock)
+        if self._misc is not None:
+            self._misc.cancel()
+            self._misc = None
+        self._closed.set()
+        if not self._stopping:
+            self._schedule_reconnect()
+
+    def _on_socket_register_write(self, client, userdata, sock):
+        self._call(self.loop.add_writer, sock, client.loop_write)
+
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        self._call(self.loop.remove_writer, sock)
+
+    def _opened(self, sock):
+        self._delay = RECONNECT_MIN
+        self.loop.add_reader(sock, self.client.loop_read)
+        self._misc = self.loop.call_later(MISC_INTERVAL, self._keepalive)
+
+    def _keepalive(self):
+        self._misc = None
+        if self.client.loop_misc() == mqtt.MQTT_ERR_SUCCESS and self.client.socket() is not None:
+            self._misc = self.loop.call_later(MISC_INTERVAL, self._keepalive)
+
+    # ---------- reconnect ----------
+
+    def _schedule_reconnect(self):
+        LOG.warning("%s: connection lost, reconnecting in %gs", self.name, self._delay)
+        self._retry = self.loop.call_later(self._delay, lambda: self.loop.create_task(self._reconnect()))
+        self._delay = min(self._delay * 2, RECONNECT_MAX)
+
+    async def _reconnect(self):
+        self._retry = None
+        if self._stopping:
+            return
+        try:
+            await self.loop.run_in_executor(None, self.client.reconnect)
+        except Exception as e:
+            LOG.error("%s reconnect failed: %s", self.name, e)
+            if not self._stopping:
+                self._schedule_reconnect()
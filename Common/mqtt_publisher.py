@@ -0,0 +1,323 @@
+import asyncio
+import threading
+import time
+from collections import deque
+import paho.mqtt.client as mqtt
+from log import get_logger
+from metrics import counter, gauge, stage
+
+LOG = get_logger("mqtt")
+
+# =============================================================================
+# BOUNDED MQTT PUBLISHER
+# =============================================================================
+
+# What publish() does when the outbound queue is full:
+#   drop_oldest  the oldest queued drop_oldest message makes room, so a new
+#                reading replaces a stale one (telemetry)
+#   block        the caller waits up to block_timeout for room, then fails
+#                (commands and their results). Never waits on the client's
+#                own network thread, which is what frees the room
+#   fail         publish() fails straight away (spooled edge data, which
+#                then goes to the spool instead)
+OVERFLOW_POLICIES = ("drop_oldest", "block", "fail")
+
+DROP_REASONS = ("overflow", "rejected", "expired", "error")
+
+REJECT_LOG_INTERVAL = 10.0  # Seconds between "queue full" lines (every rejection is counted)
+
+class PublishHandle:
+    # Stands in for paho's MQTTMessageInfo. rc is MQTT_ERR_SUCCESS once the
+    # message is queued (MQTT_ERR_QUEUE_SIZE if it was refused);
+    # wait_for_publish() and is_published() follow it to the broker's
+    # PUBACK, or to the socket for QoS 0.
+    def __init__(self, topic, payload, qos, overflow):
+        self.topic = topic
+        self.payload = payload
+        self.qos = qos
+        self.overflow = overflow
+        self.rc = mqtt.MQTT_ERR_SUCCESS
+        self.mid = None
+        self._done = threading.Event()
+        self._published = False
+
+    def wait_for_publish(self, timeout=None):
+        self._done.wait(timeout)
+
+    def is_published(self):
+        return self._published
+
+    def _finish(self, published):
+        self._published = published
+        self._done.set()
+
+class BoundedPublisher:
+    # Every outgoing message of one client goes through a bounded queue. A
+    # sender thread (or, with start(loop), the asyncio loop running the
+    # client) hands messages to paho only while fewer than
+    # max_inflight are waiting for their PUBACK (QoS 1/2) or socket write
+    # (QoS 0), so paho's own unbounded queue stays short however slow the
+    # network gets; backlog builds up here, where the overflow policy
+    # decides what to give up.
+    #
+    # policies: {topic filter: (qos, overflow)}; the first filter matching
+    # a topic applies, otherwise default. Owns the client's on_publish.
+    def __init__(self, client, policies, default=(0, "drop_oldest"), max_queue=1000, max_inflight=20,
+                 block_timeout=2.0, ack_timeout=30.0, name="MQTT"):
+        for _, overflow in [default, *policies.values()]:
+            if overflow not in OVERFLOW_POLICIES:
+                raise ValueError(f"unknown overflow policy {overflow!r}")
+        self.client = client
+        self.policies = dict(policies)
+        self.default = default
+        self.max_queue = max_queue
+        self.max_inflight = max_inflight
+        self.block_timeout = block_timeout
+        self.ack_timeout = ack_timeout
+        self.name = name
+
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._inflight = {}    # mid -> (handle, sent at)
+        self._early = {}       # mid -> time acknowledged before publish() returned
+        self._acks = threading.Lock()  # Never held while calling into paho
+        self._topic_policy = {}
+        self._network_thread = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._loop = None
+        self._pump_handle = None  # Next _pump() call (loop mode)
+        self._pump_armed = False
+        self._rejected_logged = 0    # dropped["rejected"] at the last "queue full" line
+        self._reject_logged_at = None
+
+        # Statistics
+        self.queued = 0
+        self.published = {0: 0, 1: 0, 2: 0}
+        self.dropped = dict.fromkeys(DROP_REASONS, 0)
+
+        client.on_publish = self._on_publish
+        client.max_inflight_messages_set(max_inflight)
+
+        label = name.lower().replace(" ", ".")
+        self._ack_stage = stage(f"{label}.puback")
+        gauge("mqtt_queue_depth", "Messages waiting in the outbound MQTT queue",
+              lambda: len(self._queue), publisher=label)
+        gauge("mqtt_inflight_messages", "Messages handed to the client and not yet acknowledged",
+              lambda: len(self._inflight), publisher=label)
+        for qos in self.published:
+            counter("mqtt_published_total", "Messages acknowledged (QoS 0: written to the socket)",
+                    lambda qos=qos: self.published[qos], publisher=label, qos=str(qos))
+        for reason in DROP_REASONS:
+            counter("mqtt_dropped_total", "Outbound messages given up",
+                    lambda reason=reason: self.dropped[reason], publisher=label, reason=reason)
+
+    def start(self, loop=None):
+        # loop: the asyncio loop the client runs on (mqtt_asyncio.MQTTLoop);
+        # messages are then sent from loop callbacks instead of a thread.
+        # Call from the loop's thread
+        if loop is not None:
+            self._loop = loop
+            self._network_thread = threading.get_ident()
+            self._wake()
+            return self
+        self._thread = threading.Thread(target=self._run, name=f"{self.name}-sender", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=2.0):
+        # Gives queued and in-flight messages a moment to go out (loop
+        # mode: await drain() first, this does not wait)
+        if self._loop is None:
+            deadline = time.monotonic() + timeout
+            while (self._queue or self._inflight) and self.client.is_connected() and time.monotonic() < deadline:
+                time.sleep(0.05)
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+        if self._pump_handle is not None:
+            self._pump_handle.cancel()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    async def drain(self, timeout=2.0):
+        # Loop mode: waits until queued and in-flight messages are out
+        deadline = time.monotonic() + timeout
+        while (self._queue or self._inflight) and self.client.is_connected() and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+
+    def is_connected(self):
+        return self.client.is_connected()
+
+    def policy(self, topic):
+        policy = self._topic_policy.get(topic)
+        if policy is None:
+            policy = next((policy for topic_filter, policy in self.policies.items()
+                           if mqtt.topic_matches_sub(topic_filter, topic)), self.default)
+            self._topic_policy[topic] = policy
+        return policy
+
+    def publish(self, topic, payload, qos=None):
+        # qos overrides the topic's QoS (the spool replays at the QoS it stored)
+        policy_qos, overflow = self.policy(topic)
+        handle = PublishHandle(topic, payload, policy_qos if qos is None else qos, overflow)
+        log = 0
+        with self._cond:
+            if len(self._queue) >= self.max_queue and not self._make_room(handle):
+                handle.rc = mqtt.MQTT_ERR_QUEUE_SIZE
+                self._drop(handle, "overflow" if overflow == "drop_oldest" else "rejected")
+                if overflow != "drop_oldest":
+                    log = self._reject_log_due()
+            else:
+                self._queue.append(handle)
+                self.queued += 1
+                self._cond.notify_all()
+        if handle.rc != mqtt.MQTT_ERR_SUCCESS:
+            # Outside the lock, and at most once per REJECT_LOG_INTERVAL
+            if log:
+                LOG.warning("%s: queue full, %d messages not sent (last: %s)", self.name, log, topic)
+            return handle
+        if self._loop is not None:
+            self._wake()
+        return handle
+
+    # ---------- queue ----------
+
+    def _make_room(self, handle):
+        # Called with _cond held and the queue full
+        if handle.overflow == "drop_oldest":
+            for old in self._queue:
+                if old.overflow == "drop_oldest":
+                    self._queue.remove(old)
+                    self._drop(old, "overflow")
+                    return True
+            return False
+        if handle.overflow == "block" and threading.get_ident() != self._network_thread:
+            deadline = time.monotonic() + self.block_timeout
+            while len(self._queue) >= self.max_queue:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self._stop.is_set():
+                    return False
+                self._cond.wait(remaining)
+            return True
+        return False
+
+    def _reject_log_due(self):
+        # Called with _cond held; the number of rejections to report, or 0
+        # within REJECT_LOG_INTERVAL of the last line
+        now = time.monotonic()
+        if self._reject_logged_at is not None and now - self._reject_logged_at < REJECT_LOG_INTERVAL:
+            return 0
+        count = self.dropped["rejected"] - self._rejected_logged
+        self._rejected_logged = self.dropped["rejected"]
+        self._reject_logged_at = now
+        return count
+
+    def _drop(self, handle, reason):
+        self.dropped[reason] += 1
+        handle._finish(False)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stop.is_set() and not (
+                        self._queue and self.client.is_connected() and len(self._inflight) < self.max_inflight):
+                    # Nothing signals a (re)connect, so poll briskly while a backlog waits for one
+                    self._cond.wait(0.05 if self._queue and not self.client.is_connected() else 0.5)
+                    self._expire()
+                if self._stop.is_set():
+                    return
+                handle = self._queue.popleft()
+                self._cond.notify_all()  # Room for blocked publishers
+            self._send(handle)
+
+    def _wake(self):
+        # Loop mode: one _pump() per loop iteration however many messages
+        # were queued in it. Thread-safe
+        if not self._pump_armed:
+            self._pump_armed = True
+            self._loop.call_soon_threadsafe(self._pump)
+
+    def _pump(self):
+        # Loop mode counterpart of _run()
+        self._pump_armed = False
+        if self._pump_handle is not None:
+            self._pump_handle.cancel()
+            self._pump_handle = None
+        if self._stop.is_set():
+            return
+        self._expire()
+        while self._queue and self.client.is_connected() and len(self._inflight) < self.max_inflight:
+            with self._cond:
+                handle = self._queue.popleft()
+                self._cond.notify_all()  # Room for publishers blocked in other threads
+            self._send(handle)
+            if self._queue and self._queue[0] is handle:
+                break  # Put back: disconnected since the check
+        if self._queue or self._inflight:
+            # Nothing signals a (re)connect or a lost acknowledgement, so
+            # check again: briskly while a backlog waits for a connection
+            delay = 0.05 if self._queue and not self.client.is_connected() else 0.5
+            self._pump_handle = self._loop.call_later(delay, self._pump)
+
+    def _send(self, handle):
+        sent_at = time.perf_counter()
+        try:
+            info = self.client.publish(handle.topic, handle.payload, handle.qos)
+        except Exception as e:
+            LOG.error("%s publish %s: %s", self.name, handle.topic, e)
+            self._drop(handle, "error")
+            return
+
+        if info.rc == mqtt.MQTT_ERR_NO_CONN and handle.qos == 0:
+            # Disconnected since the check; paho keeps only QoS > 0 messages
+            with self._cond:
+                self._queue.appendleft(handle)
+            return
+        if info.rc not in (mqtt.MQTT_ERR_SUCCESS, mqtt.MQTT_ERR_NO_CONN):
+            LOG.error("%s publish %s: %s", self.name, handle.topic, mqtt.error_string(info.rc))
+            self._drop(handle, "error")
+            return
+
+        with self._acks:
+            handle.mid = info.mid
+            acked_at = self._early.pop(info.mid, None)
+            if acked_at is None or acked_at < sent_at:  # Older: a reused mid
+                self._inflight[info.mid] = (handle, sent_at)
+                return
+        self._acked(handle, sent_at)
+
+    # ---------- acknowledgements ----------
+
+    def _on_publish(self, client, userdata, mid):
+        # Paho's network thread, with its message lock held
+        self._network_thread = threading.get_ident()
+        with self._acks:
+            entry = self._inflight.pop(mid, None)
+            if entry is None:
+                self._early[mid] = time.perf_counter()
+                return
+        self._acked(*entry)
+        with self._cond:
+            self._cond.notify_all()
+        if self._loop is not None and self._queue:
+            self._wake()
+
+    def _acked(self, handle, sent_at):
+        if handle.qos > 0:
+            self._ack_stage.observe(time.perf_counter() - sent_at)
+        self.published[handle.qos] += 1
+        handle._finish(True)
+
+    def _expire(self):
+        # Frees the window from acknowledgements that will not come (QoS 0
+        # messages lost with the connection, a broker that never answers)
+        cutoff = time.perf_counter() - self.ack_timeout
+        with self._acks:
+            expired = [mid for mid, (_, sent_at) in self._inflight.items() if sent_at < cutoff]
+            handles = [self._inflight.pop(mid)[0] for mid in expired]
+            for mid in [mid for mid, acked_at in self._early.items() if acked_at < cutoff]:
+                del self._early[mid]
+        for handle in handles:
+            self._ack_stage.error()
+            self._drop(handle, "expired")
@@ -0,0 +1,190 @@
+import json
+import struct
+import zlib
+from datetime import datetime, timedelta
+import paho.mqtt.client as mqtt
+from metrics import counter
+
+# =============================================================================
+# PAYLOAD CODECS
+# =============================================================================
+
+# Payloads on the edge/cloud topics are JSON by default. A binary payload
+# starts with a marker byte that can never begin JSON text, so a receiver
+# decodes whatever it is sent and plain JSON from older publishers keeps
+# working:
+#   0x81  struct   fixed schema per topic (TOPIC_SCHEMAS), then one byte
+#                  identifying the schema, then the packed fields
+#   0x82  msgpack  any payload (needs the msgpack package)
+#   0x83  cbor     any payload (needs the cbor2 package)
+# A message the struct schema cannot hold (extra or missing keys, a value
+# outside its range or enum) is sent as JSON instead.
+MARKER_STRUCT = 0x81
+MARKER_MSGPACK = 0x82
+MARKER_CBOR = 0x83
+
+CODECS = ("json", "struct", "msgpack", "cbor")
+
+# Field kinds: struct formats, "time" (naive ISO timestamp, stored as
+# microseconds), "str" (UTF-8, up to 65535 bytes) or a tuple of the
+# allowed strings (stored as their index)
+FIELD_FORMATS = {"u8": "B", "u16": "H", "i16": "h", "u32": "I", "i32": "i", "f32": "f", "f64": "d", "time": "q"}
+
+ON_OFF = ("off", "on")
+
+OUTSIDE_DATA_SCHEMA = [("timestamp", "time"), ("light", "i32"), ("sound", ("No", "Yes")), ("temperature", "i32")]
+INSIDE_DATA_SCHEMA = [("time", "time"), ("led", ON_OFF), ("fan", ON_OFF), ("door", ("close", "open")),
+                      ("mode", ("auto", "manual"))]
+OUTSIDE_STATUS_SCHEMA = [("sensors", ("inactive", "active"))]
+SUGGESTION_SCHEMA = [("message", "str"), ("temp", "f64"), ("weather condition", "str"), ("temp threshold", "f64")]
+
+# Topic filter -> schema; single-room and per-room (daemon) topics share one
+TOPIC_SCHEMAS = {
+    "edge/outside/data": OUTSIDE_DATA_SCHEMA,
+    "edge/+/outside/data": OUTSIDE_DATA_SCHEMA,
+    "edge/inside/data": INSIDE_DATA_SCHEMA,
+    "edge/+/inside/data": INSIDE_DATA_SCHEMA,
+    "edge/outside/status": OUTSIDE_STATUS_SCHEMA,
+    "edge/+/outside/status": OUTSIDE_STATUS_SCHEMA,
+    "cloud/suggestion": SUGGESTION_SCHEMA,
+    "cloud/+/suggestion": SUGGESTION_SCHEMA,
+}
+for _actuator, _values in (("led", ON_OFF), ("fan", ON_OFF), ("door", ("close", "open")), ("mode", ("auto", "manual"))):
+    TOPIC_SCHEMAS[f"cloud/control/{_actuator}"] = [(_actuator, _values), ("id", "u32")]
+    TOPIC_SCHEMAS[f"cloud/+/control/{_actuator}"] = [(_actuator, _values), ("id", "u32")]
+
+EPOCH = datetime(1970, 1, 1)
+STRING_LENGTH = struct.Struct("<H")
+
+def _time_to_us(value):
+    # Wall-clock time as given, no time zone conversion: decodes to the same text
+    delta = datetime.fromisoformat(value) - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+def _us_to_time(us):
+    return (EPOCH + timedelta(microseconds=us)).isoformat()
+
+class Schema:
+    # Packs one topic's payload dict: fixed-size fields with one struct,
+    # then the strings, each with a 2-byte length
+    def __init__(self, fields):
+        self.names = [name for name, _ in fields]
+        self.keys = frozenset(self.names)
+        self.tag = zlib.crc32(repr(fields).encode()) & 0xFF  # Catches publishers with another schema
+        self.fixed = []    # (name, to packed, from packed)
+        self.strings = []
+        fmt = "<"
+        for name, kind in fields:
+            if kind == "str":
+                self.strings.append(name)
+            elif isinstance(kind, tuple):
+                index = {value: i for i, value in enumerate(kind)}
+                self.fixed.append((name, index.__getitem__, kind.__getitem__))
+                fmt += "B"
+            elif kind == "time":
+                self.fixed.append((name, _time_to_us, _us_to_time))
+                fmt += "q"
+            else:
+                self.fixed.append((name, None, None))
+                fmt += FIELD_FORMATS[kind]
+        self.layout = struct.Struct(fmt)
+
+    def encode(self, obj):
+        # Raises (KeyError, ValueError, TypeError, struct.error) if obj does not fit
+        if obj.keys() != self.keys:
+            raise KeyError("keys do not match the schema")
+        parts = [bytes((MARKER_STRUCT, self.tag)),
+                 self.layout.pack(*[obj[name] if to is None else to(obj[name]) for name, to, _ in self.fixed])]
+        for name in self.strings:
+            data = obj[name].encode()
+            parts.append(STRING_LENGTH.pack(len(data)))
+            parts.append(data)
+        return b"".join(parts)
+
+    def decode(self, raw):
+        if raw[1] != self.tag:
+            raise ValueError("payload was packed with a different schema")
+        obj = {}
+        for (name, _, back), value in zip(self.fixed, self.layout.unpack_from(raw, 2)):
+            obj[name] = value if back is None else back(value)
+        pos = 2 + self.layout.size
+        for name in self.strings:
+            (length,) = STRING_LENGTH.unpack_from(raw, pos)
+            pos += STRING_LENGTH.size
+            obj[name] = bytes(raw[pos:pos + length]).decode()
+            pos += length
+        if pos != len(raw):
+            raise ValueError("payload length does not match the schema")
+        # Same key order as the JSON the publisher would have sent
+        return {name: obj[name] for name in self.names}
+
+class PayloadCodec:
+    # encode(topic, obj) with the configured codec; decode(topic, raw)
+    # accepts every codec. JSON is returned as str, the rest as bytes.
+    # msgpack and cbor2 are imported on first use only.
+    def __init__(self, codec="json", schemas=TOPIC_SCHEMAS, name="Payload"):
+        if codec not in CODECS:
+            raise ValueError(f"unknown payload codec {codec!r}")
+        self.codec = codec
+        self.schemas = {topic_filter: Schema(fields) for topic_filter, fields in schemas.items()}
+        self.name = name
+        self._topic_schema = {}
+        self._msgpack = None
+        self._cbor = None
+
+        # Statistics
+        self.fallbacks = 0
+
+        if codec == "struct":
+            counter("payload_json_fallback_total", "Messages sent as JSON because they did not fit the topic schema",
+                    lambda: self.fallbacks, codec=name.lower().replace(" ", "."))
+
+    def schema(self, topic):
+        schema = self._topic_schema.get(topic, False)
+        if schema is False:
+            schema = next((schema for topic_filter, schema in self.schemas.items()
+                           if mqtt.topic_matches_sub(topic_filter, topic)), None)
+            self._topic_schema[topic] = schema
+        return schema
+
+    def encode(self, topic, obj):
+        if self.codec == "struct":
+            schema = self.schema(topic)
+            if schema is not None:
+                try:
+                    return schema.encode(obj)
+                except (KeyError, ValueError, TypeError, AttributeError, struct.error):
+                    self.fallbacks += 1
+        elif self.codec == "msgpack":
+            return bytes((MARKER_MSGPACK,)) + self.msgpack().packb(obj)
+        elif self.codec == "cbor":
+            return bytes((MARKER_CBOR,)) + self.cbor().dumps(obj)
+        return json.dumps(obj)
+
+    def decode(self, topic, raw):
+        # raw: bytes from paho, or str
+        if isinstance(raw, str):
+            return json.loads(raw)
+        marker = raw[0] if raw else 0
+        if marker == MARKER_STRUCT:
+            schema = self.schema(topic)
+            if schema is None:
+                raise ValueError(f"no payload schema for {topic}")
+            return schema.decode(raw)
+        if marker == MARKER_MSGPACK:
+            return self.msgpack().unpackb(raw[1:])
+        if marker == MARKER_CBOR:
+            return self.cbor().loads(raw[1:])
+        return json.loads(raw)
+
+    def msgpack(self):
+        if self._msgpack is None:
+            import msgpack
+            self._msgpack = msgpack
+        return self._msgpack
+
+    def cbor(self):
+        if self._cbor is None:
+            import cbor2
+            self._cbor = cbor2
+        return self._cbor
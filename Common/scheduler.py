@@ -0,0 +1,190 @@
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+from datetime import datetime, timedelta
+from log import get_logger
+
+LOG = get_logger("scheduler")
+
+# =============================================================================
+# TIMER-BASED SCHEDULING
+# =============================================================================
+
+# Periodic, daily and one-shot jobs on timers instead of sleep-and-poll
+# loops: nothing wakes up until the next job is due. Due times are
+# wall-clock seconds; waits longer than CLOCK_RECHECK are cut short and
+# re-armed, so daily jobs follow a clock that is corrected after boot
+# (boards without an RTC until NTP answers).
+CLOCK_RECHECK = 300.0
+
+def next_daily(at, now=None):
+    # Epoch seconds of the next local "HH:MM"
+    hour, minute = map(int, at.split(":"))
+    now = now or datetime.now()
+    due = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if due <= now:
+        due += timedelta(days=1)
+    return due.timestamp()
+
+class Job:
+    # interval: seconds between runs; at: daily "HH:MM"; neither: run once
+    def __init__(self, fn, due, interval=None, at=None):
+        self.fn = fn
+        self.due = due
+        self.interval = interval
+        self.at = at
+        self.name = getattr(fn, "__qualname__", repr(fn))
+        self.cancelled = False
+        self.handle = None  # Timer handle (AsyncScheduler)
+
+        # Statistics
+        self.runs = 0
+        self.errors = 0
+
+    def cancel(self):
+        self.cancelled = True
+        if self.handle is not None:
+            self.handle.cancel()
+
+    def reschedule(self, now):
+        # False for one-shot jobs. Periodic jobs keep their phase; a run
+        # that overran skips the missed slots instead of catching up
+        if self.at is not None:
+            self.due = next_daily(self.at)
+        elif self.interval is not None:
+            self.due += self.interval
+            if self.due <= now:
+                self.due = now + self.interval
+        else:
+            return False
+        return True
+
+class _Scheduler:
+    def __init__(self, name):
+        self.name = name
+
+    def every(self, interval, fn, first=None):
+        # first: seconds until the first run (default: one interval)
+        return self._add(Job(fn, time.time() + (interval if first is None else first), interval=interval))
+
+    def daily(self, at, fn):
+        return self._add(Job(fn, next_daily(at), at=at))
+
+    def call_later(self, delay, fn):
+        return self._add(Job(fn, time.time() + delay))
+
+    def _execute(self, job):
+        job.runs += 1
+        try:
+            return job.fn()
+        except Exception as e:
+            job.errors += 1
+            LOG.error("%s job %s: %s", self.name, job.name, e)
+
+class TimerScheduler(_Scheduler):
+    # Jobs run one after another on the scheduler's own thread, which
+    # sleeps on a condition until the earliest one is due
+    def __init__(self, name="Scheduler"):
+        super().__init__(name)
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=5.0):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+    def _add(self, job):
+        with self._cond:
+            heapq.heappush(self._heap, (job.due, next(self._seq), job))
+            self._cond.notify()
+        return job
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._stopped:
+                        return
+                    now = time.time()
+                    if self._heap and self._heap[0][0] <= now:
+                        _, _, job = heapq.heappop(self._heap)
+                        break
+                    self._cond.wait(min(self._heap[0][0] - now, CLOCK_RECHECK) if self._heap else None)
+            if job.cancelled:
+                continue
+            self._execute(job)
+            if not job.cancelled and job.reschedule(time.time()):
+                self._add(job)
+
+class AsyncScheduler(_Scheduler):
+    # Jobs are loop.call_later() timers and run on the event loop; a job
+    # returning a coroutine runs as a task. Jobs may be added from other
+    # threads. Create it on the loop's thread.
+    def __init__(self, loop=None, name="Scheduler"):
+        super().__init__(name)
+        self.loop = loop or asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._jobs = set()
+        self._tasks = set()
+
+    def stop(self):
+        # Cancels every job and running task; call from the loop
+        for job in list(self._jobs):
+            job.cancel()
+        for task in list(self._tasks):
+            task.cancel()
+        self._jobs.clear()
+
+    def _add(self, job):
+        if threading.get_ident() == self._loop_thread:
+            self._arm(job)
+        else:
+            self.loop.call_soon_threadsafe(self._arm, job)
+        return job
+
+    def _arm(self, job):
+        if job.cancelled:
+            return
+        self._jobs.add(job)
+        delay = min(max(job.due - time.time(), 0.0), CLOCK_RECHECK)
+        job.handle = self.loop.call_later(delay, self._fire, job)
+
+    def _fire(self, job):
+        job.handle = None
+        if job.cancelled:
+            self._jobs.discard(job)
+            return
+        now = time.time()
+        if now < job.due:
+            self._arm(job)  # Woke early for a clock recheck
+            return
+
+        result = self._execute(job)
+        if asyncio.iscoroutine(result):
+            task = self.loop.create_task(result)
+            self._tasks.add(task)
+            task.add_done_callback(lambda task, job=job: self._finished(job, task))
+
+        if not job.cancelled and job.reschedule(time.time()):
+            self._arm(job)
+        else:
+            self._jobs.discard(job)
+
+    def _finished(self, job, task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            job.errors += 1
+            LOG.error("%s job %s: %s", self.name, job.name, task.exception())
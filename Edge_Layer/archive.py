@@ -0,0 +1,227 @@
+import csv
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import date, datetime, timedelta
+from log import get_logger
+from metrics import counter, stage
+
+LOG = get_logger("archive")
+
+# =============================================================================
+# ARCHIVE INDEX
+# =============================================================================
+
+class ArchiveIndex:
+    # index.json in the archive directory: table -> day -> entry, e.g.
+    #   {"file": "logs/2025-06-01.csv.gz", "rows": 86400, "sha256": "...",
+    #    "deleted": false}
+    # Rewritten atomically after every day, so an interrupted run resumes
+    # at the first day that is not in it.
+    def __init__(self, directory):
+        self.path = os.path.join(directory, "index.json")
+        try:
+            with open(self.path) as f:
+                self.tables = json.load(f)
+        except FileNotFoundError:
+            self.tables = {}
+
+    def get(self, table, day):
+        return self.tables.get(table, {}).get(day.isoformat())
+
+    def put(self, table, day, entry):
+        self.tables.setdefault(table, {})[day.isoformat()] = entry
+        self.save()
+
+    def days(self, table):
+        return sorted(date.fromisoformat(day) for day in self.tables.get(table, {}))
+
+    def save(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.tables, f, indent=1, sort_keys=True)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+def file_digest(path):
+    # (sha256, data rows) of an archive file, read back in blocks
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    with gzip.open(path, "rt", newline="") as f:
+        rows = sum(1 for _ in csv.reader(f)) - 1  # Minus the header
+    return digest.hexdigest(), rows
+
+# =============================================================================
+# ARCHIVE JOB
+# =============================================================================
+
+class ArchiveJob:
+    # Exports every complete day of raw rows to <directory>/<table>/<day>.csv.gz.
+    # Rows are streamed with a server-side cursor and written chunk by
+    # chunk, so memory does not depend on the size of a day. Each file is
+    # written under a temporary name, read back and compared with the
+    # database's row count before it is recorded in the index.
+    #
+    # With delete_after_days set, days recorded longer ago than that are
+    # checked again (file digest and row count) and their rows deleted in
+    # bounded batches, pausing between batches like RetentionJob.
+    # tables: [(table, time_column), ...]
+    def __init__(self, pool, backend, tables, directory, chunk_rows=5000,
+                 delete_after_days=None, delete_chunk=1000, pause=0.1, name="Archive"):
+        self.pool = pool
+        self.backend = backend
+        self.tables = list(tables)
+        self.directory = directory
+        self.chunk_rows = chunk_rows
+        self.delete_after_days = delete_after_days
+        self.delete_chunk = delete_chunk
+        self.pause = pause
+        self.name = name
+        self._running = threading.Lock()
+
+        self.exported = {table: 0 for table, _ in self.tables}
+        self.deleted = {table: 0 for table, _ in self.tables}
+        self._stage = stage(name.lower().replace(" ", ".") + ".export_day")
+        for table, _ in self.tables:
+            counter("archive_rows_total", "Raw rows exported to the archive",
+                    lambda table=table: self.exported[table], table=table)
+            counter("archive_deleted_rows_total", "Archived raw rows deleted from the database",
+                    lambda table=table: self.deleted[table], table=table)
+
+    def run(self, today=None):
+        # Scheduled daily; a run still busy from the day before is not doubled up
+        if not self._running.acquire(blocking=False):
+            LOG.warning("%s: previous run still in progress", self.name)
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            index = ArchiveIndex(self.directory)
+            today = today or date.today()
+            for table, column in self.tables:
+                try:
+                    self.export_table(index, table, column, today)
+                    if self.delete_after_days is not None:
+                        self.delete_table(index, table, column, today - timedelta(days=self.delete_after_days))
+                except Exception as e:
+                    LOG.error("%s %s: %s", self.name, table, e)
+        finally:
+            self._running.release()
+
+    def export_table(self, index, table, column, today):
+        # Incremental: starts after the newest indexed day, or at the oldest row
+        done = index.days(table)
+        if done:
+            day = done[-1] + timedelta(days=1)
+        else:
+            with self.pool.connection() as conn:
+                cur = conn.cursor()
+                cur.execute(f"SELECT {column} FROM {table} ORDER BY {column} LIMIT 1")
+                row = cur.fetchone()
+                cur.close()
+            if row is None:
+                return
+            day = row[0].date()
+
+        while day < today:
+            rows = self.export_day(index, table, column, day)
+            if rows:
+                LOG.info("%s: %s %s: %d rows archived", self.name, table, day, rows)
+            day += timedelta(days=1)
+
+    def export_day(self, index, table, column, day):
+        start = datetime.combine(day, datetime.min.time())
+        end = start + timedelta(days=1)
+        relative = os.path.join(table, f"{day.isoformat()}.csv.gz")
+        path = os.path.join(self.directory, relative)
+        tmp = path + ".tmp"
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        with self._stage.time():
+            written = 0
+            with self.pool.connection() as conn:
+                cur = self.backend.stream_cursor(conn)
+                try:
+                    cur.execute(f"SELECT * FROM {table} WHERE {column} >= %s AND {column} < %s ORDER BY {column}",
+                                (start, end))
+                    with gzip.open(tmp, "wt", newline="", compresslevel=6) as f:
+                        writer = csv.writer(f)
+                        writer.writerow([d[0] for d in cur.description])
+                        while True:
+                            rows = cur.fetchmany(self.chunk_rows)
+                            if not rows:
+                                break
+                            writer.writerows(rows)
+                            written += len(rows)
+                finally:
+                    cur.close()
+                expected = self.count(conn, table, column, start, end)
+
+            # Verify before the day counts as archived
+            digest, rows = file_digest(tmp)
+            if rows != written or rows != expected:
+                os.remove(tmp)
+                raise RuntimeError(f"{day}: wrote {written} rows, file has {rows}, table has {expected}")
+
+            if rows:
+                os.replace(tmp, path)
+                index.put(table, day, {"file": relative, "rows": rows, "sha256": digest, "deleted": False})
+            else:
+                os.remove(tmp)
+                index.put(table, day, {"file": None, "rows": 0, "sha256": None, "deleted": True})
+            self.exported[table] += rows
+        return rows
+
+    def delete_table(self, index, table, column, before):
+        for day in index.days(table):
+            if day >= before:
+                break
+            entry = index.get(table, day)
+            if entry["deleted"]:
+                continue
+
+            start = datetime.combine(day, datetime.min.time())
+            end = start + timedelta(days=1)
+            with self.pool.connection() as conn:
+                rows_now = self.count(conn, table, column, start, end)
+            digest, rows = file_digest(os.path.join(self.directory, entry["file"]))
+            if digest != entry["sha256"] or rows != entry["rows"]:
+                LOG.error("%s %s %s: archive file does not match the index; rows kept", self.name, table, day)
+                continue
+            if rows_now > rows:
+                # Rows arrived after the export: archive the day again first
+                rows = self.export_day(index, table, column, day)
+                if rows != rows_now:
+                    continue
+
+            deleted = self.delete_range(table, column, start, end)
+            self.deleted[table] += deleted
+            index.put(table, day, dict(index.get(table, day), deleted=True))
+            LOG.info("%s: %s %s: %d archived rows deleted", self.name, table, day, deleted)
+
+    def delete_range(self, table, column, start, end):
+        deleted = 0
+        sql = self.backend.delete_range(table, column)
+        while True:
+            with self.pool.connection() as conn:
+                cur = conn.cursor()
+                cur.execute(sql, (start, end, self.delete_chunk))
+                count = cur.rowcount
+                conn.commit()
+                cur.close()
+            deleted += count
+            if count < self.delete_chunk:
+                return deleted
+            time.sleep(self.pause)
+
+    def count(self, conn, table, column, start, end):
+        cur = conn.cursor()
+        cur.execute(f"SELECT COUNT(*) FROM {table} WHERE {column} >= %s AND {column} < %s", (start, end))
+        (rows,) = cur.fetchone()
+        cur.close()
+        return int(rows)
@@ -0,0 +1,135 @@
+import threading
+import time
+from log import get_logger
+from metrics import counter, stage
+
+LOG = get_logger("commands")
+
+# =============================================================================
+# COALESCING COMMAND QUEUE
+# =============================================================================
+
+# Arduino command IDs stay below 2^31 so the sketch's String.toInt() can parse them
+MAX_SEQUENCE = 0x7FFFFFFF
+
+class CommandQueue:
+    # Last-writer-wins path from control messages to one Arduino. Each
+    # actuator has at most one command on the serial line waiting for the
+    # sketch's ACK and at most one waiting behind it; a newer command for
+    # the same actuator replaces the waiting one, whose sender is told it
+    # was superseded. Commands carry an edge-local sequence number
+    # ("led:on;id:17") so the ACK can be matched; the caller's command ID
+    # is opaque and only handed back through respond(command_id, result).
+    def __init__(self, send, respond, ack_timeout=2.0, name="Commands"):
+        self.send = send
+        self.respond = respond
+        self.ack_timeout = ack_timeout
+        self.name = name
+
+        self._lock = threading.Lock()
+        self._inflight = {}  # actuator -> (sequence, command_id, value, received_at, sent_at)
+        self._waiting = {}   # actuator -> (command_id, value, received_at)
+        self._sequences = {} # sequence -> actuator
+        self._sequence = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+        # Statistics
+        self.results = {"ok": 0, "superseded": 0, "timeout": 0}
+
+        label = name.lower().replace(" ", ".")
+        self._stage = stage(label + ".ack")
+        for result in self.results:
+            counter("commands_total", "Commands by outcome at the edge",
+                    lambda result=result: self.results[result], queue=label, result=result)
+
+    def start(self):
+        # Only needed by threaded callers; the edge daemon calls expire() itself
+        self._thread = threading.Thread(target=self._run, name=f"{self.name}-timeouts", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=2.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def submit(self, actuator, value, command_id=None):
+        now = time.perf_counter()
+        replies = []
+        with self._lock:
+            if actuator in self._inflight:
+                replaced = self._waiting.get(actuator)
+                self._waiting[actuator] = (command_id, value, now)
+                if replaced is not None:
+                    replies.append((replaced[0], self._result("superseded", actuator, replaced[1])))
+            else:
+                self._send_locked(actuator, command_id, value, now)
+        self._reply(replies)
+
+    def ack(self, sequence, state):
+        # state: actuator states reported by the sketch after applying the command
+        now = time.perf_counter()
+        replies = []
+        with self._lock:
+            actuator = self._sequences.pop(sequence, None)
+            if actuator is None:
+                return  # Unknown or already timed out
+            _, command_id, value, received_at, _ = self._inflight.pop(actuator)
+            latency = now - received_at
+            self._stage.observe(latency)
+            replies.append((command_id, self._result("ok", actuator, value, state, latency)))
+            self._send_waiting_locked(actuator, now)
+        self._reply(replies)
+
+    def expire(self):
+        # Gives up on commands the sketch never acknowledged
+        now = time.perf_counter()
+        replies = []
+        with self._lock:
+            for actuator, (sequence, command_id, value, received_at, sent_at) in list(self._inflight.items()):
+                if now - sent_at < self.ack_timeout:
+                    continue
+                del self._inflight[actuator]
+                self._sequences.pop(sequence, None)
+                self._stage.error()
+                replies.append((command_id, self._result("timeout", actuator, value)))
+                self._send_waiting_locked(actuator, now)
+        self._reply(replies)
+
+    def _send_locked(self, actuator, command_id, value, received_at):
+        # Sent under the lock so lines reach the sketch in decision order
+        self._sequence = self._sequence % MAX_SEQUENCE + 1
+        sequence = self._sequence
+        self._inflight[actuator] = (sequence, command_id, value, received_at, time.perf_counter())
+        self._sequences[sequence] = actuator
+        self.send(f"{actuator}:{value};id:{sequence}")
+
+    def _send_waiting_locked(self, actuator, now):
+        waiting = self._waiting.pop(actuator, None)
+        if waiting is not None:
+            command_id, value, received_at = waiting
+            self._send_locked(actuator, command_id, value, received_at)
+
+    def _result(self, status, actuator, value, state=None, latency=None):
+        self.results[status] += 1
+        result = {"status": status, "actuator": actuator, "value": value}
+        if state is not None:
+            result["state"] = state
+        if latency is not None:
+            result["latency_ms"] = round(latency * 1000, 1)
+        return result
+
+    def _reply(self, replies):
+        # Outside the lock: respond() publishes over MQTT
+        for command_id, result in replies:
+            if command_id is None:
+                continue
+            try:
+                self.respond(command_id, result)
+            except Exception as e:
+                LOG.error("%s respond failed: %s", self.name, e)
+
+    def _run(self):
+        while not self._stop.wait(min(0.25, self.ack_timeout / 4)):
+            self.expire()
@@ -0,0 +1,112 @@
+import threading
+import time
+from datetime import date, timedelta
+
+# =============================================================================
+# INCREMENTAL DAILY SUMMARY
+# =============================================================================
+
+class DailySummary:
+    # Per-day counters updated as each reading is ingested. Dirty days are
+    # checkpointed to a small summary table (one row per day) through the
+    # batched DB writer, so reports read O(days) rows instead of scanning
+    # the raw logs table. scope holds fixed key columns (e.g. {"room": "lab"})
+    # when several summaries share one table.
+    #
+    # A checkpoint adds the increments since the previous one to the stored
+    # row (col = col + delta), so nothing is lost when load() failed at
+    # startup and counting restarted from zero.
+    def __init__(self, writer, table, counters, checkpoint_interval=60.0, keep_days=2, scope=None):
+        self.writer = writer
+        self.table = table
+        self.counters = list(counters)
+        self.checkpoint_interval = checkpoint_interval
+        self.keep_days = keep_days
+        self.scope = dict(scope or {})
+        self._scope_values = tuple(self.scope.values())
+        self._scope_sql = "".join(f" AND {c} = %s" for c in self.scope)
+
+        self._days = {}      # day -> counts known to this process (loaded + added)
+        self._pending = {}   # day -> increments not yet checkpointed
+        self._loaded = False # _days holds complete counts once load() succeeded
+        self._lock = threading.Lock()
+        self._next_checkpoint = time.monotonic() + checkpoint_interval
+
+        self.upsert_sql = writer.backend.upsert(table, list(self.scope) + ["day"], dict.fromkeys(self.counters, "sum"))
+
+    def load(self, conn, day=None):
+        # Resume today's counters from the last checkpoint after a restart
+        day = day or date.today()
+        cur = conn.cursor()
+        cur.execute(f"SELECT {', '.join(self.counters)} FROM {self.table} WHERE day = %s{self._scope_sql}",
+                    (day, *self._scope_values))
+        row = cur.fetchone()
+        cur.close()
+        stored = dict(zip(self.counters, (int(v or 0) for v in row))) if row else dict.fromkeys(self.counters, 0)
+        with self._lock:
+            pending = self._pending.get(day, {})
+            self._days[day] = {c: stored[c] + pending.get(c, 0) for c in self.counters}
+            self._loaded = True
+
+    def add(self, day, **increments):
+        with self._lock:
+            counts = self._days.get(day)
+            if counts is None:
+                counts = self._days[day] = dict.fromkeys(self.counters, 0)
+            pending = self._pending.get(day)
+            if pending is None:
+                pending = self._pending[day] = dict.fromkeys(self.counters, 0)
+            for name, value in increments.items():
+                if value:
+                    counts[name] += value
+                    pending[name] += value
+
+        if time.monotonic() >= self._next_checkpoint:
+            self.checkpoint()
+
+    def checkpoint(self):
+        self._next_checkpoint = time.monotonic() + self.checkpoint_interval
+        with self._lock:
+            rows = [(*self._scope_values, day, *(pending[c] for c in self.counters))
+                    for day, pending in sorted(self._pending.items())]
+            self._pending.clear()
+
+            # Forget days that can no longer receive readings
+            oldest = date.today() - timedelta(days=self.keep_days - 1)
+            for day in [d for d in self._days if d < oldest]:
+                del self._days[day]
+
+        for row in rows:
+            self.writer.submit(self.upsert_sql, row)
+
+    def totals(self, conn, start_day, end_day=None):
+        # Sum the per-day counters for a date range (inclusive), including
+        # readings not yet checkpointed. After a successful load() the days
+        # held in memory are complete; otherwise the increments not yet
+        # submitted are added to the stored row.
+        end_day = end_day or start_day
+        cur = conn.cursor()
+        cur.execute(
+            f"SELECT day, {', '.join(self.counters)} FROM {self.table} "
+            f"WHERE day BETWEEN %s AND %s{self._scope_sql}",
+            (start_day, end_day, *self._scope_values)
+        )
+        per_day = {row[0]: dict(zip(self.counters, (int(v or 0) for v in row[1:]))) for row in cur.fetchall()}
+        cur.close()
+
+        with self._lock:
+            for day, counts in self._days.items():
+                if start_day <= day <= end_day:
+                    if self._loaded:
+                        per_day[day] = dict(counts)
+                    else:
+                        stored = per_day.get(day, {})
+                        pending = self._pending.get(day, {})
+                        per_day[day] = {c: stored.get(c, 0) + pending.get(c, 0) for c in self.counters}
+
+        totals = dict.fromkeys(self.counters, 0)
+        for counts in per_day.values():
+            for name in self.counters:
+                totals[name] += counts[name]
+        totals["days"] = len(per_day)
+        return totals
@@ -0,0 +1,321 @@
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from log import get_logger
+from metrics import stage
+from storage import MySQLBackend
+
+LOG = get_logger("db")
+
+ERROR_LOG_INTERVAL = 30.0  # Seconds between repeated error lines (every failure is counted)
+
+# =============================================================================
+# CONNECTION POOL
+# =============================================================================
+
+class ConnectionPool:
+    # Small pool of long-lived connections created by a factory such as
+    # get_db_connection(). Idle connections are reused most-recent first.
+    def __init__(self, connect, size=2):
+        self._connect = connect
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    def acquire(self):
+        try:
+            conn = self._idle.get_nowait()
+            try:
+                conn.ping(reconnect=True)
+                return conn
+            except Exception:
+                self._discard(conn)
+        except queue.Empty:
+            pass
+
+        conn = self._connect()
+        if conn is None:
+            raise ConnectionError("database connection unavailable")
+        return conn
+
+    def release(self, conn, broken=False):
+        if broken:
+            self._discard(conn)
+            return
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            self._discard(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        broken = False
+        try:
+            yield conn
+        except Exception:
+            broken = True
+            raise
+        finally:
+            self.release(conn, broken)
+
+    def close_all(self):
+        while True:
+            try:
+                self._discard(self._idle.get_nowait())
+            except queue.Empty:
+                return
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+# =============================================================================
+# BATCHED WRITER
+# =============================================================================
+
+class DBWriter:
+    # Long-lived writer: callers enqueue rows without touching the database,
+    # a background thread flushes them with executemany() whenever a batch
+    # fills up or the flush deadline passes. backend (storage.py) builds the
+    # statements that differ between MySQL and SQLite.
+    #
+    # A batch that fails because the connection is lost is kept and retried
+    # every flush_interval. A batch that fails on its data is written again
+    # one row per transaction, and only the rows the database refuses are
+    # dropped (counted as "rejected"), so one bad row cannot block the rest.
+    def __init__(self, connect, schema=(), pool_size=2, max_queue=5000,
+                 batch_size=50, flush_interval=2.0, stats_interval=60.0, name="DB", backend=None):
+        self.pool = ConnectionPool(connect, pool_size)
+        self.backend = backend or MySQLBackend()
+        self.schema = list(schema)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.stats_interval = stats_interval
+        self.name = name
+        self.enabled = True  # False discards rows (running without a database)
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stop = threading.Event()
+        self._thread = None
+        self._schema_ready = False
+        self._stage = stage(name.lower().replace(" ", ".") + ".flush")
+
+        # Statistics
+        self._lock = threading.Lock()
+        self.enqueued = 0
+        self.dropped = 0
+        self.rejected = 0
+        self.flushed_rows = 0
+        self.flush_count = 0
+        self.flush_errors = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self._total_flush_ms = 0.0
+        self._errors_unlogged = 0
+        self._error_logged_at = float("-inf")
+
+    def start(self):
+        if not self.enabled:
+            return self
+        self.ensure_schema()
+        self._thread = threading.Thread(target=self._run, name=f"{self.name}-writer", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.pool.close_all()
+
+    def submit(self, sql, row):
+        # Never blocks the caller: when the queue is full the row is dropped
+        if not self.enabled:
+            return False
+        try:
+            self._queue.put_nowait((sql, row))
+            with self._lock:
+                self.enqueued += 1
+            return True
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+
+    def ensure_schema(self):
+        # Run table creation once per process instead of once per reading
+        if self._schema_ready:
+            return True
+        try:
+            with self.pool.connection() as conn:
+                cur = conn.cursor()
+                # Each step is either a SQL statement or a callable(cursor, backend)
+                for statement in self.schema:
+                    if callable(statement):
+                        statement(cur, self.backend)
+                    else:
+                        cur.execute(statement)
+                conn.commit()
+                cur.close()
+            self._schema_ready = True
+        except Exception as e:
+            self._log_error(f"schema setup failed: {e}")
+        return self._schema_ready
+
+    def stats(self):
+        with self._lock:
+            return {
+                "queue_depth": self._queue.qsize(),
+                "enqueued": self.enqueued,
+                "dropped": self.dropped,
+                "rejected": self.rejected,
+                "flushed_rows": self.flushed_rows,
+                "flushes": self.flush_count,
+                "flush_errors": self.flush_errors,
+                "last_flush_ms": self.last_flush_ms,
+                "avg_flush_ms": self._total_flush_ms / self.flush_count if self.flush_count else 0.0,
+                "max_flush_ms": self.max_flush_ms,
+            }
+
+    def _run(self):
+        batch = []
+        deadline = None
+        next_stats = time.monotonic() + self.stats_interval
+
+        while not (self._stop.is_set() and not batch and self._queue.empty()):
+            now = time.monotonic()
+
+            # Collect rows until the batch is full or its deadline passes
+            if len(batch) < self.batch_size:
+                timeout = self.flush_interval if deadline is None else max(0.0, deadline - now)
+                try:
+                    item = self._queue.get(timeout=min(timeout, 0.5))
+                    batch.append(item)
+                    if deadline is None:
+                        deadline = time.monotonic() + self.flush_interval
+                    # Drain whatever else is already waiting without blocking
+                    while len(batch) < self.batch_size:
+                        batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    pass
+
+            now = time.monotonic()
+            due = deadline is not None and now >= deadline
+            if batch and (len(batch) >= self.batch_size or due or self._stop.is_set()):
+                batch = self._flush(batch)
+                if not batch:
+                    deadline = None
+                else:
+                    # Keep the unwritten rows and retry later; new rows wait
+                    # in the bounded queue and are dropped once it fills up
+                    if self._stop.is_set():
+                        break
+                    deadline = time.monotonic() + self.flush_interval
+                    self._stop.wait(self.flush_interval)
+
+            if self.stats_interval and now >= next_stats:
+                next_stats = now + self.stats_interval
+                s = self.stats()
+                LOG.info("%s: queue=%d flushed=%d dropped=%d rejected=%d last_flush=%.1fms avg_flush=%.1fms",
+                         self.name, s["queue_depth"], s["flushed_rows"], s["dropped"], s["rejected"],
+                         s["last_flush_ms"], s["avg_flush_ms"])
+
+    def _flush(self, batch):
+        # Returns the rows still to be written: none once the batch is
+        # stored, the unwritten ones after a connection error
+        if not self.ensure_schema():
+            with self._lock:
+                self.flush_errors += 1
+            return batch
+
+        # Group rows by statement so each one becomes a single executemany()
+        grouped = {}
+        for sql, row in batch:
+            grouped.setdefault(sql, []).append(row)
+
+        start = time.perf_counter()
+        try:
+            conn = self.pool.acquire()
+        except Exception as e:
+            self._flush_failed(e)
+            return batch
+
+        try:
+            cur = conn.cursor()
+            for sql, rows in grouped.items():
+                cur.executemany(sql, rows)
+            conn.commit()
+            cur.close()
+        except Exception as e:
+            self._rollback(conn)
+            if self.backend.is_transient(e):
+                self.pool.release(conn, broken=True)
+                self._flush_failed(e)
+                return batch
+            # Something in the batch was refused: find it row by row
+            return self._flush_rows(conn, batch, start)
+
+        self.pool.release(conn)
+        self._flushed(len(batch), start)
+        return []
+
+    def _flush_rows(self, conn, batch, start):
+        # One transaction per row, so only the refused rows are dropped
+        cur = conn.cursor()
+        written = 0
+        for i, (sql, row) in enumerate(batch):
+            try:
+                cur.execute(sql, row)
+                conn.commit()
+                written += 1
+            except Exception as e:
+                self._rollback(conn)
+                if self.backend.is_transient(e):
+                    self.pool.release(conn, broken=True)
+                    self._flush_failed(e)
+                    return batch[i:]
+                with self._lock:
+                    self.rejected += 1
+                self._log_error(f"dropped a row the database refused: {e} ({row!r})")
+        cur.close()
+        self.pool.release(conn)
+        self._flushed(written, start)
+        return []
+
+    def _flushed(self, rows, start):
+        elapsed = time.perf_counter() - start
+        self._stage.observe(elapsed)
+        elapsed_ms = elapsed * 1000.0
+        with self._lock:
+            self.flushed_rows += rows
+            self.flush_count += 1
+            self.last_flush_ms = elapsed_ms
+            self._total_flush_ms += elapsed_ms
+            self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+
+    def _flush_failed(self, error):
+        self._stage.error()
+        with self._lock:
+            self.flush_errors += 1
+        self._log_error(f"flush failed: {error}")
+
+    def _rollback(self, conn):
+        try:
+            conn.rollback()
+        except Exception:
+            pass
+
+    def _log_error(self, message):
+        # While the database stays down every retry fails the same way:
+        # print one line per ERROR_LOG_INTERVAL with the count since the last
+        now = time.monotonic()
+        with self._lock:
+            self._errors_unlogged += 1
+            if now - self._error_logged_at < ERROR_LOG_INTERVAL:
+                return
+            count, self._errors_unlogged = self._errors_unlogged, 0
+            self._error_logged_at = now
+        suffix = f" ({count} errors since the last line)" if count > 1 else ""
+        LOG.error("%s %s%s", self.name, message, suffix)
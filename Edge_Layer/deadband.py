@@ -0,0 +1,90 @@
+from collections import deque
+from metrics import counter
+
+# =============================================================================
+# SMOOTHING
+# =============================================================================
+
+class Ewma:
+    # Exponentially weighted moving average; alpha near 1 follows the input
+    def __init__(self, alpha):
+        self.alpha = alpha
+        self.value = None
+
+    def update(self, x):
+        self.value = x if self.value is None else self.value + self.alpha * (x - self.value)
+        return self.value
+
+class MovingMedian:
+    # Median of the last `window` values; drops single-sample spikes
+    def __init__(self, window):
+        self.values = deque(maxlen=window)
+
+    def update(self, x):
+        self.values.append(x)
+        ordered = sorted(self.values)
+        return ordered[(len(ordered) - 1) // 2]
+
+def _like(value, smoothed):
+    # Smoothed values keep the input's type so stored columns do not change
+    return round(smoothed, 1) if isinstance(value, float) else int(round(smoothed))
+
+def make_smoother(kind, alpha=0.3, window=5):
+    if kind is None:
+        return None
+    if kind == "ewma":
+        return Ewma(alpha)
+    if kind == "median":
+        return MovingMedian(window)
+    raise ValueError(f"unknown smoothing {kind!r}")
+
+# =============================================================================
+# DEADBAND FILTER
+# =============================================================================
+
+class DeadbandFilter:
+    # Decides which readings are worth sending on. Numeric fields pass when
+    # they move at least their delta from the last value sent; fields with
+    # delta None (on/off states) pass on any change. When nothing passes
+    # for `heartbeat` seconds the reading is sent anyway, so subscribers
+    # and the database still see the sensor is alive.
+    #
+    # fields: name -> delta, in the order values are given to update()
+    def __init__(self, fields, heartbeat=15.0, smoothing=None, alpha=0.3, window=5, name="Deadband"):
+        self.fields = tuple(fields)
+        self.deltas = tuple(fields[field] for field in self.fields)
+        self.heartbeat = heartbeat
+        self.name = name
+        self._smoothers = [None if delta is None else make_smoother(smoothing, alpha, window)
+                           for delta in self.deltas]
+        self._last = None
+        self._last_sent_at = 0.0
+
+        # Statistics
+        self.results = {"sent": 0, "suppressed": 0}
+
+        label = name.lower().replace(" ", ".")
+        for result in self.results:
+            counter("deadband_readings_total", "Readings sent on or held back by the deadband",
+                    lambda result=result: self.results[result], filter=label, result=result)
+
+    def update(self, values, ts):
+        # Returns (possibly smoothed values, whether to send them)
+        values = tuple(value if smoother is None else _like(value, smoother.update(value))
+                       for value, smoother in zip(values, self._smoothers))
+
+        last = self._last
+        send = last is None or ts - self._last_sent_at >= self.heartbeat
+        if not send:
+            for value, previous, delta in zip(values, last, self.deltas):
+                if (value != previous) if delta is None else abs(value - previous) >= delta:
+                    send = True
+                    break
+
+        if send:
+            self._last = values
+            self._last_sent_at = ts
+            self.results["sent"] += 1
+        else:
+            self.results["suppressed"] += 1
+        return values, send
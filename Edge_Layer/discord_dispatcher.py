@@ -0,0 +1,182 @@
+import queue
+import threading
+import time
+import requests
+from log import get_logger
+from metrics import stage
+
+LOG = get_logger("discord")
+
+# =============================================================================
+# DISCORD NOTIFICATION DISPATCHER
+# =============================================================================
+
+DISCORD_CONTENT_LIMIT = 2000  # Maximum characters in a message
+DISCORD_EMBED_LIMIT = 10      # Maximum embeds in a message
+
+class DiscordDispatcher:
+    # Callers enqueue alerts and reports without ever blocking. A background
+    # worker posts them through one reused HTTP session, merges everything
+    # that arrives within the coalescing window into a single message and
+    # backs off when Discord answers 429 Too Many Requests.
+    def __init__(self, webhook_url, coalesce_window=5.0, max_queue=500,
+                 timeout=5.0, max_attempts=5, name="Discord"):
+        self.webhook_url = webhook_url
+        self.coalesce_window = coalesce_window
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.name = name
+
+        self._stage = stage(name.lower().replace(" ", ".") + ".post")
+        self.session = requests.Session()
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stop = threading.Event()
+        self._thread = None
+        self._last_sent = 0.0
+
+        # Statistics
+        self.enqueued = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.sent = 0
+        self.rate_limited = 0
+        self.failed = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name=f"{self.name}-dispatcher", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.session.close()
+
+    def send(self, message):
+        return self._enqueue(("content", message))
+
+    def send_embed(self, title, description, color=5814783):
+        return self._enqueue(("embed", {"title": title, "description": description, "color": color}))
+
+    def stats(self):
+        return {
+            "queue_depth": self._queue.qsize(),
+            "enqueued": self.enqueued,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "sent": self.sent,
+            "rate_limited": self.rate_limited,
+            "failed": self.failed,
+        }
+
+    def _enqueue(self, item):
+        try:
+            self._queue.put_nowait(item)
+            self.enqueued += 1
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                items = [self._queue.get(timeout=0.5)]
+            except queue.Empty:
+                continue
+
+            # Collect everything that arrives before the window closes
+            window_end = self._last_sent + self.coalesce_window
+            while True:
+                remaining = window_end - time.monotonic()
+                if remaining <= 0 or self._stop.is_set():
+                    break
+                try:
+                    items.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            while True:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            for payload in self._build_payloads(items):
+                self._post(payload)
+            self._last_sent = time.monotonic()
+
+    def _build_payloads(self, items):
+        # Merge duplicate alerts into one line with a repeat count
+        counts = {}
+        embeds = []
+        for kind, value in items:
+            if kind == "content":
+                counts[value] = counts.get(value, 0) + 1
+            else:
+                embeds.append(value)
+        self.coalesced += len(items) - len(counts) - len(embeds)
+
+        lines = [msg if n == 1 else f"{msg} (x{n})" for msg, n in counts.items()]
+
+        # Split into messages that respect Discord's size limits
+        payloads = []
+        content = ""
+        for line in lines:
+            line = line[:DISCORD_CONTENT_LIMIT]
+            if content and len(content) + 1 + len(line) > DISCORD_CONTENT_LIMIT:
+                payloads.append({"content": content})
+                content = ""
+            content = f"{content}\n{line}" if content else line
+        if content:
+            payloads.append({"content": content})
+
+        for i in range(0, len(embeds), DISCORD_EMBED_LIMIT):
+            chunk = embeds[i:i + DISCORD_EMBED_LIMIT]
+            if i == 0 and payloads and "embeds" not in payloads[-1]:
+                payloads[-1]["embeds"] = chunk
+            else:
+                payloads.append({"embeds": chunk})
+        return payloads
+
+    def _post(self, payload):
+        # Notifications are optional: without a webhook they are discarded
+        if not self.webhook_url:
+            return False
+        for attempt in range(self.max_attempts):
+            try:
+                with self._stage.time():
+                    res = self.session.post(self.webhook_url, json=payload, timeout=self.timeout)
+            except Exception as e:
+                LOG.error("%s post failed: %s", self.name, e)
+                self._stop.wait(min(2 ** attempt, 30))
+                continue
+
+            if res.status_code == 429:
+                # Honour the delay Discord asks for before retrying
+                self.rate_limited += 1
+                self._stop.wait(self._retry_after(res))
+                continue
+            if res.status_code >= 500:
+                self._stop.wait(min(2 ** attempt, 30))
+                continue
+            if res.status_code >= 400:
+                LOG.error("%s rejected message: %s %s", self.name, res.status_code, res.text[:200])
+                self.failed += 1
+                return False
+
+            self.sent += 1
+            return True
+
+        self.failed += 1
+        return False
+
+    def _retry_after(self, res):
+        try:
+            return float(res.json().get("retry_after", 1.0))
+        except Exception:
+            pass
+        try:
+            return float(res.headers.get("Retry-After", 1.0))
+        except Exception:
+            return 1.0
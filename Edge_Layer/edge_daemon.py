@@ -0,0 +1,698 @@
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Common'))
+import serial
+from datetime import datetime
+import asyncio
+import time
+import paho.mqtt.client as mqtt
+import json
+from functools import partial
+from archive import ArchiveJob
+from db_writer import DBWriter
+from deadband import DeadbandFilter
+from discord_dispatcher import DiscordDispatcher
+from history import start_history_server
+from log import configure_logging, get_logger, stop_logging
+from metrics import stage, start_metrics_server
+from mqtt_publisher import BoundedPublisher
+from mqtt_spool import MessageSpool, SpooledPublisher
+from payload_codec import PayloadCodec
+from rollup import RetentionJob
+from room_handlers import InsideRoom, OutsideRoom
+from rule_engine import RuleEngine
+from scheduler import AsyncScheduler
+from serial_protocol import INSIDE_FRAMES, SENSOR_FRAMES, make_decoder, parse_inside_text, parse_sensor_text
+from storage import ensure_index, make_backend
+
+# =============================================================================
+# CONFIGURATION SECTION
+# =============================================================================
+
+# MQTT Configuration
+MQTT_BROKER = "172.20.10.14" # Change to cloud VM server address
+MQTT_PORT = 1883
+
+# Per-room topics ({room} is the room ID from the device map)
+TOPIC_OUTSIDE_DATA = "edge/{room}/outside/data"
+TOPIC_OUTSIDE_STATUS = "edge/{room}/outside/status"
+TOPIC_INSIDE_DATA = "edge/{room}/inside/data"
+TOPIC_COMMAND_ACK = "edge/{room}/inside/ack"   # Command results for the cloud
+TOPIC_CONTROL = "cloud/{room}/control/"        # + actuator name (mode, led, fan, door)
+TOPIC_SUGGESTION = "cloud/{room}/suggestion"
+TOPIC_SUGGESTION_ALL = "cloud/suggestion"      # Weather suggestion for every room
+
+# Store-and-forward spool for outgoing data while the broker is unreachable
+MQTT_DATA_QOS = 1                     # QoS for spooled data messages
+SPOOL_DIR = "spool/daemon"
+SPOOL_MAX_BYTES = 256 * 1024 * 1024   # Oldest messages are dropped beyond this
+SPOOL_SEGMENT_BYTES = 4 * 1024 * 1024 # Size of each spool file
+SPOOL_REPLAY_RATE = 1000              # Messages per second replayed after reconnect
+SPOOL_REPLAY_BATCH = 100              # Messages per replay batch
+
+# Outbound MQTT queue: QoS and overflow policy per topic filter (see
+# Common/mqtt_publisher.py). Spooled data fails when the queue is full, so
+# the message goes to the spool instead of being lost; the sensor status
+# drops its oldest message. Command results fail instead of blocking: they
+# are published from the event loop, which must not wait
+MQTT_TOPIC_POLICIES = {
+    TOPIC_OUTSIDE_DATA.format(room="+"): (MQTT_DATA_QOS, "fail"),
+    TOPIC_INSIDE_DATA.format(room="+"): (MQTT_DATA_QOS, "fail"),
+    TOPIC_OUTSIDE_STATUS.format(room="+"): (0, "drop_oldest"),
+    TOPIC_COMMAND_ACK.format(room="+"): (1, "fail"),
+}
+MQTT_QUEUE_SIZE = 5000    # Messages waiting for the broker (all rooms)
+MQTT_MAX_INFLIGHT = 50    # Messages sent and not yet acknowledged
+
+# Payload encoding of published messages: "json", "struct" (compact binary
+# with a fixed schema per topic), "msgpack" or "cbor". Received messages are
+# decoded whatever their encoding (see Common/payload_codec.py)
+PAYLOAD_CODEC = "json"
+
+# Device map: JSON list of {"port": ..., "room": ..., "role": "inside" | "outside"}
+# with an optional "protocol" ("text" or "framed") per device
+DEVICE_MAP_FILE = "devices.json"
+
+# Discord Integration
+DISCORD_WEBHOOK_URL = "https://discord.com/api/webhooks/1375385948715487243/18tL62HUw6PFjRXGYorL1Age2WsKibXKvwc5zlJGQCLdNlp9O6B6cBvC9tg_grTRz9_O"
+DISCORD_COALESCE_WINDOW = 5.0  # Alerts within this many seconds share one message
+DISCORD_TIMEOUT = 5.0          # Seconds before a webhook request is abandoned
+
+# Database Configuration (one database for every room)
+DB_BACKEND = "mysql"   # "mysql", or "sqlite" for boards without a MySQL server
+DB_SQLITE_PATH = "edgelog.db"
+DB_HOST = "localhost"
+DB_USER = "root"
+DB_PASSWORD = "12345678"
+DB_NAME = "edgelog"
+DB_ENABLED = True      # False runs without a database (nothing is stored)
+DB_POOL_SIZE = 2
+DB_QUEUE_SIZE = 20000    # Rows buffered while the database is slow
+DB_BATCH_SIZE = 200      # Rows per executemany() batch
+DB_FLUSH_INTERVAL = 2.0  # Maximum seconds a row waits before being written
+SUMMARY_CHECKPOINT_INTERVAL = 60.0  # Seconds between report counter checkpoints
+
+# Data Retention
+RAW_RETENTION_DAYS = 30             # Raw readings and status frames kept
+MINUTE_ROLLUP_RETENTION_DAYS = 90   # Minute aggregates kept (hourly kept forever)
+RETENTION_CHUNK_SIZE = 1000         # Rows deleted per statement
+ROLLUP_MAX_GAP = 30.0               # Seconds an actuator state is assumed to hold
+
+# Archive Export: complete days of raw rows are streamed to gzip CSV
+# files. An index.json lets each run continue where the last one stopped.
+# Archived rows are deleted after ARCHIVE_DELETE_AFTER_DAYS (None keeps
+# them until RAW_RETENTION_DAYS, which stays as the backstop).
+ARCHIVE_ENABLED = True
+ARCHIVE_DIR = "archive/edgelog"
+ARCHIVE_TIME = "00:30"
+ARCHIVE_CHUNK_ROWS = 5000
+ARCHIVE_DELETE_AFTER_DAYS = None
+
+# Sensor Thresholds (defaults; the cloud may change TEMP_THRESHOLD per room)
+LIGHT_THRESHOLD = 800
+TEMP_THRESHOLD = 30.0
+
+# Report Analytics: each room's raw rows streamed through NumPy in chunks
+REPORT_CHUNK_ROWS = 5000      # Rows fetched per chunk (bounds report memory)
+REPORT_MAX_GAP = 30.0         # Seconds a sensor reading is assumed to hold
+REPORT_WINDOW_MINUTES = 15    # Moving average window
+REPORT_Z_LIMIT = 3.0          # Minute means this many deviations out are flagged
+
+# Alert Rules (see rule_engine.py), shared by every room with state and
+# thresholds per room. cloud/<room>/suggestion changes one room's "param"
+# thresholds, cloud/suggestion every room's; "alert rules" replaces the list.
+ALERT_SENSORS = ("light", "temperature", "sound")  # sound: 1 when loud
+ALERT_RULES = [
+    {"name": "sound_loud", "sensor": "sound", "above": 0.5, "hold": 30.0,
+     "message": "🔊🔊 SOUND changed to LOUD, CAUTION 🔊🔊"},
+    {"name": "light_high", "sensor": "light", "above": LIGHT_THRESHOLD, "band": 50, "debounce": 2.0,
+     "message": "💡💡 BRIGHTNESS changed to {value} lux, EXCEEDED {threshold:g} lux, CAUTION 💡💡"},
+    {"name": "temp_high", "sensor": "temperature", "above": TEMP_THRESHOLD, "band": 1.0, "debounce": 5.0,
+     "param": "temp threshold",
+     "message": "🔥🔥 TEMPERATURE change to {value} °C, EXCEEDED {threshold:g} °C, CAUTION 🔥🔥"},
+    {"name": "temp_rising", "sensor": "temperature", "rate": 60.0, "above": 3.0, "band": 1.0,
+     "message": "🌡️🌡️ TEMPERATURE rising {value:.1f} °C per minute, CAUTION 🌡️🌡️"},
+]
+
+# Commands: unanswered ones are reported as timed out after this many seconds
+COMMAND_ACK_TIMEOUT = 2.0
+
+# Deadband Publishing: outside readings are published and stored as raw rows
+# only when light or temperature moves by its delta, sound changes (None),
+# or nothing was sent for DEADBAND_HEARTBEAT seconds. Alerts, report
+# counters, rollups and the history API still see every reading.
+DEADBAND_FIELDS = {"light": 20, "sound": None, "temperature": 1}  # In reading order
+DEADBAND_HEARTBEAT = 15.0     # Keep below REPORT_MAX_GAP
+DEADBAND_SMOOTHING = None     # None, "ewma" or "median" (light and temperature)
+DEADBAND_EWMA_ALPHA = 0.3
+DEADBAND_MEDIAN_WINDOW = 5
+
+# Outside readings forwarded to inside Arduinos: a line identical to the
+# last one sent is skipped until this many seconds have passed
+FORWARD_REFRESH_INTERVAL = 60.0
+
+# Serial Configuration
+SERIAL_BAUD = 9600
+SERIAL_PROTOCOL = "text"     # Default for devices without a "protocol" entry
+SERIAL_RETRY_INTERVAL = 5.0  # Seconds before reopening a missing or failed port
+
+# Reports
+REPORT_TIME = "23:59"
+
+# Metrics Endpoint (Prometheus text format; port 0 disables it)
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9104
+
+# History API: /history/<room>/sensors and /history/<room>/actuators
+# (recent data from memory, older from the database; port 0 disables it)
+HISTORY_HOST = "127.0.0.1"
+HISTORY_PORT = 9114
+HISTORY_SENSOR_CAPACITY = 86400    # Readings kept in memory per room (a day at 1 Hz)
+HISTORY_ACTUATOR_CAPACITY = 28800  # Status frames kept in memory per room (a day at one per 3 s)
+HISTORY_RELOAD = 24 * 3600         # Seconds refilled from the database at startup
+
+# Logging: lines are written by a background thread (see Common/log.py).
+# Levels per category, e.g. {"mqtt.received": "WARNING"}; per-message
+# categories are sampled to LOG_SAMPLE_RATE lines per second
+LOG_LEVEL = "INFO"
+LOG_LEVELS = {}
+LOG_SAMPLE_RATE = 5
+
+# =============================================================================
+# DATABASE SCHEMA
+# =============================================================================
+
+# Same tables as the single-room scripts, keyed by room
+SENSOR_ROLLUP_COLUMNS = '''
+        room VARCHAR(64) NOT NULL,
+        bucket DATETIME NOT NULL,
+        samples INT NOT NULL,
+        light_min INT, light_max INT, light_sum BIGINT NOT NULL,
+        temp_min INT, temp_max INT, temp_sum BIGINT NOT NULL,
+        loud_samples INT NOT NULL,
+        PRIMARY KEY (room, bucket)
+'''
+
+ACTUATOR_ROLLUP_COLUMNS = '''
+        room VARCHAR(64) NOT NULL,
+        bucket DATETIME NOT NULL,
+        samples INT NOT NULL,
+        observed_s DOUBLE NOT NULL,
+        led_on_s DOUBLE NOT NULL, fan_on_s DOUBLE NOT NULL,
+        door_open_s DOUBLE NOT NULL, mode_manual_s DOUBLE NOT NULL,
+        led_changes INT NOT NULL, fan_changes INT NOT NULL,
+        door_changes INT NOT NULL, mode_changes INT NOT NULL,
+        PRIMARY KEY (room, bucket)
+'''
+
+EDGE_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS sensor_logs (
+        room VARCHAR(64) NOT NULL,
+        time DATETIME,
+        light INT,
+        sound VARCHAR(20),
+        temperature INT
+    )
+    ''',
+    ensure_index("sensor_logs", ("room", "time"), "idx_sensor_logs_room_time"),
+    ensure_index("sensor_logs", ("time",), "idx_sensor_logs_time"),
+    '''
+    CREATE TABLE IF NOT EXISTS actuator_logs (
+        room VARCHAR(64) NOT NULL,
+        time DATETIME,
+        led VARCHAR(20),
+        fan VARCHAR(20),
+        door VARCHAR(20),
+        mode VARCHAR(20)
+    )
+    ''',
+    ensure_index("actuator_logs", ("room", "time"), "idx_actuator_logs_room_time"),
+    ensure_index("actuator_logs", ("time",), "idx_actuator_logs_time"),
+    '''
+    CREATE TABLE IF NOT EXISTS sensor_summary (
+        room VARCHAR(64) NOT NULL,
+        day DATE NOT NULL,
+        total INT NOT NULL DEFAULT 0,
+        light_high INT NOT NULL DEFAULT 0,
+        sound_high INT NOT NULL DEFAULT 0,
+        temp_high INT NOT NULL DEFAULT 0,
+        PRIMARY KEY (room, day)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS actuator_summary (
+        room VARCHAR(64) NOT NULL,
+        day DATE NOT NULL,
+        total INT NOT NULL DEFAULT 0,
+        led_on INT NOT NULL DEFAULT 0,
+        door_open INT NOT NULL DEFAULT 0,
+        fan_on INT NOT NULL DEFAULT 0,
+        mode_manual INT NOT NULL DEFAULT 0,
+        PRIMARY KEY (room, day)
+    )
+    ''',
+    f"CREATE TABLE IF NOT EXISTS sensor_rollup_minute ({SENSOR_ROLLUP_COLUMNS})",
+    f"CREATE TABLE IF NOT EXISTS sensor_rollup_hour ({SENSOR_ROLLUP_COLUMNS})",
+    f"CREATE TABLE IF NOT EXISTS actuator_rollup_minute ({ACTUATOR_ROLLUP_COLUMNS})",
+    f"CREATE TABLE IF NOT EXISTS actuator_rollup_hour ({ACTUATOR_ROLLUP_COLUMNS})"
+]
+
+# MySQL server or local SQLite file, chosen by DB_BACKEND
+STORAGE = make_backend(DB_BACKEND, DB_HOST, DB_USER, DB_PASSWORD, DB_NAME, DB_SQLITE_PATH)
+
+def get_db_connection():
+    try:
+        return STORAGE.connect()
+    except Exception as e:
+        LOG.error("Database connection failed: %s", e)
+        return None
+
+# =============================================================================
+# DEVICE MAP
+# =============================================================================
+
+def load_device_map(path=DEVICE_MAP_FILE):
+    with open(path) as f:
+        entries = json.load(f)
+
+    devices = []
+    seen_ports = set()
+    for entry in entries:
+        port, room, role = entry["port"], str(entry["room"]), entry["role"]
+        if role not in DEVICE_TYPES:
+            raise ValueError(f"{port}: unknown role {role!r}")
+        if port in seen_ports:
+            raise ValueError(f"{port}: listed more than once")
+        if '/' in room or '+' in room or '#' in room:
+            raise ValueError(f"{port}: room ID {room!r} is not a valid topic level")
+        seen_ports.add(port)
+        devices.append((port, room, role, entry.get("protocol", SERIAL_PROTOCOL)))
+    return devices
+
+# =============================================================================
+# SERIAL DEVICES
+# =============================================================================
+
+# Loggers per category (see LOG_LEVELS); per-message lines are sampled
+LOG = get_logger("daemon")
+MQTT_LOG = get_logger("mqtt")
+PUBLISHED_LOG = get_logger("mqtt.published", rate=LOG_SAMPLE_RATE)
+SERIAL_LOG = get_logger("serial.sent", rate=LOG_SAMPLE_RATE)
+
+class RoomDevice:
+    # One Arduino on one serial port. The port is opened non-blocking and
+    # watched by the daemon's event loop, so every device is read from the
+    # same thread without a reader thread per port. What happens to its
+    # records and messages is up to its room handler (room_handlers.py),
+    # the same code the single-room scripts run.
+    ROLE = None
+
+    def __init__(self, daemon, port, room, protocol=SERIAL_PROTOCOL):
+        self.daemon = daemon
+        self.port = port
+        self.room = room
+        self.protocol = protocol
+        self.name = f"{room}/{self.ROLE}"
+        self.serial = None
+        self.decoder = None
+        self.handler = None  # Set by the subclass
+
+        # Per-stage timings, shared by every device with the same role
+        self.process_stage = stage(f"daemon.{self.ROLE}.process")
+        self.publish_stage = stage(f"daemon.{self.ROLE}.mqtt_publish")
+
+    def open(self):
+        loop = self.daemon.loop
+        try:
+            self.serial = serial.Serial(self.port, SERIAL_BAUD, timeout=0)
+        except Exception as e:
+            SERIAL_LOG.error("%s cannot open %s: %s", self.name, self.port, e)
+            self.serial = None
+            loop.call_later(SERIAL_RETRY_INTERVAL, self.open)
+            return
+
+        # Fresh decoder so a partial line from before a reconnect is dropped
+        self.decoder = make_decoder(self.protocol, self.TEXT_PARSE, self.FRAMES, name=f"Serial {self.name}")
+        loop.add_reader(self.serial.fileno(), self._on_readable)
+        LOG.info("%s listening on %s", self.name, self.port)
+
+    def close(self):
+        if self.serial is None:
+            return
+        try:
+            self.daemon.loop.remove_reader(self.serial.fileno())
+        except Exception:
+            pass
+        try:
+            self.serial.close()
+        except Exception:
+            pass
+        self.serial = None
+
+    def _on_readable(self):
+        try:
+            data = self.serial.read(self.serial.in_waiting or 1)
+        except Exception as e:
+            # Unplugged or failed: stop watching and try again later
+            LOG.error("%s read failed: %s", self.name, e)
+            self.close()
+            self.daemon.loop.call_later(SERIAL_RETRY_INTERVAL, self.open)
+            return
+
+        received_at = time.time()
+        for record in self.decoder.feed(data):
+            try:
+                with self.process_stage.time():
+                    self.handler.handle(received_at, record)
+            except Exception as e:
+                LOG.error("%s handle: %s", self.name, e)
+
+    def send_to_arduino(self, message: str, kind="command"):
+        # kind is for prioritized writers; the loop is this port's only writer
+        if self.serial is None:
+            SERIAL_LOG.error("%s not connected, dropped: %s", self.name, message)
+            return
+        try:
+            self.serial.write((message + '\n').encode())
+            SERIAL_LOG.info("Sent to %s: %s", self.name, message)
+        except Exception as e:
+            SERIAL_LOG.error("Sending to %s: %s", self.name, e)
+
+    def publish(self, topic, message, spooled=True):
+        # Data goes through the spool; transient acknowledgements do not
+        payload = self.daemon.payload.encode(topic, message)
+        with self.publish_stage.time():
+            if spooled:
+                self.daemon.publisher.publish(topic, payload, MQTT_DATA_QOS)
+            else:
+                self.daemon.mqtt_out.publish(topic, payload)
+        PUBLISHED_LOG.info("Published: %s to %s", message, topic)
+
+    def alert(self, message):
+        self.daemon.discord.send(f"[{self.room}] {message}")
+
+class OutsideDevice(RoomDevice):
+    ROLE = "outside"
+    TEXT_PARSE = staticmethod(parse_sensor_text)
+    FRAMES = SENSOR_FRAMES
+
+    def __init__(self, daemon, port, room, protocol=SERIAL_PROTOCOL):
+        super().__init__(daemon, port, room, protocol)
+        self.handler = OutsideRoom(
+            daemon.db_writer,
+            self.publish,
+            self.send_to_arduino,
+            self.alert,
+            daemon.alerts,
+            DeadbandFilter(
+                DEADBAND_FIELDS,
+                heartbeat=DEADBAND_HEARTBEAT,
+                smoothing=DEADBAND_SMOOTHING,
+                alpha=DEADBAND_EWMA_ALPHA,
+                window=DEADBAND_MEDIAN_WINDOW,
+                name=f"Deadband {room}"
+            ),
+            TOPIC_OUTSIDE_DATA.format(room=room),
+            TOPIC_OUTSIDE_STATUS.format(room=room),
+            TOPIC_SUGGESTION.format(room=room),
+            name=self.name,
+            label=room,
+            scope={"room": room},
+            raw_table="sensor_logs",
+            summary_table="sensor_summary",
+            history_name=f"{room}/sensors",
+            history_capacity=HISTORY_SENSOR_CAPACITY,
+            light_threshold=LIGHT_THRESHOLD,
+            temp_threshold=TEMP_THRESHOLD,
+            checkpoint_interval=SUMMARY_CHECKPOINT_INTERVAL,
+            chunk_rows=REPORT_CHUNK_ROWS,
+            max_gap=REPORT_MAX_GAP,
+            window_minutes=REPORT_WINDOW_MINUTES,
+            z_limit=REPORT_Z_LIMIT
+        )
+
+class InsideDevice(RoomDevice):
+    ROLE = "inside"
+    TEXT_PARSE = staticmethod(parse_inside_text)
+    FRAMES = INSIDE_FRAMES
+
+    def __init__(self, daemon, port, room, protocol=SERIAL_PROTOCOL):
+        super().__init__(daemon, port, room, protocol)
+
+        # Its command queue is expired by the daemon from the loop
+        self.handler = InsideRoom(
+            daemon.db_writer,
+            self.publish,
+            self.send_to_arduino,
+            self.alert,
+            TOPIC_OUTSIDE_DATA.format(room=room),
+            TOPIC_OUTSIDE_STATUS.format(room=room),
+            TOPIC_INSIDE_DATA.format(room=room),
+            TOPIC_CONTROL.format(room=room),
+            TOPIC_COMMAND_ACK.format(room=room),
+            TOPIC_SUGGESTION.format(room=room),
+            name=self.name,
+            label=room,
+            scope={"room": room},
+            raw_table="actuator_logs",
+            summary_table="actuator_summary",
+            history_name=f"{room}/actuators",
+            history_capacity=HISTORY_ACTUATOR_CAPACITY,
+            checkpoint_interval=SUMMARY_CHECKPOINT_INTERVAL,
+            chunk_rows=REPORT_CHUNK_ROWS,
+            max_gap=ROLLUP_MAX_GAP,
+            ack_timeout=COMMAND_ACK_TIMEOUT,
+            forward_refresh=FORWARD_REFRESH_INTERVAL
+        )
+
+DEVICE_TYPES = {"outside": OutsideDevice, "inside": InsideDevice}
+
+# =============================================================================
+# EDGE DAEMON
+# =============================================================================
+
+class EdgeDaemon:
+    # Runs every device in the map on one asyncio loop with one MQTT
+    # connection, one DB writer and one Discord dispatcher. MQTT callbacks
+    # arrive on paho's network thread and are handed to the loop, so device
+    # state is only ever touched from the loop thread.
+    def __init__(self, device_map, broker=MQTT_BROKER, broker_port=MQTT_PORT, db_enabled=DB_ENABLED):
+        self.broker = broker
+        self.broker_port = broker_port
+        self.loop = None
+
+        self.db_writer = DBWriter(
+            get_db_connection,
+            schema=EDGE_SCHEMA,
+            pool_size=DB_POOL_SIZE,
+            max_queue=DB_QUEUE_SIZE,
+            batch_size=DB_BATCH_SIZE,
+            flush_interval=DB_FLUSH_INTERVAL,
+            name=f"DB {DB_NAME}",
+            backend=STORAGE
+        )
+        self.db_writer.enabled = db_enabled
+        self.retention = RetentionJob(
+            self.db_writer.pool,
+            [
+                ("sensor_logs", "time", RAW_RETENTION_DAYS),
+                ("actuator_logs", "time", RAW_RETENTION_DAYS),
+                ("sensor_rollup_minute", "bucket", MINUTE_ROLLUP_RETENTION_DAYS),
+                ("actuator_rollup_minute", "bucket", MINUTE_ROLLUP_RETENTION_DAYS),
+            ],
+            chunk_size=RETENTION_CHUNK_SIZE,
+            backend=STORAGE
+        )
+        self.archive = ArchiveJob(
+            self.db_writer.pool,
+            STORAGE,
+            [("sensor_logs", "time"), ("actuator_logs", "time")],
+            ARCHIVE_DIR,
+            chunk_rows=ARCHIVE_CHUNK_ROWS,
+            delete_after_days=ARCHIVE_DELETE_AFTER_DAYS,
+            delete_chunk=RETENTION_CHUNK_SIZE
+        )
+        self.discord = DiscordDispatcher(
+            DISCORD_WEBHOOK_URL,
+            coalesce_window=DISCORD_COALESCE_WINDOW,
+            timeout=DISCORD_TIMEOUT
+        )
+
+        # Alert rules for every room, evaluated on the loop thread
+        self.alerts = RuleEngine(ALERT_SENSORS, ALERT_RULES, name="Rules daemon")
+
+        self.devices = [DEVICE_TYPES[role](self, port, room, protocol) for port, room, role, protocol in device_map]
+        self.rooms = {}
+        for device in self.devices:
+            self.rooms.setdefault(device.room, []).append(device)
+
+        self.mqtt = mqtt.Client()
+        self.mqtt.on_connect = self.on_connect
+        self.mqtt.on_disconnect = self.on_disconnect
+        self.mqtt.on_message = self.on_message
+        self.mqtt.reconnect_delay_set(1, 30)
+        self.mqtt_out = BoundedPublisher(
+            self.mqtt,
+            MQTT_TOPIC_POLICIES,
+            max_queue=MQTT_QUEUE_SIZE,
+            max_inflight=MQTT_MAX_INFLIGHT,
+            name="MQTT daemon"
+        )
+        self.publisher = SpooledPublisher(
+            self.mqtt_out,
+            MessageSpool(SPOOL_DIR, SPOOL_MAX_BYTES, SPOOL_SEGMENT_BYTES, name="Spool daemon"),
+            replay_rate=SPOOL_REPLAY_RATE,
+            batch_size=SPOOL_REPLAY_BATCH,
+            name="Spool daemon"
+        )
+        self.scheduler = None  # AsyncScheduler on the loop, created by run()
+        self.payload = PayloadCodec(PAYLOAD_CODEC, name="Payload daemon")
+        self.dispatch_stage = stage("daemon.on_message")
+        self._stopped = None
+
+    # ---------- MQTT ----------
+
+    def on_connect(self, client, userdata, flags, rc):
+        MQTT_LOG.info("Connected with result code %s", rc)
+        topics = {TOPIC_SUGGESTION_ALL}
+        for device in self.devices:
+            topics.update(device.handler.topics())
+        client.subscribe([(topic, 0) for topic in sorted(topics)])
+
+    def on_disconnect(self, client, userdata, rc):
+        MQTT_LOG.warning("Disconnected with result code %s, spooling until reconnected", rc)
+
+    def on_message(self, client, userdata, msg):
+        # Runs on the paho thread: hand the message to the event loop
+        self.loop.call_soon_threadsafe(self.dispatch, msg.topic, msg.payload)
+
+    def dispatch(self, topic, raw):
+        with self.dispatch_stage.time():
+            self._dispatch(topic, raw)
+
+    def _dispatch(self, topic, raw):
+        try:
+            payload = self.payload.decode(topic, raw)
+        except Exception as e:
+            self.dispatch_stage.error()
+            LOG.error("on_message %s: %s", topic, e)
+            return
+
+        # Topics are edge/<room>/... or cloud/<room>/...; cloud/suggestion is for all rooms
+        if topic == TOPIC_SUGGESTION_ALL:
+            self.alerts.apply_suggestion(payload)
+            targets = self.devices
+        else:
+            parts = topic.split('/')
+            targets = self.rooms.get(parts[1], []) if len(parts) > 2 else []
+
+        for device in targets:
+            try:
+                device.handler.on_message(topic, payload)
+            except Exception as e:
+                self.dispatch_stage.error()
+                LOG.error("%s on_message: %s", device.name, e)
+
+    # ---------- reports ----------
+
+    def load_report_counters(self):
+        try:
+            with self.db_writer.pool.connection() as conn:
+                for device in self.devices:
+                    device.handler.load(conn, HISTORY_RELOAD)
+        except Exception as e:
+            LOG.error("Loading report counters: %s", e)
+
+    def generate_reports(self):
+        LOG.info("Generating reports")
+        day = datetime.now().date()
+        for device in self.devices:
+            try:
+                with self.db_writer.pool.connection() as conn:
+                    title, report = device.handler.build_report(conn, day)
+                self.discord.send_embed(title, report, color=5814783)
+            except Exception as e:
+                LOG.error("generate_report %s: %s", device.name, e)
+
+    def _in_background(self, job):
+        # Reports and retention block on the database, so keep them off the loop
+        self.loop.run_in_executor(None, job)
+
+    def _expire_commands(self):
+        for device in self.devices:
+            if device.ROLE == "inside":
+                device.handler.commands.expire()
+
+    def _schedule_jobs(self):
+        self.scheduler.daily(REPORT_TIME, partial(self._in_background, self.generate_reports))
+        self.scheduler.every(3600, partial(self._in_background, self.retention.run))
+        if ARCHIVE_ENABLED:
+            self.scheduler.daily(ARCHIVE_TIME, partial(self._in_background, self.archive.run))
+        self.scheduler.every(min(0.25, COMMAND_ACK_TIMEOUT / 4), self._expire_commands)
+        LOG.info("Scheduler started. Waiting for %s every day...", REPORT_TIME)
+
+    # ---------- lifecycle ----------
+
+    async def run(self):
+        configure_logging(LOG_LEVEL, LOG_LEVELS)
+        self.loop = asyncio.get_running_loop()
+        self._stopped = asyncio.Event()
+
+        self.db_writer.start()
+        if self.db_writer.enabled:
+            await self.loop.run_in_executor(None, self.load_report_counters)
+        self.discord.start()
+        start_metrics_server(METRICS_HOST, METRICS_PORT)
+        start_history_server(HISTORY_HOST, HISTORY_PORT, {device.handler.history.name: device.handler.history for device in self.devices})
+
+        # Connect in the background; data is spooled until the broker answers
+        self.mqtt.connect_async(self.broker, self.broker_port, 60)
+        self.mqtt.loop_start()
+        self.mqtt_out.start()
+        self.publisher.start()
+
+        for device in self.devices:
+            device.open()
+        LOG.info("Edge daemon running %d devices in %d rooms", len(self.devices), len(self.rooms))
+
+        self.scheduler = AsyncScheduler(self.loop, name="Scheduler daemon")
+        self._schedule_jobs()
+        try:
+            await self._stopped.wait()
+        finally:
+            self.scheduler.stop()
+            self.shutdown()
+
+    def stop(self):
+        # Thread-safe request to end run()
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self._stopped.set)
+
+    def shutdown(self):
+        for device in self.devices:
+            device.close()
+            device.handler.flush()
+        self.publisher.stop()
+        self.mqtt_out.stop()
+        self.mqtt.loop_stop()
+        self.mqtt.disconnect()
+        self.db_writer.stop()
+        self.discord.stop()
+        stop_logging()
+
+# =============================================================================
+# MAIN EXECUTION
+# =============================================================================
+
+def main():
+    # Optional argument: path to the device map
+    path = sys.argv[1] if len(sys.argv) > 1 else DEVICE_MAP_FILE
+    daemon = EdgeDaemon(load_device_map(path))
+    try:
+        asyncio.run(daemon.run())
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+import json
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from log import get_logger
+from metrics import counter, stage
+
+LOG = get_logger("history")
+
+# =============================================================================
+# IN-MEMORY RING OF READINGS
+# =============================================================================
+
+class HistoryRing:
+    # Fixed-size ring of the most recent readings: one array('d') for the
+    # timestamps and one per field, so a day of 1 Hz readings costs a few
+    # MB and no per-reading objects. Readings arrive in time order, which
+    # lets range lookups binary-search the timestamps.
+    def __init__(self, fields, capacity):
+        self.fields = tuple(fields)
+        self.capacity = capacity
+        self._ts = array('d', bytes(8 * capacity))
+        self._columns = [array('d', bytes(8 * capacity)) for _ in self.fields]
+        self._start = 0  # Physical index of the oldest reading
+        self._count = 0
+        self._lock = threading.Lock()
+
+        # Every reading at or after this time is in the ring
+        self.covered_from = time.time()
+
+    def append(self, ts, values):
+        with self._lock:
+            i = (self._start + self._count) % self.capacity
+            self._ts[i] = ts
+            for column, value in zip(self._columns, values):
+                column[i] = value
+            if self._count < self.capacity:
+                self._count += 1
+            else:
+                # Overwrote the oldest reading
+                self._start = (self._start + 1) % self.capacity
+                self.covered_from = self._ts[self._start]
+
+    def __len__(self):
+        return self._count
+
+    def range(self, start, end):
+        # Readings with start <= ts < end as (timestamps, [column, ...]) lists
+        with self._lock:
+            lo = self._search(start)
+            hi = self._search(end)
+            if lo >= hi:
+                return [], [[] for _ in self.fields]
+            a = (self._start + lo) % self.capacity
+            b = (self._start + hi) % self.capacity
+            if a < b:
+                return self._ts[a:b].tolist(), [column[a:b].tolist() for column in self._columns]
+            return (self._ts[a:].tolist() + self._ts[:b].tolist(),
+                    [column[a:].tolist() + column[:b].tolist() for column in self._columns])
+
+    def _search(self, ts):
+        # First logical index whose timestamp is >= ts
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._ts[(self._start + mid) % self.capacity] < ts:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+# =============================================================================
+# BUCKET AGGREGATION
+# =============================================================================
+
+def bucket_rows(timestamps, columns, bucket, buckets=None):
+    # Partial aggregates per bucket start: [count, mins, maxes, sums], the
+    # same shape the SQL query returns so both sources merge. Timestamps
+    # are sorted, so each bucket is one slice reduced by the builtins.
+    buckets = {} if buckets is None else buckets
+    i, n = 0, len(timestamps)
+    while i < n:
+        key = timestamps[i] // bucket * bucket
+        j = bisect_left(timestamps, key + bucket, i)
+        slices = [column[i:j] for column in columns]
+        merge_bucket(buckets, key, j - i, [min(v) for v in slices], [max(v) for v in slices], [sum(v) for v in slices])
+        i = j
+    return buckets
+
+def merge_bucket(buckets, key, count, mins, maxes, sums):
+    agg = buckets.get(key)
+    if agg is None:
+        buckets[key] = [count, list(mins), list(maxes), list(sums)]
+        return
+    agg[0] += count
+    for i in range(len(mins)):
+        agg[1][i] = min(agg[1][i], mins[i])
+        agg[2][i] = max(agg[2][i], maxes[i])
+        agg[3][i] += sums[i]
+
+def finish_buckets(buckets, fields):
+    rows = []
+    for key in sorted(buckets):
+        count, mins, maxes, sums = buckets[key]
+        row = {"ts": key, "count": count}
+        for i, field in enumerate(fields):
+            row[f"{field}_min"] = mins[i]
+            row[f"{field}_max"] = maxes[i]
+            row[f"{field}_avg"] = round(sums[i] / count, 3)
+        rows.append(row)
+    return rows
+
+# =============================================================================
+# HISTORY STORE
+# =============================================================================
+
+class HistoryStore:
+    # Range queries over one series. The part of the range still in the
+    # ring is answered from memory; only older data is read from the
+    # writer's table with an indexed range scan on time (and the scope
+    # columns, e.g. room). With a bucket size the database aggregates its
+    # part with GROUP BY, so raw rows never leave the database.
+    #
+    # columns maps each ring field to the SQL expression that yields the
+    # same number from the table, e.g. {"loud": "sound = 'Yes'"}.
+    def __init__(self, name, ring, writer, table, columns, scope=None, max_rows=10000):
+        self.name = name
+        self.ring = ring
+        self.writer = writer
+        self.table = table
+        self.columns = columns
+        self.scope = dict(scope or {})
+        self.max_rows = max_rows
+
+        label = name.lower().replace(" ", ".").replace("/", ".")
+        self._stage = stage(f"history.{label}.query")
+        self.queries = {"memory": 0, "database": 0}
+        for source in self.queries:
+            counter("history_queries_total", "History queries by the oldest source they needed",
+                    lambda source=source: self.queries[source], series=name, source=source)
+
+    def add(self, ts, values):
+        self.ring.append(ts, values)
+
+    def load_recent(self, conn, seconds):
+        # Refill the ring from the table after a restart
+        since = time.time() - seconds
+        rows = self._select(conn, since, time.time(), None, self.ring.capacity, newest=True)
+        for row in reversed(rows):
+            self.ring.append(row[0], row[1:])
+        # A full ring only covers back to its oldest row
+        self.ring.covered_from = rows[-1][0] if len(rows) >= self.ring.capacity else since
+        LOG.info("History %s: loaded %d readings", self.name, len(rows))
+
+    def query(self, start, end, bucket=None, fields=None):
+        with self._stage.time():
+            return self._query(start, end, bucket, fields)
+
+    def _query(self, start, end, bucket, fields):
+        fields = list(fields or self.ring.fields)
+        unknown = [field for field in fields if field not in self.ring.fields]
+        if unknown:
+            raise ValueError(f"unknown fields {unknown}")
+        picks = [self.ring.fields.index(field) for field in fields]
+
+        # Split the range at the oldest reading the ring still covers
+        boundary = max(start, min(end, self.ring.covered_from))
+        use_db = start < boundary and self.writer.enabled
+        self.queries["database" if use_db else "memory"] += 1
+
+        timestamps, columns = self.ring.range(boundary, end)
+        columns = [columns[i] for i in picks]
+
+        if bucket:
+            buckets = {}
+            if use_db:
+                with self.writer.pool.connection() as conn:
+                    for key, count, *stats in self._select(conn, start, boundary, bucket, None, fields=fields):
+                        n = len(fields)
+                        merge_bucket(buckets, key, count, stats[0:n], stats[n:2 * n], stats[2 * n:3 * n])
+            bucket_rows(timestamps, columns, bucket, buckets)
+            rows = finish_buckets(buckets, fields)
+        else:
+            rows = []
+            if use_db:
+                with self.writer.pool.connection() as conn:
+                    rows = [dict(zip(["ts"] + fields, row))
+                            for row in self._select(conn, start, boundary, None, self.max_rows + 1, fields=fields)]
+            rows += [dict(zip(["ts"] + fields, values)) for values in zip(timestamps, *columns)]
+
+        truncated = len(rows) > self.max_rows
+        return {
+            "series": self.name,
+            "start": start,
+            "end": end,
+            "bucket": bucket,
+            "source": "database" if use_db else "memory",
+            "truncated": truncated,
+            "rows": rows[:self.max_rows],
+        }
+
+    def _select(self, conn, start, end, bucket, limit, fields=None, newest=False):
+        # Range scan on (scope..., time); expressions come from the store's
+        # own column map, never from the request
+        backend = self.writer.backend
+        expressions = [self.columns[field] for field in (fields or self.ring.fields)]
+        where = " AND ".join([f"{key} = %s" for key in self.scope] + ["time >= %s", "time < %s"])
+        params = list(self.scope.values()) + [datetime.fromtimestamp(start), datetime.fromtimestamp(end)]
+
+        if bucket:
+            stats = ([f"MIN({e})" for e in expressions] + [f"MAX({e})" for e in expressions] +
+                     [f"SUM({e})" for e in expressions])
+            sql = (f"SELECT {backend.floor(backend.epoch('time') + ' / %s')} * %s AS bucket, COUNT(*), {', '.join(stats)} "
+                   f"FROM {self.table} WHERE {where} GROUP BY bucket ORDER BY bucket")
+            params = [bucket, bucket] + params
+        else:
+            order = "DESC" if newest else "ASC"
+            sql = (f"SELECT {backend.epoch('time')}, {', '.join(expressions)} FROM {self.table} "
+                   f"WHERE {where} ORDER BY time {order} LIMIT {int(limit)}")
+
+        with conn.cursor() as cur:
+            cur.execute(sql, params)
+            return [tuple(float(v) if v is not None else None for v in row) for row in cur.fetchall()]
+
+# =============================================================================
+# HTTP ENDPOINT
+# =============================================================================
+
+MAX_BUCKETS = 10000  # Rejects bucket sizes that would return more rows than this
+
+def parse_time(value, default):
+    # Epoch seconds or ISO 8601 ("2025-06-01T12:00:00")
+    if value is None:
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+class _HistoryHandler(BaseHTTPRequestHandler):
+    stores = {}
+
+    def do_GET(self):
+        # GET /history/<series>?start=..&end=..&bucket=<seconds>&fields=a,b
+        url = urlparse(self.path)
+        if not url.path.startswith("/history/"):
+            self._reply(404, {"error": "not found", "series": sorted(self.stores)})
+            return
+        store = self.stores.get(url.path[len("/history/"):].strip("/"))
+        if store is None:
+            self._reply(404, {"error": "unknown series", "series": sorted(self.stores)})
+            return
+
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        try:
+            end = parse_time(query.get("end"), time.time())
+            start = parse_time(query.get("start"), end - 3600)
+            bucket = float(query["bucket"]) if query.get("bucket") else None
+            fields = query["fields"].split(",") if query.get("fields") else None
+            if start >= end:
+                raise ValueError("start must be before end")
+            if bucket is not None and (bucket <= 0 or (end - start) / bucket > MAX_BUCKETS):
+                raise ValueError(f"bucket must be positive and give at most {MAX_BUCKETS} buckets")
+            result = store.query(start, end, bucket, fields)
+        except ValueError as e:
+            self._reply(400, {"error": str(e)})
+            return
+        except Exception as e:
+            LOG.error("History query %s failed: %s", url.path, e)
+            self._reply(503, {"error": "history unavailable"})
+            return
+        self._reply(200, result)
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass  # Dashboards poll often; errors are printed above
+
+def start_history_server(host, port, stores):
+    # stores: series name -> HistoryStore; port 0 or None disables the API
+    if not port:
+        return None
+    handler = type("HistoryHandler", (_HistoryHandler,), {"stores": dict(stores)})
+    try:
+        server = ThreadingHTTPServer((host, port), handler)
+    except OSError as e:
+        LOG.error("History API on %s:%s failed: %s", host, port, e)
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="history-http", daemon=True).start()
+    LOG.info("History API at http://%s:%s/history/{%s}", host, port, ",".join(sorted(stores)))
+    return server
@@ -1,12 +1,26 @@
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Common'))
 import serial
-import pymysql
-from datetime import datetime
 import time
 import threading
 import paho.mqtt.client as mqtt
-import json
-import requests
-import schedule
+from archive import ArchiveJob
+from db_writer import DBWriter
+from discord_dispatcher import DiscordDispatcher
+from history import start_history_server
+from log import configure_logging, get_logger, stop_logging
+from metrics import stage, start_metrics_server
+from mqtt_publisher import BoundedPublisher
+from mqtt_spool import MessageSpool, SpooledPublisher
+from payload_codec import PayloadCodec
+from rollup import RetentionJob
+from room_handlers import InsideRoom
+from scheduler import TimerScheduler
+from serial_protocol import INSIDE_FRAMES, make_decoder, parse_inside_text
+from serial_reader import SerialReader
+from serial_writer import SerialWriter
+from storage import ensure_index, make_backend
 
 # =============================================================================
 # CONFIGURATION SECTION
@@ -14,304 +28,459 @@ import schedule
 
 # MQTT Configuration
 MQTT_BROKER = "172.20.10.14" # Change to cloud VM server address
+MQTT_PORT = 1883
 MQTT_SUBS_EDGE_TOPIC = "edge/outside/data"
 MQTT_PUBS_EDGE_TOPIC = "edge/outside/status"
-MQTT_SUBS_CLOUD_TOPIC_CONTROL = "cloud/control/#"
+MQTT_SUBS_CLOUD_TOPIC_CONTROL = "cloud/control/"  # + actuator name (mode, led, fan, door)
 MQTT_SUBS_CLOUD_TOPIC_SUGGESTION = "cloud/suggestion"
 MQTT_PUBS_CLOUD_TOPIC = "edge/inside/data"
+MQTT_PUBS_COMMAND_ACK_TOPIC = "edge/inside/ack"  # Command results for the cloud
+
+# Commands: the sketch acknowledges each one; unanswered commands are
+# reported as timed out so the dashboard RPC never hangs
+COMMAND_ACK_TIMEOUT = 2.0  # Seconds
+
+# Outside readings forwarded to the Arduino: a line identical to the last
+# one sent is skipped until this many seconds have passed
+FORWARD_REFRESH_INTERVAL = 60.0
+
+# Store-and-forward spool for outgoing data while the broker is unreachable
+MQTT_DATA_QOS = 1                    # QoS for spooled data messages
+SPOOL_DIR = "spool/inside"
+SPOOL_MAX_BYTES = 64 * 1024 * 1024   # Oldest messages are dropped beyond this
+SPOOL_SEGMENT_BYTES = 1024 * 1024    # Size of each spool file
+SPOOL_REPLAY_RATE = 200              # Messages per second replayed after reconnect
+SPOOL_REPLAY_BATCH = 50              # Messages per replay batch
+
+# Outbound MQTT queue: QoS and overflow policy per topic filter (see
+# Common/mqtt_publisher.py). Spooled data fails when the queue is full,
+# so the frame goes to the spool instead of being lost; the sensor status
+# drops its oldest message. Command results fail instead of blocking: they
+# are published from the serial reader thread and from paho's on_message,
+# neither of which may wait for the queue (as in edge_daemon.py)
+MQTT_TOPIC_POLICIES = {
+    MQTT_PUBS_CLOUD_TOPIC: (MQTT_DATA_QOS, "fail"),
+    MQTT_PUBS_EDGE_TOPIC: (0, "drop_oldest"),
+    MQTT_PUBS_COMMAND_ACK_TOPIC: (1, "fail"),
+}
+MQTT_QUEUE_SIZE = 1000    # Messages waiting for the broker
+MQTT_MAX_INFLIGHT = 20    # Messages sent and not yet acknowledged
+
+# Payload encoding of published messages: "json", "struct" (compact binary
+# with a fixed schema per topic), "msgpack" or "cbor". Received messages are
+# decoded whatever their encoding (see Common/payload_codec.py)
+PAYLOAD_CODEC = "json"
 
 # Discord Integration
 DISCORD_WEBHOOK_URL = "https://discord.com/api/webhooks/1375385948715487243/18tL62HUw6PFjRXGYorL1Age2WsKibXKvwc5zlJGQCLdNlp9O6B6cBvC9tg_grTRz9_O"
+DISCORD_COALESCE_WINDOW = 5.0  # Alerts within this many seconds share one message
+DISCORD_TIMEOUT = 5.0          # Seconds before a webhook request is abandoned
+
+# Database Configuration
+DB_BACKEND = "mysql"   # "mysql", or "sqlite" for boards without a MySQL server
+DB_SQLITE_PATH = "actuatorslog.db"
+DB_HOST = "localhost"
+DB_USER = "root"
+DB_PASSWORD = "12345678"
+DB_NAME = "actuatorslog"
+DB_ENABLED = True      # False runs without a database (nothing is stored)
+DB_POOL_SIZE = 2
+DB_QUEUE_SIZE = 5000     # Status frames buffered while the database is slow
+DB_BATCH_SIZE = 50       # Rows per executemany() batch
+DB_FLUSH_INTERVAL = 2.0  # Maximum seconds a status frame waits before being written
+SUMMARY_CHECKPOINT_INTERVAL = 60.0  # Seconds between report counter checkpoints
+
+# Data Retention
+RAW_RETENTION_DAYS = 30             # Raw status frames kept in logs
+MINUTE_ROLLUP_RETENTION_DAYS = 90   # Minute aggregates kept (hourly kept forever)
+RETENTION_CHUNK_SIZE = 1000         # Rows deleted per statement
+ROLLUP_MAX_GAP = 30.0               # Seconds a state is assumed to hold without frames
+
+# Archive Export: complete days of raw status frames are streamed to gzip CSV
+# files. An index.json lets each run continue where the last one stopped.
+# Archived rows are deleted after ARCHIVE_DELETE_AFTER_DAYS (None keeps
+# them until RAW_RETENTION_DAYS, which stays as the backstop).
+ARCHIVE_ENABLED = True
+ARCHIVE_DIR = "archive/actuatorslog"
+ARCHIVE_TIME = "00:30"
+ARCHIVE_CHUNK_ROWS = 5000
+ARCHIVE_DELETE_AFTER_DAYS = None
+
+# Report Analytics: the day's status frames streamed through NumPy in chunks
+REPORT_CHUNK_ROWS = 5000  # Rows fetched per chunk (bounds report memory)
+
+# Serial Configuration
+SERIAL_PORT = "/dev/ttyACM0"
+SERIAL_BAUD = 9600
+
+# Serial Protocol: "text" lines or "framed" binary frames
+# (must match FRAMED_PROTOCOL in the Arduino sketch)
+SERIAL_PROTOCOL = "text"
+
+# Metrics Endpoint (Prometheus text format; port 0 disables it)
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9102
+
+# History API: recent status frames from memory, older ones from the database (port 0 disables it)
+HISTORY_HOST = "127.0.0.1"
+HISTORY_PORT = 9112
+HISTORY_CAPACITY = 28800   # Status frames kept in memory (a day at one per 3 s)
+HISTORY_RELOAD = 24 * 3600  # Seconds refilled from the database at startup
+
+# Logging: lines are written by a background thread (see Common/log.py).
+# Levels per category, e.g. {"mqtt.received": "WARNING"}; per-message
+# categories are sampled to LOG_SAMPLE_RATE lines per second
+LOG_LEVEL = "INFO"
+LOG_LEVELS = {}
+LOG_SAMPLE_RATE = 5
 
 # =============================================================================
 # GLOBAL VARIABLES
 # =============================================================================
 
-# Track last actuator states for change detection
-last_state = {"led": None, "door": None, "fan": None}
+# Loggers per category (see LOG_LEVELS); per-message lines are sampled
+LOG = get_logger("inside")
+MQTT_LOG = get_logger("mqtt")
+RECEIVED_LOG = get_logger("mqtt.received", rate=LOG_SAMPLE_RATE)
+PUBLISHED_LOG = get_logger("mqtt.published", rate=LOG_SAMPLE_RATE)
+SERIAL_LOG = get_logger("serial.sent", rate=LOG_SAMPLE_RATE)
 
 # =============================================================================
 # HARDWARE INITIALIZATION
 # =============================================================================
 
-# Initialize Arduino serial connection
-arduino = serial.Serial('/dev/ttyACM0', 9600, timeout=1)
+# Created by start() so the module can be imported without hardware
+arduino = None
+MQTT_CLIENT = None
+MQTT_OUT = None
+MQTT_PUBLISHER = None
+SERIAL_READER = None
+SERIAL_WRITER = None
+PAYLOAD = None
 
-# Initialize MQTT client
-MQTT_CLIENT = mqtt.Client()
-MQTT_CLIENT.connect(MQTT_BROKER, 1883, 60)
+def init_hardware(serial_port=SERIAL_PORT, broker=MQTT_BROKER, broker_port=MQTT_PORT):
+    global arduino, MQTT_CLIENT
+
+    # Initialize Arduino serial connection
+    arduino = serial.Serial(serial_port, SERIAL_BAUD, timeout=1)
+
+    # Initialize MQTT client; connects (and reconnects) in the background
+    # so readings are spooled while the broker is unreachable
+    MQTT_CLIENT = mqtt.Client()
+    MQTT_CLIENT.reconnect_delay_set(1, 30)
+    MQTT_CLIENT.connect_async(broker, broker_port, 60)
 
 # =============================================================================
 # MQTT EVENT HANDLERS
 # =============================================================================
 
+# Per-stage timings exported on the metrics endpoint
+PROCESS_STAGE = stage("inside.process")
+PUBLISH_STAGE = stage("inside.mqtt_publish")
+ON_MESSAGE_STAGE = stage("inside.on_message")
+
 def on_connect(client, userdata, flags, rc):
-    print(f"[MQTT] Connected with result code {rc}")
-    client.subscribe(MQTT_SUBS_EDGE_TOPIC)
-    client.subscribe(MQTT_SUBS_CLOUD_TOPIC_CONTROL)
-    client.subscribe(MQTT_SUBS_CLOUD_TOPIC_SUGGESTION)
+    MQTT_LOG.info("Connected with result code %s", rc)
+    for topic in ROOM.topics():
+        client.subscribe(topic)
+
+def on_disconnect(client, userdata, rc):
+    MQTT_LOG.warning("Disconnected with result code %s, spooling until reconnected", rc)
 
 def on_message(client, userdata, msg):
-    global current_mode
     topic = msg.topic
-    payload_str = msg.payload.decode()
-    print(f"[MQTT] Message received: {topic} -> {payload_str}")
 
     try:
-        # Handle outside sensor data
-        if topic == MQTT_SUBS_EDGE_TOPIC:
-            payload = json.loads(payload_str)
-            temp = payload["temperature"]
-            light = payload["light"]
-            sound = payload["sound"]
-
-            # Forward sensor data to Arduino
-            send_to_arduino(f"sensor:outside,temp:{temp},light:{light},sound:{sound}")
-        
-        # Handle mode control commands
-        elif topic == "cloud/control/mode":
-            payload = json.loads(payload_str)
-            new_mode = payload.get("mode","").lower()
-
-            if new_mode in ["auto", "manual"]:
-                current_mode = new_mode
-                send_discord_alert(f"⚙️⚙️ CONTROL MODE changed to {current_mode.upper()} ⚙️⚙️")
-
-            # Send mode update to Arduino
-            send_to_arduino(f"mode:{current_mode}")          
-            
-        # Handle actuator control commands
-        elif topic.startswith("cloud/control/"):
-            # Check if system is in auto mode
-            if current_mode == "auto":
-                print("[INFO] Ignoring actuator command in AUTO mode.")
-                send_discord_alert("⚠️⚠️ WARING: SYSTEM in AUTO MODE, IGNORED COMMAND ⚠️⚠️")
-                return  # Ignore command in auto mode
-            
-            # Extract actuator type from topic
-            actuator = topic.split("/")[-1]
-            payload = json.loads(payload_str)
-            value = str(payload.get(f"{actuator}", "")).lower()
-
-            # Send command to Arduino
-            command = f"{actuator}:{value}"
-            send_to_arduino(command)
-            handle_actuator_command(command)             
-
-        # Handle cloud weather suggestions
-        elif topic == MQTT_SUBS_CLOUD_TOPIC_SUGGESTION:
-            payload = json.loads(payload_str)
-            message = payload.get("message", "")
-
-            # Send weather message to Discord
-            send_discord_alert(f"🌤️🌤️ MESSAGE FROM CLOUD: {message}🌤️🌤️")
-
-            # Update temperature threshold
-            temp_threshold = payload.get("temp threshold", 30.0)
-            temp_threshold_str = f"threshold:{temp_threshold}"
-            send_to_arduino(temp_threshold_str)
+        with ON_MESSAGE_STAGE.time():
+            # Any payload encoding; the first byte tells which
+            payload = PAYLOAD.decode(topic, msg.payload)
+            RECEIVED_LOG.info("Message received: %s -> %s", topic, payload)
+
+            # Outside readings, mode and actuator commands, suggestions (see room_handlers.py)
+            ROOM.on_message(topic, payload)
 
     except Exception as e:
-        print("[ERROR] on_message:", e)
+        LOG.error("on_message: %s", e)
+
+def publish(topic, message, spooled=True):
+    # Data goes through the spool so nothing is lost while offline;
+    # sensor status and command results are sent straight away
+    payload = PAYLOAD.encode(topic, message)
+    with PUBLISH_STAGE.time():
+        if spooled:
+            MQTT_PUBLISHER.publish(topic, payload, MQTT_DATA_QOS)
+        else:
+            MQTT_OUT.publish(topic, payload)
+    PUBLISHED_LOG.info("Published: %s to %s", message, topic)
 
 # =============================================================================
 # SERIAL COMMUNICATION FUNCTIONS
 # =============================================================================
 
-def send_to_arduino(message: str):
-    try:
-        arduino.write((message + '\n').encode())
-        print(f"[Serial] Sent to Arduino: {message}")
-    except Exception as e:
-        print("[ERROR] Sending to Arduino:", e)
-
-def handle_actuator_command(cmd: str):
-    global last_state
-    try:
-        key, value = cmd.split(':')
-        if key in last_state and last_state[key] != value:
-            send_discord_alert(f"🔄🔄 ACTUATOR '{key.upper()}' CHANGED TO: {value.upper()} 🔄🔄")
-            last_state[key] = value
-    except Exception as e:
-        print("[ERROR] handle_actuator_command:", e)
+def send_to_arduino(message: str, kind="command"):
+    # Queued for the writer thread: commands first, then the latest
+    # threshold, then the latest outside reading (see serial_writer.py)
+    SERIAL_WRITER.send(message, kind)
+    SERIAL_LOG.info("Queued for Arduino: %s", message)
 
 # =============================================================================
 # NOTIFICATION FUNCTIONS
 # =============================================================================
 
+# Background dispatcher so webhook calls never stall MQTT or serial handling
+DISCORD = DiscordDispatcher(
+    DISCORD_WEBHOOK_URL,
+    coalesce_window=DISCORD_COALESCE_WINDOW,
+    timeout=DISCORD_TIMEOUT
+)
+
 def send_discord_alert(message):
-    data = {"content": message}
-    try:
-        requests.post(DISCORD_WEBHOOK_URL, json=data)
-    except Exception as e:
-        print("[ERROR] Discord alert failed:", e)
+    # Non-blocking: the message is queued for the dispatcher
+    DISCORD.send(message)
 
 # =============================================================================
 # DATABASE FUNCTIONS
 # =============================================================================
 
-def get_db_connection(host='localhost', user='root', password='12345678', db='actuatorslog'):
+# Minute and hour aggregates share one layout (durations in seconds)
+ACTUATOR_ROLLUP_COLUMNS = '''
+        bucket DATETIME PRIMARY KEY,
+        samples INT NOT NULL,
+        observed_s DOUBLE NOT NULL,
+        led_on_s DOUBLE NOT NULL, fan_on_s DOUBLE NOT NULL,
+        door_open_s DOUBLE NOT NULL, mode_manual_s DOUBLE NOT NULL,
+        led_changes INT NOT NULL, fan_changes INT NOT NULL,
+        door_changes INT NOT NULL, mode_changes INT NOT NULL
+'''
+
+# Tables are created once when the writer starts
+ACTUATORS_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS logs (
+        time DATETIME,
+        led VARCHAR(20),
+        fan VARCHAR(20),
+        door VARCHAR(20),
+        mode VARCHAR(20)
+    )
+    ''',
+    ensure_index("logs", ("time",), "idx_logs_time"),
+    '''
+    CREATE TABLE IF NOT EXISTS daily_summary (
+        day DATE PRIMARY KEY,
+        total INT NOT NULL DEFAULT 0,
+        led_on INT NOT NULL DEFAULT 0,
+        door_open INT NOT NULL DEFAULT 0,
+        fan_on INT NOT NULL DEFAULT 0,
+        mode_manual INT NOT NULL DEFAULT 0
+    )
+    ''',
+    f"CREATE TABLE IF NOT EXISTS actuator_rollup_minute ({ACTUATOR_ROLLUP_COLUMNS})",
+    f"CREATE TABLE IF NOT EXISTS actuator_rollup_hour ({ACTUATOR_ROLLUP_COLUMNS})"
+]
+
+# MySQL server or local SQLite file, chosen by DB_BACKEND
+STORAGE = make_backend(DB_BACKEND, DB_HOST, DB_USER, DB_PASSWORD, DB_NAME, DB_SQLITE_PATH)
+
+def get_db_connection():
     try:
-        conn = pymysql.connect(host=host, user=user, password=password, database=db)
-        cur = conn.cursor()
-        
-        # Create table if it doesn't exist
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS logs (
-                time DATETIME,
-                led VARCHAR(20),
-                fan VARCHAR(20),
-                door VARCHAR(20),
-                mode VARCHAR(20)
-            )
-        ''')
-        conn.commit()
-        return conn
+        return STORAGE.connect()
     except Exception as e:
-        print(f"[ERROR] Database connection failed: {e}")
+        LOG.error("Database connection failed: %s", e)
         return None
 
+# Long-lived writer shared by the logging thread and the reports
+DB_WRITER = DBWriter(
+    get_db_connection,
+    schema=ACTUATORS_SCHEMA,
+    pool_size=DB_POOL_SIZE,
+    max_queue=DB_QUEUE_SIZE,
+    batch_size=DB_BATCH_SIZE,
+    flush_interval=DB_FLUSH_INTERVAL,
+    name="DB actuatorslog",
+    backend=STORAGE
+)
+
+# Pruning of expired rows
+RETENTION = RetentionJob(
+    DB_WRITER.pool,
+    [
+        ("logs", "time", RAW_RETENTION_DAYS),
+        ("actuator_rollup_minute", "bucket", MINUTE_ROLLUP_RETENTION_DAYS),
+    ],
+    chunk_size=RETENTION_CHUNK_SIZE,
+    backend=STORAGE
+)
+ARCHIVE = ArchiveJob(
+    DB_WRITER.pool,
+    STORAGE,
+    [("logs", "time")],
+    ARCHIVE_DIR,
+    chunk_rows=ARCHIVE_CHUNK_ROWS,
+    delete_after_days=ARCHIVE_DELETE_AFTER_DAYS,
+    delete_chunk=RETENTION_CHUNK_SIZE
+)
+
+def load_report_counters():
+    try:
+        with DB_WRITER.pool.connection() as conn:
+            ROOM.load(conn, HISTORY_RELOAD)
+    except Exception as e:
+        LOG.error("Loading report counters: %s", e)
+
 def log_data():
     while True:
+        # Wait for the next parsed message from the serial reader
+        received_at, record = SERIAL_READER.get()
         try:
-            if arduino.in_waiting:
-                msg = arduino.readline().decode().strip()
-
-                # Process actuator status messages
-                if msg.startswith("ACTUATORS|"):
-                    parts = msg.split(',')
-                    current_mode = parts[0].split(':')[1]
-                    led = parts[1].split(':')[1]
-                    fan = parts[2].split(':')[1]
-                    door = parts[3].split(':')[1]                   
-                    now = datetime.now()
-
-                    # Log to database
-                    conn = get_db_connection()
-                    cur = conn.cursor()
-                    cur.execute("INSERT INTO logs (time, led, fan, door, mode) VALUES (%s, %s, %s, %s, %s)",
-                                (now, led, fan, door, current_mode))
-                    conn.commit()
-                    conn.close()
-
-                    # Publish to MQTT
-                    payload = json.dumps({
-                        "time": now.isoformat(),
-                        "led": led,
-                        "fan": fan,
-                        "door": door,
-                        "mode": current_mode
-                    })
-                    MQTT_CLIENT.publish(MQTT_PUBS_CLOUD_TOPIC, payload)
-                    print(f"[MQTT] Published: {payload} to {MQTT_PUBS_CLOUD_TOPIC}")
-                
-                # Process sensor acknowledgment messages
-                elif msg.startswith("SENSORS|"):
-                    parts = msg.split(',')
-                    ack = parts[0].split(':')[1]
-                    payload = json.dumps({ "sensors": ack })
-                    MQTT_CLIENT.publish(MQTT_PUBS_EDGE_TOPIC, payload)
-                    print(f"[MQTT] Published: {payload} to {MQTT_PUBS_EDGE_TOPIC}")
+            with PROCESS_STAGE.time():
+                # Status frames are stored, counted and published; command
+                # acknowledgements answer their sender (see room_handlers.py)
+                ROOM.handle(received_at, record)
         except Exception as e:
-            print("[ERROR] log_data:", e)
-        time.sleep(1)
+            LOG.error("log_data: %s", e)
+
+# =============================================================================
+# ROOM HANDLER
+# =============================================================================
+
+# Per-frame and per-message logic, shared with the edge daemon; this
+# script runs one room on the edge/inside/... topics and unscoped tables
+ROOM = InsideRoom(
+    DB_WRITER,
+    publish,
+    send_to_arduino,
+    send_discord_alert,
+    MQTT_SUBS_EDGE_TOPIC,
+    MQTT_PUBS_EDGE_TOPIC,
+    MQTT_PUBS_CLOUD_TOPIC,
+    MQTT_SUBS_CLOUD_TOPIC_CONTROL,
+    MQTT_PUBS_COMMAND_ACK_TOPIC,
+    MQTT_SUBS_CLOUD_TOPIC_SUGGESTION,
+    history_capacity=HISTORY_CAPACITY,
+    checkpoint_interval=SUMMARY_CHECKPOINT_INTERVAL,
+    chunk_rows=REPORT_CHUNK_ROWS,
+    max_gap=ROLLUP_MAX_GAP,
+    ack_timeout=COMMAND_ACK_TIMEOUT,
+    forward_refresh=FORWARD_REFRESH_INTERVAL
+)
 
 # =============================================================================
 # REPORTING FUNCTIONS
 # =============================================================================
 
-def generate_reports():
+def generate_reports(start_day=None, end_day=None):
     try:
-        print("[INFO] Generating Report")
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
-        # Define today's time range
-        today = datetime.now().date()
-        start_time = datetime.combine(today, datetime.min.time())
-        end_time = datetime.combine(today, datetime.max.time())
-
-        # Query actuator data for today
-        cursor.execute("""
-            SELECT led, fan, door, mode
-            FROM logs
-            WHERE time BETWEEN %s AND %s
-            ORDER BY time ASC
-        """, (start_time, end_time))
-        actuator_rows = cursor.fetchall()
-
-        # Generate report content
-        actuator_report = "**ACTUATORS REPORT**\n"
-        if not actuator_rows:
-            actuator_report += "No actuator activity recorded today.\n"
-        else:
-            # Count state transitions
-            led_count = door_count = fan_count = mode_count = 0
-            last_led = last_door = last_fan = last_mode = None
-
-            for led, servo, fan, mode in actuator_rows:
-                # Count on transitions
-                if last_led is not None and last_led == " off" and led == " on":
-                    led_count += 1
-                if last_door is not None and last_door == " closed" and servo == " open":
-                    door_count += 1
-                if last_fan is not None and last_fan == " off" and fan == " on":
-                    fan_count += 1
-                if last_mode is not None and last_mode == " manual" and mode == " auto":
-                    mode_count += 1
-                last_led, last_door, last_fan, last_mode = led, servo, fan, mode
-
-            actuator_report += f"LED turned ON: {led_count} times\n"
-            actuator_report += f"Door opened: {door_count} times\n"
-            actuator_report += f"Fan turned ON: {fan_count} times\n"
-            actuator_report += f"Mode changed to MANUAL: {mode_count} times\n"
-
-        send_discord_report("⚙️ Daily Actuator Report", actuator_report)
-
-        cursor.close()
-        conn.close()
+        LOG.info("Generating report")
+        with DB_WRITER.pool.connection() as conn:
+            title, actuator_report = ROOM.build_report(conn, start_day, end_day)
+        send_discord_report(title, actuator_report)
 
     except Exception as e:
-            print("[ERROR] generate_report: ", e)
+            LOG.error("generate_report: %s", e)
 
 def send_discord_report(title, content):
-    data = {
-        "embeds": [
-            {
-                "title": title,
-                "description": content,
-                "color": 5814783
-            }
-        ]
-    }
-    requests.post(DISCORD_WEBHOOK_URL, json=data)
+    DISCORD.send_embed(title, content, color=5814783)
+
+# Periodic jobs share one timer thread that sleeps until the next is due
+SCHEDULER = TimerScheduler("Scheduler inside")
 
 def schedule_report():
     # Schedule task to run at specific time daily
     schedule_time = "23:59"
-    schedule.every().day.at(schedule_time).do(generate_reports)
-    print(f"Scheduler started. Waiting for {schedule_time} every day...")
-    while True:
-        schedule.run_pending()
-        time.sleep(10)
+    SCHEDULER.daily(schedule_time, generate_reports)
+
+    # Prune expired raw rows and minute rollups every hour
+    SCHEDULER.every(3600, RETENTION.run)
+
+    # Export finished days to the archive (and delete old archived rows)
+    if ARCHIVE_ENABLED:
+        SCHEDULER.daily(ARCHIVE_TIME, ARCHIVE.run)
+    SCHEDULER.start()
+    LOG.info("Scheduler started. Waiting for %s every day...", schedule_time)
 
 # =============================================================================
 # MAIN EXECUTION
 # =============================================================================
 
-# Configure MQTT client     
-MQTT_CLIENT.on_message = on_message
-MQTT_CLIENT.on_connect = on_connect
-MQTT_CLIENT.loop_start()
-
-# Start background threads
-threading.Thread(target=log_data, daemon=True).start()
-threading.Thread(target=schedule_report, daemon=True).start()
-
-# Keep main thread alive
-try:
-    while True:
-        time.sleep(1)
-except KeyboardInterrupt:
+def start(serial_port=SERIAL_PORT, broker=MQTT_BROKER, broker_port=MQTT_PORT, db_enabled=DB_ENABLED):
+    global SERIAL_READER, SERIAL_WRITER, MQTT_OUT, MQTT_PUBLISHER, PAYLOAD
+    configure_logging(LOG_LEVEL, LOG_LEVELS)
+    init_hardware(serial_port, broker, broker_port)
+    PAYLOAD = PayloadCodec(PAYLOAD_CODEC, name="Payload inside")
+
+    # One thread writes to the Arduino, by priority (commands before sensor forwards)
+    SERIAL_WRITER = SerialWriter(arduino, name="Serial inside").start()
+
+    # Coalescing command path to the Arduino, acknowledged end to end
+    ROOM.commands.start()
+
+    # Configure MQTT client
+    MQTT_CLIENT.on_message = on_message
+    MQTT_CLIENT.on_connect = on_connect
+    MQTT_CLIENT.on_disconnect = on_disconnect
+    MQTT_CLIENT.loop_start()
+
+    # Every outgoing message goes through one bounded queue
+    MQTT_OUT = BoundedPublisher(
+        MQTT_CLIENT,
+        MQTT_TOPIC_POLICIES,
+        max_queue=MQTT_QUEUE_SIZE,
+        max_inflight=MQTT_MAX_INFLIGHT,
+        name="MQTT inside"
+    ).start()
+
+    # Outgoing data goes through the spool so nothing is lost while offline
+    MQTT_PUBLISHER = SpooledPublisher(
+        MQTT_OUT,
+        MessageSpool(SPOOL_DIR, SPOOL_MAX_BYTES, SPOOL_SEGMENT_BYTES, name="Spool inside"),
+        replay_rate=SPOOL_REPLAY_RATE,
+        batch_size=SPOOL_REPLAY_BATCH,
+        name="Spool inside"
+    ).start()
+
+    # Reader thread that blocks on the serial port and queues decoded messages
+    SERIAL_READER = SerialReader(
+        arduino,
+        make_decoder(SERIAL_PROTOCOL, parse_inside_text, INSIDE_FRAMES, name="Serial inside"),
+        name="Serial inside"
+    )
+
+    # Start database writer, notifier and background threads
+    DB_WRITER.enabled = db_enabled
+    DB_WRITER.start()
+    if db_enabled:
+        load_report_counters()
+    DISCORD.start()
+    start_metrics_server(METRICS_HOST, METRICS_PORT)
+    start_history_server(HISTORY_HOST, HISTORY_PORT, {"actuators": ROOM.history})
+    SERIAL_READER.start()
+    threading.Thread(target=log_data, daemon=True).start()
+    schedule_report()
+
+def stop():
+    SCHEDULER.stop()
+    ROOM.commands.stop()
+    MQTT_PUBLISHER.stop()
+    MQTT_OUT.stop()
     MQTT_CLIENT.loop_stop()
-    MQTT_CLIENT.disconnect()
\ No newline at end of file
+    MQTT_CLIENT.disconnect()
+    SERIAL_READER.stop()
+    SERIAL_WRITER.stop()
+    ROOM.flush()
+    DB_WRITER.stop()
+    DISCORD.stop()
+    stop_logging()
+
+def main():
+    start()
+
+    # Keep main thread alive
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        stop()
+
+if __name__ == "__main__":
+    main()
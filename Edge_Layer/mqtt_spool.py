@@ -0,0 +1,331 @@
+import os
+import struct
+import threading
+import time
+import zlib
+import paho.mqtt.client as mqtt
+from log import get_logger
+from metrics import counter, gauge
+
+LOG = get_logger("spool")
+
+# =============================================================================
+# SEGMENTED MESSAGE SPOOL
+# =============================================================================
+
+# Record: payload length, topic length, QoS, CRC-32 of topic + payload,
+# followed by the topic and payload bytes
+RECORD_HEADER = struct.Struct('<IHBI')
+SEGMENT_SUFFIX = ".seg"
+CURSOR_FILE = "cursor"
+
+class MessageSpool:
+    # Bounded append-only spool of outgoing MQTT messages in numbered segment
+    # files (00000001.seg, ...). A cursor file records how far replay has
+    # got, so unsent messages survive a restart. When the spool exceeds
+    # max_bytes the oldest segment is dropped: the newest readings are kept.
+    def __init__(self, directory, max_bytes=64 * 1024 * 1024, segment_bytes=1024 * 1024, name="Spool"):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        self.name = name
+
+        self._lock = threading.Lock()
+        self._counts = {}  # segment number -> unsent records in it
+        self._sizes = {}   # segment number -> bytes
+        self._head = None  # file object of the segment being appended to
+        self._head_seq = 0
+
+        # Statistics
+        self.spooled = 0
+        self.dropped = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self._cursor = self._load_cursor()
+        self._recover()
+
+    # ---------- public ----------
+
+    def append(self, topic, payload, qos=1):
+        topic_bytes = topic.encode()
+        if isinstance(payload, str):
+            payload = payload.encode()
+        body = topic_bytes + payload
+        record = RECORD_HEADER.pack(len(payload), len(topic_bytes), qos, zlib.crc32(body)) + body
+
+        with self._lock:
+            head_size = self._sizes[self._head_seq]
+            if head_size and head_size + len(record) > self.segment_bytes:
+                self._roll()
+            self._head.write(record)
+            self._head.flush()
+            self._sizes[self._head_seq] += len(record)
+            self._counts[self._head_seq] += 1
+            self.spooled += 1
+            self._enforce_bound()
+
+    def peek(self, max_count):
+        # Oldest unsent records without consuming them:
+        # ([(topic, payload, qos), ...], position after them, {segment: count})
+        with self._lock:
+            records = []
+            consumed = {}
+            seq, offset = self._cursor
+            while len(records) < max_count and seq <= self._head_seq:
+                batch, offset = self._read(seq, offset, max_count - len(records))
+                if batch:
+                    records.extend(batch)
+                    consumed[seq] = consumed.get(seq, 0) + len(batch)
+                if len(records) < max_count:
+                    if seq == self._head_seq:
+                        break
+                    seq, offset = seq + 1, 0
+            return records, (seq, offset), consumed
+
+    def commit(self, position, consumed):
+        # Mark records returned by peek() as delivered
+        with self._lock:
+            if position <= self._cursor:
+                return  # Overtaken by a dropped segment
+            for seq, count in consumed.items():
+                if seq in self._counts:
+                    self._counts[seq] = max(0, self._counts[seq] - count)
+            self._cursor = position
+            self._delete_before(position[0])
+            self._save_cursor()
+
+    def depth(self):
+        with self._lock:
+            return sum(self._counts.values())
+
+    def depth_bytes(self):
+        with self._lock:
+            return sum(self._sizes.values()) - self._cursor[1]
+
+    def close(self):
+        with self._lock:
+            if self._head is not None:
+                self._head.close()
+                self._head = None
+
+    # ---------- segments ----------
+
+    def _path(self, seq):
+        return os.path.join(self.directory, f"{seq:08d}{SEGMENT_SUFFIX}")
+
+    def _segments(self):
+        return sorted(int(f[:-len(SEGMENT_SUFFIX)]) for f in os.listdir(self.directory)
+                      if f.endswith(SEGMENT_SUFFIX) and f[:-len(SEGMENT_SUFFIX)].isdigit())
+
+    def _recover(self):
+        # Count unsent records and cut off a record torn by a crash
+        segments = [s for s in self._segments() if s >= self._cursor[0]]
+        for seq in self._segments():
+            if seq < self._cursor[0]:
+                os.remove(self._path(seq))
+        if not segments:
+            segments = [max(self._cursor[0], 1)]
+            open(self._path(segments[0]), "ab").close()
+        if self._cursor[0] < segments[0]:
+            self._cursor = (segments[0], 0)
+
+        for seq in segments:
+            offset = self._cursor[1] if seq == self._cursor[0] else 0
+            count, valid_end = self._scan(seq, offset)
+            size = os.path.getsize(self._path(seq))
+            if valid_end < size:
+                LOG.warning("%s: truncating %d corrupt bytes from segment %d", self.name, size - valid_end, seq)
+                with open(self._path(seq), "r+b") as f:
+                    f.truncate(valid_end)
+                size = valid_end
+            self._counts[seq] = count
+            self._sizes[seq] = size
+
+        self._head_seq = segments[-1]
+        self._head = open(self._path(self._head_seq), "ab")
+        pending = sum(self._counts.values())
+        if pending:
+            LOG.info("%s: recovered %d unsent messages", self.name, pending)
+
+    def _scan(self, seq, offset):
+        count = 0
+        with open(self._path(seq), "rb") as f:
+            f.seek(offset)
+            while True:
+                header = f.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    return count, offset
+                payload_len, topic_len, _, crc = RECORD_HEADER.unpack(header)
+                body = f.read(topic_len + payload_len)
+                if len(body) < topic_len + payload_len or zlib.crc32(body) != crc:
+                    return count, offset
+                offset += RECORD_HEADER.size + len(body)
+                count += 1
+
+    def _read(self, seq, offset, max_count):
+        records = []
+        if seq not in self._sizes or offset >= self._sizes[seq]:
+            return records, offset
+        with open(self._path(seq), "rb") as f:
+            f.seek(offset)
+            while len(records) < max_count and offset < self._sizes[seq]:
+                payload_len, topic_len, qos, _ = RECORD_HEADER.unpack(f.read(RECORD_HEADER.size))
+                topic = f.read(topic_len).decode()
+                payload = f.read(payload_len)
+                records.append((topic, payload, qos))
+                offset += RECORD_HEADER.size + topic_len + payload_len
+        return records, offset
+
+    def _roll(self):
+        self._head.close()
+        self._head_seq += 1
+        self._head = open(self._path(self._head_seq), "ab")
+        self._counts[self._head_seq] = 0
+        self._sizes[self._head_seq] = 0
+
+    def _enforce_bound(self):
+        # Drop whole oldest segments until the spool fits again
+        while len(self._sizes) > 1 and sum(self._sizes.values()) > self.max_bytes:
+            oldest = min(self._sizes)
+            self.dropped += self._counts.pop(oldest, 0)
+            del self._sizes[oldest]
+            os.remove(self._path(oldest))
+            self._cursor = (oldest + 1, 0)
+            self._save_cursor()
+            LOG.warning("%s: spool full, dropped segment %d", self.name, oldest)
+
+    def _delete_before(self, seq):
+        for old in [s for s in self._sizes if s < seq]:
+            del self._sizes[old]
+            self._counts.pop(old, None)
+            try:
+                os.remove(self._path(old))
+            except OSError:
+                pass
+
+    def _load_cursor(self):
+        try:
+            with open(os.path.join(self.directory, CURSOR_FILE)) as f:
+                seq, offset = f.read().split()
+                return int(seq), int(offset)
+        except (OSError, ValueError):
+            return (0, 0)
+
+    def _save_cursor(self):
+        # Write then rename so a crash never leaves a half-written cursor
+        path = os.path.join(self.directory, CURSOR_FILE)
+        with open(path + ".tmp", "w") as f:
+            f.write(f"{self._cursor[0]} {self._cursor[1]}\n")
+        os.replace(path + ".tmp", path)
+
+# =============================================================================
+# STORE-AND-FORWARD PUBLISHER
+# =============================================================================
+
+class SpooledPublisher:
+    # Publishes straight through paho while the broker is connected and
+    # nothing is waiting. Otherwise messages go to the spool and a replay
+    # thread sends them, oldest first, in batches limited to replay_rate
+    # messages per second. A batch is committed only once paho confirms
+    # it was sent (PUBACK for QoS 1), so delivery is at-least-once.
+    def __init__(self, client, spool, replay_rate=200, batch_size=50, ack_timeout=10.0, name="Spool"):
+        self.client = client
+        self.spool = spool
+        self.replay_rate = replay_rate
+        self.batch_size = batch_size
+        self.ack_timeout = ack_timeout
+        self.name = name
+
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+
+        # Statistics
+        self.direct = 0
+        self.replayed = 0
+        self.replay_rate_last = 0.0  # Messages/s achieved by the last replay batch
+
+        label = name.lower().replace(" ", ".")
+        gauge("spool_depth_messages", "Messages waiting in the store-and-forward spool", spool.depth, spool=label)
+        gauge("spool_depth_bytes", "Bytes waiting in the store-and-forward spool", spool.depth_bytes, spool=label)
+        gauge("spool_replay_messages_per_second", "Throughput of the last replay batch",
+              lambda: self.replay_rate_last, spool=label)
+        counter("spool_spooled_total", "Messages written to the spool", lambda: spool.spooled, spool=label)
+        counter("spool_replayed_total", "Spooled messages delivered after reconnect", lambda: self.replayed, spool=label)
+        counter("spool_dropped_total", "Spooled messages dropped because the spool was full",
+                lambda: spool.dropped, spool=label)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name=f"{self.name}-replay", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.spool.close()
+
+    def publish(self, topic, payload, qos=1):
+        # Direct only when it cannot overtake older spooled messages
+        if self.client.is_connected() and self.spool.depth() == 0:
+            info = self.client.publish(topic, payload, qos)
+            if info.rc == mqtt.MQTT_ERR_SUCCESS:
+                self.direct += 1
+                return True
+        self.spool.append(topic, payload, qos)
+        self._wake.set()
+        return False
+
+    def _run(self):
+        replaying = False
+        while not self._stop.is_set():
+            if not self.client.is_connected() or self.spool.depth() == 0:
+                if replaying and self.spool.depth() == 0:
+                    LOG.info("%s: replay complete, %d messages delivered so far", self.name, self.replayed)
+                replaying = False
+                self._wake.wait(1.0)
+                self._wake.clear()
+                continue
+
+            if not replaying:
+                LOG.info("%s: replaying %d spooled messages", self.name, self.spool.depth())
+                replaying = True
+
+            records, position, consumed = self.spool.peek(self.batch_size)
+            if not records:
+                self._stop.wait(0.5)
+                continue
+
+            start = time.monotonic()
+            if not self._send(records):
+                self._stop.wait(1.0)
+                continue
+            self.spool.commit(position, consumed)
+            self.replayed += len(records)
+
+            # Pace batches so replay does not flood the broker
+            elapsed = time.monotonic() - start
+            target = len(records) / self.replay_rate
+            if elapsed < target:
+                self._stop.wait(target - elapsed)
+            self.replay_rate_last = len(records) / max(time.monotonic() - start, 1e-6)
+
+    def _send(self, records):
+        infos = []
+        for topic, payload, qos in records:
+            info = self.client.publish(topic, payload, qos)
+            if info.rc != mqtt.MQTT_ERR_SUCCESS:
+                return False
+            infos.append(info)
+
+        deadline = time.monotonic() + self.ack_timeout
+        for info in infos:
+            try:
+                info.wait_for_publish(max(0.0, deadline - time.monotonic()))
+            except (RuntimeError, ValueError):
+                return False
+            if not info.is_published():
+                return False
+        return True
@@ -1,12 +1,27 @@
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Common'))
 import serial
-import pymysql
-from datetime import datetime
 import time
 import threading
 import paho.mqtt.client as mqtt
-import json
-import requests
-import schedule
+from archive import ArchiveJob
+from db_writer import DBWriter
+from deadband import DeadbandFilter
+from discord_dispatcher import DiscordDispatcher
+from history import start_history_server
+from log import configure_logging, get_logger, stop_logging
+from metrics import stage, start_metrics_server
+from mqtt_publisher import BoundedPublisher
+from mqtt_spool import MessageSpool, SpooledPublisher
+from payload_codec import PayloadCodec
+from rollup import RetentionJob
+from room_handlers import OutsideRoom
+from rule_engine import RuleEngine
+from scheduler import TimerScheduler
+from serial_protocol import SENSOR_FRAMES, make_decoder, parse_sensor_text
+from serial_reader import SerialReader
+from storage import ensure_index, make_backend
 
 # =============================================================================
 # CONFIGURATION SECTION
@@ -14,256 +29,481 @@ import schedule
 
 # MQTT Configuration
 MQTT_BROKER = "172.20.10.14" # Change to cloud VM server address
+MQTT_PORT = 1883
 MQTT_PUBS_TOPIC = "edge/outside/data"
-MQTT_SUBS_TOPIC = ["edge/outside/status", "cloud/suggestion"]
+MQTT_SUBS_STATUS_TOPIC = "edge/outside/status"
+MQTT_SUBS_SUGGESTION_TOPIC = "cloud/suggestion"
+
+# Store-and-forward spool for outgoing data while the broker is unreachable
+MQTT_DATA_QOS = 1                    # QoS for spooled data messages
+SPOOL_DIR = "spool/outside"
+SPOOL_MAX_BYTES = 64 * 1024 * 1024   # Oldest messages are dropped beyond this
+SPOOL_SEGMENT_BYTES = 1024 * 1024    # Size of each spool file
+SPOOL_REPLAY_RATE = 200              # Messages per second replayed after reconnect
+SPOOL_REPLAY_BATCH = 50              # Messages per replay batch
+
+# Outbound MQTT queue: QoS and overflow policy per topic filter (see
+# Common/mqtt_publisher.py). Spooled data fails when the queue is full,
+# so the reading goes to the spool instead of being lost
+MQTT_TOPIC_POLICIES = {
+    MQTT_PUBS_TOPIC: (MQTT_DATA_QOS, "fail"),
+}
+MQTT_QUEUE_SIZE = 1000    # Messages waiting for the broker
+MQTT_MAX_INFLIGHT = 20    # Messages sent and not yet acknowledged
+MQTT_BLOCK_TIMEOUT = 2.0  # Seconds a "block" publish waits for room
+
+# Payload encoding of published messages: "json", "struct" (compact binary
+# with a fixed schema per topic), "msgpack" or "cbor". Received messages are
+# decoded whatever their encoding (see Common/payload_codec.py)
+PAYLOAD_CODEC = "json"
 
 # Discord Integration
 DISCORD_WEBHOOK_URL = "https://discord.com/api/webhooks/1375385948715487243/18tL62HUw6PFjRXGYorL1Age2WsKibXKvwc5zlJGQCLdNlp9O6B6cBvC9tg_grTRz9_O"
-
-# Sensor Thresholds
+DISCORD_COALESCE_WINDOW = 5.0  # Alerts within this many seconds share one message
+DISCORD_TIMEOUT = 5.0          # Seconds before a webhook request is abandoned
+
+# Database Configuration
+DB_BACKEND = "mysql"   # "mysql", or "sqlite" for boards without a MySQL server
+DB_SQLITE_PATH = "sensorslog.db"
+DB_HOST = "localhost"
+DB_USER = "root"
+DB_PASSWORD = "12345678"
+DB_NAME = "sensorslog"
+DB_ENABLED = True      # False runs without a database (nothing is stored)
+DB_POOL_SIZE = 2
+DB_QUEUE_SIZE = 5000     # Readings buffered while the database is slow
+DB_BATCH_SIZE = 50       # Rows per executemany() batch
+DB_FLUSH_INTERVAL = 2.0  # Maximum seconds a reading waits before being written
+SUMMARY_CHECKPOINT_INTERVAL = 60.0  # Seconds between report counter checkpoints
+
+# Data Retention
+RAW_RETENTION_DAYS = 30             # Raw readings kept in logs
+MINUTE_ROLLUP_RETENTION_DAYS = 90   # Minute aggregates kept (hourly kept forever)
+RETENTION_CHUNK_SIZE = 1000         # Rows deleted per statement
+
+# Archive Export: complete days of raw readings are streamed to gzip CSV
+# files. An index.json lets each run continue where the last one stopped.
+# Archived rows are deleted after ARCHIVE_DELETE_AFTER_DAYS (None keeps
+# them until RAW_RETENTION_DAYS, which stays as the backstop).
+ARCHIVE_ENABLED = True
+ARCHIVE_DIR = "archive/sensorslog"
+ARCHIVE_TIME = "00:30"
+ARCHIVE_CHUNK_ROWS = 5000
+ARCHIVE_DELETE_AFTER_DAYS = None
+
+# Sensor Thresholds (reports; the cloud may change TEMP_THRESHOLD)
 LIGHT_THRESHOLD = 800
 TEMP_THRESHOLD = 30.0
 
+# Deadband Publishing: a reading is published and stored as a raw row only
+# when light or temperature moves by its delta, sound changes (None), or
+# nothing was sent for DEADBAND_HEARTBEAT seconds. Alerts, report counters,
+# rollups and the history API still see every reading.
+DEADBAND_FIELDS = {"light": 20, "sound": None, "temperature": 1}  # In reading order
+DEADBAND_HEARTBEAT = 15.0     # Keep below REPORT_MAX_GAP
+DEADBAND_SMOOTHING = None     # None, "ewma" or "median" (light and temperature)
+DEADBAND_EWMA_ALPHA = 0.3
+DEADBAND_MEDIAN_WINDOW = 5
+
+# Report Analytics: the day's raw readings streamed through NumPy in chunks
+REPORT_CHUNK_ROWS = 5000      # Rows fetched per chunk (bounds report memory)
+REPORT_MAX_GAP = 30.0         # Seconds a reading is assumed to hold
+REPORT_WINDOW_MINUTES = 15    # Moving average window
+REPORT_Z_LIMIT = 3.0          # Minute means this many deviations out are flagged
+
+# Alert Rules (see rule_engine.py). A cloud/suggestion can change any
+# threshold named by "param", or replace the list with "alert rules".
+ALERT_SENSORS = ("light", "temperature", "sound")  # sound: 1 when loud
+ALERT_RULES = [
+    {"name": "sound_loud", "sensor": "sound", "above": 0.5, "hold": 30.0,
+     "message": "🔊🔊 SOUND changed to LOUD, CAUTION 🔊🔊"},
+    {"name": "light_high", "sensor": "light", "above": LIGHT_THRESHOLD, "band": 50, "debounce": 2.0,
+     "message": "💡💡 BRIGHTNESS changed to {value} lux, EXCEEDED {threshold:g} lux, CAUTION 💡💡"},
+    {"name": "temp_high", "sensor": "temperature", "above": TEMP_THRESHOLD, "band": 1.0, "debounce": 5.0,
+     "param": "temp threshold",
+     "message": "🔥🔥 TEMPERATURE change to {value} °C, EXCEEDED {threshold:g} °C, CAUTION 🔥🔥"},
+    {"name": "temp_rising", "sensor": "temperature", "rate": 60.0, "above": 3.0, "band": 1.0,
+     "message": "🌡️🌡️ TEMPERATURE rising {value:.1f} °C per minute, CAUTION 🌡️🌡️"},
+]
+
+# Serial Configuration
+SERIAL_PORT = "/dev/ttyACM0"
+SERIAL_BAUD = 9600
+
+# Serial Protocol: "text" lines or "framed" binary frames
+# (must match FRAMED_PROTOCOL in the Arduino sketch)
+SERIAL_PROTOCOL = "text"
+
+# Metrics Endpoint (Prometheus text format; port 0 disables it)
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9101
+
+# History API: recent readings from memory, older ones from the database (port 0 disables it)
+HISTORY_HOST = "127.0.0.1"
+HISTORY_PORT = 9111
+HISTORY_CAPACITY = 86400   # Readings kept in memory (a day at 1 Hz)
+HISTORY_RELOAD = 24 * 3600  # Seconds refilled from the database at startup
+
+# Logging: lines are written by a background thread (see Common/log.py).
+# Levels per category, e.g. {"mqtt.received": "WARNING"}; per-message
+# categories are sampled to LOG_SAMPLE_RATE lines per second
+LOG_LEVEL = "INFO"
+LOG_LEVELS = {}
+LOG_SAMPLE_RATE = 5
+
 # =============================================================================
 # GLOBAL VARIABLES
 # =============================================================================
 
-# Store previous sensor states for edge detection
-prev_sound = "no"
-prev_light_exceeded = False
-prev_temp_exceeded = False
+# Loggers per category (see LOG_LEVELS); per-message lines are sampled
+LOG = get_logger("outside")
+MQTT_LOG = get_logger("mqtt")
+RECEIVED_LOG = get_logger("mqtt.received", rate=LOG_SAMPLE_RATE)
+PUBLISHED_LOG = get_logger("mqtt.published", rate=LOG_SAMPLE_RATE)
+SERIAL_LOG = get_logger("serial.sent", rate=LOG_SAMPLE_RATE)
+
+# Alert rules compiled once; this script has a single slot
+ALERTS = RuleEngine(ALERT_SENSORS, ALERT_RULES, name="Rules outside")
+
+# Holds back readings that did not change enough to be worth sending
+DEADBAND = DeadbandFilter(
+    DEADBAND_FIELDS,
+    heartbeat=DEADBAND_HEARTBEAT,
+    smoothing=DEADBAND_SMOOTHING,
+    alpha=DEADBAND_EWMA_ALPHA,
+    window=DEADBAND_MEDIAN_WINDOW,
+    name="Deadband outside"
+)
 
 # =============================================================================
 # HARDWARE INITIALIZATION
 # =============================================================================
 
-# Initialize Arduino serial connection
-arduino = serial.Serial('/dev/ttyACM0', 9600, timeout=1)
+# Created by start() so the module can be imported without hardware
+arduino = None
+MQTT_CLIENT = None
+MQTT_OUT = None
+MQTT_PUBLISHER = None
+SERIAL_READER = None
+PAYLOAD = None
+
+def init_hardware(serial_port=SERIAL_PORT, broker=MQTT_BROKER, broker_port=MQTT_PORT):
+    global arduino, MQTT_CLIENT
+
+    # Initialize Arduino serial connection
+    arduino = serial.Serial(serial_port, SERIAL_BAUD, timeout=1)
 
-# Initialize MQTT client
-MQTT_CLIENT = mqtt.Client()
-MQTT_CLIENT.connect(MQTT_BROKER, 1883, 60)
+    # Initialize MQTT client; connects (and reconnects) in the background
+    # so readings are spooled while the broker is unreachable
+    MQTT_CLIENT = mqtt.Client()
+    MQTT_CLIENT.reconnect_delay_set(1, 30)
+    MQTT_CLIENT.connect_async(broker, broker_port, 60)
 
 # =============================================================================
 # DATABASE FUNCTIONS
 # =============================================================================
 
-def get_db_connection(host='localhost', user='root', password='12345678', db='sensorslog'):
+# Minute and hour aggregates share one layout (avg = sum / samples)
+SENSOR_ROLLUP_COLUMNS = '''
+        bucket DATETIME PRIMARY KEY,
+        samples INT NOT NULL,
+        light_min INT, light_max INT, light_sum BIGINT NOT NULL,
+        temp_min INT, temp_max INT, temp_sum BIGINT NOT NULL,
+        loud_samples INT NOT NULL
+'''
+
+# Tables are created once when the writer starts
+SENSORS_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS logs (
+        time DATETIME,
+        light INT,
+        sound VARCHAR(20),
+        temperature INT
+    )
+    ''',
+    ensure_index("logs", ("time",), "idx_logs_time"),
+    '''
+    CREATE TABLE IF NOT EXISTS daily_summary (
+        day DATE PRIMARY KEY,
+        total INT NOT NULL DEFAULT 0,
+        light_high INT NOT NULL DEFAULT 0,
+        sound_high INT NOT NULL DEFAULT 0,
+        temp_high INT NOT NULL DEFAULT 0
+    )
+    ''',
+    f"CREATE TABLE IF NOT EXISTS sensor_rollup_minute ({SENSOR_ROLLUP_COLUMNS})",
+    f"CREATE TABLE IF NOT EXISTS sensor_rollup_hour ({SENSOR_ROLLUP_COLUMNS})"
+]
+
+# MySQL server or local SQLite file, chosen by DB_BACKEND
+STORAGE = make_backend(DB_BACKEND, DB_HOST, DB_USER, DB_PASSWORD, DB_NAME, DB_SQLITE_PATH)
+
+def get_db_connection():
     try:
-        conn = pymysql.connect(host=host, user=user, password=password, database=db)
-        cur = conn.cursor()
-        
-        # Create table if it doesn't exist
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS logs (
-                time DATETIME,
-                light INT,
-                sound VARCHAR(20),
-                temperature INT
-            )
-        ''')
-        conn.commit()
-        return conn
+        return STORAGE.connect()
     except Exception as e:
-        print(f"[ERROR] Database connection failed: {e}")
+        LOG.error("Database connection failed: %s", e)
         return None
+
+# Long-lived writer shared by the logging thread and the reports
+DB_WRITER = DBWriter(
+    get_db_connection,
+    schema=SENSORS_SCHEMA,
+    pool_size=DB_POOL_SIZE,
+    max_queue=DB_QUEUE_SIZE,
+    batch_size=DB_BATCH_SIZE,
+    flush_interval=DB_FLUSH_INTERVAL,
+    name="DB sensorslog",
+    backend=STORAGE
+)
+
+# Pruning of expired rows
+RETENTION = RetentionJob(
+    DB_WRITER.pool,
+    [
+        ("logs", "time", RAW_RETENTION_DAYS),
+        ("sensor_rollup_minute", "bucket", MINUTE_ROLLUP_RETENTION_DAYS),
+    ],
+    chunk_size=RETENTION_CHUNK_SIZE,
+    backend=STORAGE
+)
+ARCHIVE = ArchiveJob(
+    DB_WRITER.pool,
+    STORAGE,
+    [("logs", "time")],
+    ARCHIVE_DIR,
+    chunk_rows=ARCHIVE_CHUNK_ROWS,
+    delete_after_days=ARCHIVE_DELETE_AFTER_DAYS,
+    delete_chunk=RETENTION_CHUNK_SIZE
+)
+
+def load_report_counters():
+    try:
+        with DB_WRITER.pool.connection() as conn:
+            ROOM.load(conn, HISTORY_RELOAD)
+    except Exception as e:
+        LOG.error("Loading report counters: %s", e)
     
 # =============================================================================
 # DATA PROCESSING FUNCTIONS
 # =============================================================================
+
+# Per-stage timings exported on the metrics endpoint
+PROCESS_STAGE = stage("outside.process")
+PUBLISH_STAGE = stage("outside.mqtt_publish")
+ON_MESSAGE_STAGE = stage("outside.on_message")
     
 def log_and_publish_data():
-    global prev_sound, prev_light_exceeded, prev_temp_exceeded
     while True:
+        # Wait for the next parsed reading from the serial reader
+        received_at, reading = SERIAL_READER.get()
         try:
-            if arduino.in_waiting:
-                # Read sensor data from Arduino
-                line = arduino.readline().decode().strip()
-                parts = line.split(',')
-
-                # Parse sensor values
-                light = int(parts[0].split(':')[1])
-                sound = parts[1].split(':')[1]
-                temp = int(parts[2].split(':')[1])
-                now = datetime.now()            
-
-                # SOUND ALERT: Rising edge detection (quiet -> loud)
-                if sound == "yes" and prev_sound != "yes":
-                    send_discord_alert("🔊🔊 SOUND changed to LOUD, CAUTION 🔊🔊")
-                prev_sound = sound
-
-                # LIGHT ALERT: Rising edge detection (normal -> bright)
-                light_exceeded = light > LIGHT_THRESHOLD
-                if light_exceeded and not prev_light_exceeded:
-                    send_discord_alert(f"💡💡 BRIGHTNESS changed to {light} lux, EXCEEDED {LIGHT_THRESHOLD} lux, CAUTION 💡💡")
-                prev_light_exceeded = light_exceeded
-
-                # TEMPERATURE ALERT: Rising edge detection (normal -> hot)
-                temp_exceeded = temp > TEMP_THRESHOLD
-                if temp_exceeded and not prev_temp_exceeded:
-                    send_discord_alert(f"🔥🔥 TEMPERATURE change to {temp} °C, EXCEEDED {TEMP_THRESHOLD} °C, CAUTION 🔥🔥")
-                prev_temp_exceeded = temp_exceeded
-                               
-                # Save sensor data to database
-                conn = get_db_connection()  
-                cur = conn.cursor()
-                cur.execute(
-                    "INSERT INTO logs (time, light, sound, temperature) VALUES (%s, %s, %s, %s)",
-                    (now, light, sound, temp)
-                )
-                conn.commit()
-                conn.close()
-                
-                # Prepare payload and publish to MQTT
-                payload = json.dumps({
-                    "timestamp": now.isoformat(),
-                    "light": light,
-                    "sound": sound,
-                    "temperature": temp
-                })
-                MQTT_CLIENT.publish(MQTT_PUBS_TOPIC, payload)
-                print(f"[INFO] Published: {payload} to {MQTT_PUBS_TOPIC}")
-                                        
+            with PROCESS_STAGE.time():
+                # Alerts, report counters, rollups, history; stored and
+                # published when it passes the deadband (see room_handlers.py)
+                ROOM.handle(received_at, reading)
         except Exception as e:
-            print("[Error] Sending to Arduino or MQTT pusblishing:", e)
-        time.sleep(1)
+            LOG.error("Sending to Arduino or MQTT publishing: %s", e)
+
+def publish(topic, message, spooled=True):
+    # Data goes through the spool so nothing is lost while offline
+    payload = PAYLOAD.encode(topic, message)
+    with PUBLISH_STAGE.time():
+        if spooled:
+            MQTT_PUBLISHER.publish(topic, payload, MQTT_DATA_QOS)
+        else:
+            MQTT_OUT.publish(topic, payload)
+    PUBLISHED_LOG.info("Published: %s to %s", message, topic)
 
 # =============================================================================
 # NOTIFICATION FUNCTIONS
 # =============================================================================
 
+# Background dispatcher so webhook calls never stall MQTT or serial handling
+DISCORD = DiscordDispatcher(
+    DISCORD_WEBHOOK_URL,
+    coalesce_window=DISCORD_COALESCE_WINDOW,
+    timeout=DISCORD_TIMEOUT
+)
+
 def send_discord_alert(message):
-    data = {"content": message}
-    try:
-        requests.post(DISCORD_WEBHOOK_URL, json=data)
-    except Exception as e:
-        print("[Error] Failed to send Discord alert:", e)
+    # Non-blocking: the message is queued for the dispatcher
+    DISCORD.send(message)
 
 # =============================================================================
 # MQTT EVENT HANDLERS
 # =============================================================================
 
 def on_connect(client, userdata, flags, rc):
-    print(f"[MQTT] Connected with result code {rc}")
-    for topic in MQTT_SUBS_TOPIC:
+    MQTT_LOG.info("Connected with result code %s", rc)
+    for topic in ROOM.topics():
         client.subscribe(topic)
 
+def on_disconnect(client, userdata, rc):
+    MQTT_LOG.warning("Disconnected with result code %s, spooling until reconnected", rc)
+
 def on_message(client, userdata, msg):
     topic = msg.topic
-    payload_str = msg.payload.decode()
-    print(f"[MQTT] Message received: {topic} -> {payload_str}")
 
     try:
-        # Handle edge server data
-        if "edge" in topic:
-            payload = json.loads(payload_str)
-            ack = payload["sensors"]
-            send_to_arduino(f"status:{ack}")
-
-        # Handle cloud server data
-        elif "cloud" in topic:
-            global TEMP_THRESHOLD
-            payload = json.loads(payload_str)
-            TEMP_THRESHOLD = payload.get("temp threshold", 30.0)
-                    
+        with ON_MESSAGE_STAGE.time():
+            # Any payload encoding; the first byte tells which
+            payload = PAYLOAD.decode(topic, msg.payload)
+            RECEIVED_LOG.info("Message received: %s -> %s", topic, payload)
+
+            # Sensor status to the Arduino, suggestions to the thresholds and rules
+            ROOM.on_message(topic, payload)
+
     except Exception as e:
-        print("[Error] on_message:", e)
+        LOG.error("on_message: %s", e)
 
 # =============================================================================
 # SERIAL COMMUNICATION FUNCTIONS
 # =============================================================================
 
-def send_to_arduino(message: str):
+def send_to_arduino(message: str, kind="command"):
+    # kind is for prioritized writers; only the MQTT thread writes here
     try:
         arduino.write((message + '\n').encode())
-        print(f"[Serial] Sent to Arduino: {message}")
+        SERIAL_LOG.info("Sent to Arduino: %s", message)
     except Exception as e:
-        print("[Error] Sending to Arduino:", e)
+        SERIAL_LOG.error("Sending to Arduino: %s", e)
+
+# =============================================================================
+# ROOM HANDLER
+# =============================================================================
+
+# Per-reading and per-message logic, shared with the edge daemon; this
+# script runs one room on the edge/outside/... topics and unscoped tables
+ROOM = OutsideRoom(
+    DB_WRITER,
+    publish,
+    send_to_arduino,
+    send_discord_alert,
+    ALERTS,
+    DEADBAND,
+    MQTT_PUBS_TOPIC,
+    MQTT_SUBS_STATUS_TOPIC,
+    MQTT_SUBS_SUGGESTION_TOPIC,
+    history_capacity=HISTORY_CAPACITY,
+    light_threshold=LIGHT_THRESHOLD,
+    temp_threshold=TEMP_THRESHOLD,
+    checkpoint_interval=SUMMARY_CHECKPOINT_INTERVAL,
+    chunk_rows=REPORT_CHUNK_ROWS,
+    max_gap=REPORT_MAX_GAP,
+    window_minutes=REPORT_WINDOW_MINUTES,
+    z_limit=REPORT_Z_LIMIT
+)
 
 # =============================================================================
 # REPORTING FUNCTIONS
 # =============================================================================
 
-def generate_reports():
+def generate_reports(start_day=None, end_day=None):
     try:
-        print("[INFO] Generating Report")
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
-        # Define today's time range
-        today = datetime.now().date()
-        start_time = datetime.combine(today, datetime.min.time())
-        end_time = datetime.combine(today, datetime.max.time())
-
-        # Query sensor data for today
-        cursor.execute("""
-            SELECT light, sound, temperature
-            FROM logs
-            WHERE time BETWEEN %s AND %s
-        """, (start_time, end_time))
-        sensor_rows = cursor.fetchall()
-
-        # Generate report content
-        sensor_report = "**SENSORS DAILY REPORT**\n"
-        total = len(sensor_rows)
-        if total == 0:
-            sensor_report += "No sensor data recorded today.\n"
-        else:  
-            # Only add if conditions are met    
-            light_high = sum(1 for l, _, _ in sensor_rows if l > LIGHT_THRESHOLD)        
-            sound_high = sum(1 for _, s, _ in sensor_rows if s == "yes")
-            temp_high = sum(1 for _, _, t in sensor_rows if t > TEMP_THRESHOLD)
-
-            sensor_report += f"Total records: {total}\n"    
-            sensor_report += f"Light > {LIGHT_THRESHOLD} lux: {light_high / total * 100:.2f}% of time\n"
-            sensor_report += f"Loud noise: {sound_high / total * 100:.2f}% of time\n"
-            sensor_report += f"Temperature > {TEMP_THRESHOLD}°C: {temp_high / total * 100:.2f}% of time\n"
-
-        send_discord_report("📊 Daily Sensor Report", sensor_report)
-
-        cursor.close()
-        conn.close()
+        LOG.info("Generating report")
+        with DB_WRITER.pool.connection() as conn:
+            title, sensor_report = ROOM.build_report(conn, start_day, end_day)
+        send_discord_report(title, sensor_report)
     except Exception as e:
-        print("[Error] generate report", e)
+        LOG.error("generate report: %s", e)
 
 def send_discord_report(title, content):
-    data = {
-        "embeds": [
-            {
-                "title": title,
-                "description": content,
-                "color": 5814783
-            }
-        ]
-    }
-    requests.post(DISCORD_WEBHOOK_URL, json=data)
+    DISCORD.send_embed(title, content, color=5814783)
+
+# Periodic jobs share one timer thread that sleeps until the next is due
+SCHEDULER = TimerScheduler("Scheduler outside")
 
 def schedule_report():
     # Schedule task to run at specific time daily
     schedule_time = "23:59"
-    schedule.every().day.at(schedule_time).do(generate_reports)
-    print(f"Scheduler started. Waiting for {schedule_time} every day...")
-    while True:
-        schedule.run_pending()
-        time.sleep(10)
+    SCHEDULER.daily(schedule_time, generate_reports)
+
+    # Prune expired raw rows and minute rollups every hour
+    SCHEDULER.every(3600, RETENTION.run)
+
+    # Export finished days to the archive (and delete old archived rows)
+    if ARCHIVE_ENABLED:
+        SCHEDULER.daily(ARCHIVE_TIME, ARCHIVE.run)
+    SCHEDULER.start()
+    LOG.info("Scheduler started. Waiting for %s every day...", schedule_time)
 
 # =============================================================================
 # MAIN EXECUTION
 # =============================================================================
 
-# Configure MQTT client    
-MQTT_CLIENT.on_message = on_message
-MQTT_CLIENT.on_connect = on_connect
-MQTT_CLIENT.loop_start()
+def start(serial_port=SERIAL_PORT, broker=MQTT_BROKER, broker_port=MQTT_PORT, db_enabled=DB_ENABLED):
+    global SERIAL_READER, MQTT_OUT, MQTT_PUBLISHER, PAYLOAD
+    configure_logging(LOG_LEVEL, LOG_LEVELS)
+    init_hardware(serial_port, broker, broker_port)
+    PAYLOAD = PayloadCodec(PAYLOAD_CODEC, name="Payload outside")
+
+    # Configure MQTT client
+    MQTT_CLIENT.on_message = on_message
+    MQTT_CLIENT.on_connect = on_connect
+    MQTT_CLIENT.on_disconnect = on_disconnect
+    MQTT_CLIENT.loop_start()
+
+    # Every outgoing message goes through one bounded queue
+    MQTT_OUT = BoundedPublisher(
+        MQTT_CLIENT,
+        MQTT_TOPIC_POLICIES,
+        max_queue=MQTT_QUEUE_SIZE,
+        max_inflight=MQTT_MAX_INFLIGHT,
+        block_timeout=MQTT_BLOCK_TIMEOUT,
+        name="MQTT outside"
+    ).start()
+
+    # Outgoing data goes through the spool so nothing is lost while offline
+    MQTT_PUBLISHER = SpooledPublisher(
+        MQTT_OUT,
+        MessageSpool(SPOOL_DIR, SPOOL_MAX_BYTES, SPOOL_SEGMENT_BYTES, name="Spool outside"),
+        replay_rate=SPOOL_REPLAY_RATE,
+        batch_size=SPOOL_REPLAY_BATCH,
+        name="Spool outside"
+    ).start()
+
+    # Reader thread that blocks on the serial port and queues decoded readings
+    SERIAL_READER = SerialReader(
+        arduino,
+        make_decoder(SERIAL_PROTOCOL, parse_sensor_text, SENSOR_FRAMES, name="Serial outside"),
+        name="Serial outside"
+    )
+
+    # Start database writer, notifier and background threads
+    DB_WRITER.enabled = db_enabled
+    DB_WRITER.start()
+    if db_enabled:
+        load_report_counters()
+    DISCORD.start()
+    start_metrics_server(METRICS_HOST, METRICS_PORT)
+    start_history_server(HISTORY_HOST, HISTORY_PORT, {"sensors": ROOM.history})
+    SERIAL_READER.start()
+    threading.Thread(target=log_and_publish_data, daemon=True).start()
+    schedule_report()
+
+def stop():
+    SCHEDULER.stop()
+    MQTT_PUBLISHER.stop()
+    MQTT_OUT.stop()
+    MQTT_CLIENT.loop_stop()
+    MQTT_CLIENT.disconnect()
+    SERIAL_READER.stop()
+    ROOM.flush()
+    DB_WRITER.stop()
+    DISCORD.stop()
+    stop_logging()
 
-# Start background threads
-threading.Thread(target=log_and_publish_data, daemon=True).start()
-threading.Thread(target=schedule_report, daemon=True).start()
+def main():
+    start()
 
-# Keep main thread alive
-try:
-    while True:
-        time.sleep(1)
-except KeyboardInterrupt:
-    MQTT_CLIENT.loop_stop()
-    MQTT_CLIENT.disconnect()
\ No newline at end of file
+    # Keep main thread alive
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+from datetime import datetime, timedelta
+import numpy as np
+
+# =============================================================================
+# STREAMED DAY ANALYTICS
+# =============================================================================
+
+MINUTES_PER_DAY = 1440
+
+class DayAnalytics:
+    # Statistics for one day of raw rows, computed with NumPy on chunks
+    # fetched from a streaming cursor. Memory stays bounded by the chunk size
+    # and per-day arrays (1440 minute bins and one histogram per field)
+    # instead of growing with the sampling rate.
+    #
+    # columns maps each field to an SQL expression (as in HistoryStore),
+    # e.g. {"light": "light", "loud": "sound = 'Yes'"}. bins gives
+    # (low, high, step) for fields whose percentiles are reported; the
+    # stored values are integers, so step 1 gives exact percentiles.
+    # Values outside [low, high] are kept in their own bins below and above
+    # the range; a percentile that falls there is -inf or +inf.
+    #
+    # Every statistic except min, max and the row count is time-weighted: a
+    # reading holds until the next one, for at most max_gap seconds. The
+    # deadband stores a row only when the reading changes (or on the
+    # heartbeat), so a per-row mean or percentile would over-weight the
+    # periods of change; outages do not count at all.
+    def __init__(self, writer, table, columns, bins=None, scope=None,
+                 chunk_rows=5000, max_gap=30.0, window_minutes=15, z_limit=3.0):
+        self.writer = writer
+        self.table = table
+        self.columns = dict(columns)
+        self.bins = dict(bins or {})
+        self.scope = dict(scope or {})
+        self.chunk_rows = chunk_rows
+        self.max_gap = max_gap
+        self.window_minutes = window_minutes
+        self.z_limit = z_limit
+
+    def analyze(self, conn, day, thresholds):
+        # thresholds: field -> level for time-above and rising-edge counts
+        # (0.5 for on/off fields gives duty cycles and switch-on counts)
+        start = datetime.combine(day, datetime.min.time())
+        end = start + timedelta(days=1)
+        t0 = start.timestamp()
+        t_end = min(end.timestamp(), datetime.now().timestamp())
+
+        fields = list(self.columns)
+        n = len(fields)
+        levels = np.array([thresholds.get(field, np.inf) for field in fields])
+        # Seconds per bin; bin 0 and the last bin hold the values below and above the range
+        hist = {field: np.zeros(int(round((high - low) / step)) + 3)
+                for field, (low, high, step) in self.bins.items()}
+        minute_sum = np.zeros((n, MINUTES_PER_DAY))
+        minute_held = np.zeros(MINUTES_PER_DAY)
+        total = np.zeros(n)
+        minimum = np.full(n, np.inf)
+        maximum = np.full(n, -np.inf)
+        above = np.zeros(n)
+        rises = np.zeros(n, dtype=np.int64)
+        observed = 0.0
+        count = 0
+        last = None  # (ts, values) of the previous chunk's last row
+
+        backend = self.writer.backend
+        where = " AND ".join([f"{key} = %s" for key in self.scope] + ["time >= %s", "time < %s"])
+        sql = (f"SELECT {backend.epoch('time')}, {', '.join(self.columns.values())} "
+               f"FROM {self.table} WHERE {where} ORDER BY time")
+        cur = backend.stream_cursor(conn)
+        try:
+            cur.execute(sql, (*self.scope.values(), start, end))
+            while True:
+                rows = cur.fetchmany(self.chunk_rows)
+                if rows:
+                    chunk = np.array(rows, dtype=float)
+                    ts, values = chunk[:, 0], chunk[:, 1:]
+                    count += len(ts)
+                    minimum = np.minimum(minimum, values.min(axis=0))
+                    maximum = np.maximum(maximum, values.max(axis=0))
+                elif last is None:
+                    break
+                else:
+                    # The last reading holds until the end of the day (or now)
+                    ts, values = np.array([max(t_end, last[0])]), last[1][np.newaxis]
+
+                # Each reading is weighted by how long it held: until the next
+                # one, for at most max_gap. A chunk's last reading is weighted
+                # with the next chunk (or the end of the day)
+                if last is not None:
+                    ts = np.concatenate(([last[0]], ts))
+                    values = np.vstack((last[1], values))
+                held = np.minimum(np.diff(ts), self.max_gap)
+                weighted = values[:-1]
+                high_flags = values > levels
+                observed += held.sum()
+                total += held @ weighted
+                above += held @ high_flags[:-1]
+                rises += np.count_nonzero(high_flags[1:] & ~high_flags[:-1], axis=0)
+                for i, field in enumerate(fields):
+                    if field in hist:
+                        low, high, step = self.bins[field]
+                        column = weighted[:, i]
+                        index = np.rint((column - low) / step).astype(np.int64) + 1
+                        index[column < low] = 0
+                        index[column > high] = len(hist[field]) - 1
+                        hist[field] += np.bincount(index, weights=held, minlength=len(hist[field]))
+
+                # Credited to the minute the reading started in
+                minute = np.clip(((ts[:-1] - t0) // 60).astype(np.int64), 0, MINUTES_PER_DAY - 1)
+                minute_held += np.bincount(minute, weights=held, minlength=MINUTES_PER_DAY)
+                for i in range(n):
+                    minute_sum[i] += np.bincount(minute, weights=weighted[:, i] * held, minlength=MINUTES_PER_DAY)
+                last = (ts[-1], values[-1])
+                if not rows:
+                    break
+        finally:
+            cur.close()
+
+        if count == 0 or observed == 0:
+            return {"count": 0}
+
+        stats = {"count": count, "observed_s": observed,
+                 "window_minutes": self.window_minutes, "z_limit": self.z_limit}
+        minute_mean = np.divide(minute_sum, minute_held, out=np.full_like(minute_sum, np.nan), where=minute_held > 0)
+        kernel = np.ones(self.window_minutes)
+        window_held = np.convolve(minute_held, kernel, mode="same")
+        for i, field in enumerate(fields):
+            field_stats = {
+                "mean": total[i] / observed,
+                "min": minimum[i],
+                "max": maximum[i],
+                "above_s": above[i],
+                "above_pct": above[i] / observed * 100,
+                "rises": int(rises[i]),
+            }
+            if field in hist:
+                low, high, step = self.bins[field]
+                cumulative = np.cumsum(hist[field])
+                for pct in (5, 50, 95):
+                    index = min(np.searchsorted(cumulative, pct / 100 * cumulative[-1]), len(cumulative) - 1)
+                    if index == 0:
+                        field_stats[f"p{pct}"] = -np.inf
+                    elif index == len(cumulative) - 1:
+                        field_stats[f"p{pct}"] = np.inf
+                    else:
+                        field_stats[f"p{pct}"] = low + (index - 1) * step
+                field_stats["range"] = (low, high)
+                field_stats["below_range_s"] = hist[field][0]
+                field_stats["above_range_s"] = hist[field][-1]
+
+                # Moving average over window_minutes
+                moving = np.divide(np.convolve(minute_sum[i], kernel, mode="same"), window_held,
+                                   out=np.full(MINUTES_PER_DAY, np.nan), where=window_held > 0)
+                if np.isfinite(moving).any():
+                    peak = int(np.nanargmax(moving))
+                    field_stats["peak_avg"] = moving[peak]
+                    field_stats["peak_at"] = start + timedelta(minutes=peak)
+
+                # Minutes whose mean is more than z_limit deviations from the day's minute means
+                means = minute_mean[i]
+                seen = np.isfinite(means)
+                std = means[seen].std() if seen.any() else 0.0
+                if std > 0:
+                    z = np.abs(means[seen] - means[seen].mean()) / std
+                    flagged = np.flatnonzero(seen)[z > self.z_limit]
+                    field_stats["anomalies"] = [start + timedelta(minutes=int(m)) for m in flagged]
+                else:
+                    field_stats["anomalies"] = []
+            stats[field] = field_stats
+        return stats
+
+def format_duration(seconds):
+    minutes = int(round(seconds / 60))
+    return f"{minutes // 60}h{minutes % 60:02d}m"
+
+def format_percentiles(field_stats, unit):
+    # p5 / p50 / p95, with "<low" or ">high" for a percentile outside the binned range
+    low, high = field_stats["range"]
+    shown = []
+    for pct in (5, 50, 95):
+        value = field_stats[f"p{pct}"]
+        shown.append(f"<{low:g}" if value == -np.inf else f">{high:g}" if value == np.inf else f"{value:g}")
+    text = " / ".join(shown) + f" {unit}"
+    outside = field_stats["below_range_s"] + field_stats["above_range_s"]
+    if outside:
+        text += f" ({format_duration(outside)} outside {low:g}-{high:g})"
+    return text
+
+def format_anomalies(times, limit=3):
+    if not times:
+        return "none"
+    shown = ", ".join(f"{t:%H:%M}" for t in times[:limit])
+    return f"{len(times)} min ({shown}{', ...' if len(times) > limit else ''})"
+
+# =============================================================================
+# REPORT TEXT
+# =============================================================================
+
+def sensor_report_lines(stats, light_threshold, temp_threshold):
+    if not stats.get("count"):
+        return ""
+    light, temp, loud = stats["light"], stats["temperature"], stats["loud"]
+    window_minutes, z_limit = stats["window_minutes"], stats["z_limit"]
+    text = "**Analytics**\n"
+    text += (f"Light p5/p50/p95: {format_percentiles(light, 'lux')}, "
+             f"peak {window_minutes}-min avg {light['peak_avg']:.0f} lux at {light['peak_at']:%H:%M}\n")
+    text += (f"Temperature p5/p50/p95: {format_percentiles(temp, '°C')}, "
+             f"peak {window_minutes}-min avg {temp['peak_avg']:.1f} °C at {temp['peak_at']:%H:%M}\n")
+    text += (f"Time above threshold: light > {light_threshold} lux {format_duration(light['above_s'])} "
+             f"({light['above_pct']:.1f}%), temperature > {temp_threshold}°C {format_duration(temp['above_s'])} "
+             f"({temp['above_pct']:.1f}%), loud {format_duration(loud['above_s'])} ({loud['above_pct']:.1f}%)\n")
+    text += (f"Anomalous minutes (|z| > {z_limit:g}): light {format_anomalies(light['anomalies'])}, "
+             f"temperature {format_anomalies(temp['anomalies'])}\n")
+    return text
+
+def actuator_report_lines(stats, names=(("led", "LED"), ("fan", "Fan"), ("door", "Door open"), ("manual", "Manual mode"))):
+    if not stats.get("count"):
+        return ""
+    text = "**Analytics**\n"
+    text += "Duty cycle: " + ", ".join(
+        f"{label} {stats[field]['above_pct']:.1f}% ({format_duration(stats[field]['above_s'])})"
+        for field, label in names) + "\n"
+    text += "Switched on: " + ", ".join(f"{label} {stats[field]['rises']}x" for field, label in names) + "\n"
+    return text
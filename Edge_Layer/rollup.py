@@ -0,0 +1,194 @@
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from storage import MySQLBackend
+
+LOG = logging.getLogger("retention")
+
+# =============================================================================
+# BUCKET HELPERS
+# =============================================================================
+
+# Rollup granularities: table suffix and bucket width
+GRANULARITIES = (("minute", timedelta(minutes=1)), ("hour", timedelta(hours=1)))
+
+def bucket_start(ts, granularity):
+    if granularity == "minute":
+        return ts.replace(second=0, microsecond=0)
+    return ts.replace(minute=0, second=0, microsecond=0)
+
+# Buckets are upserted with the same merge kinds, so partial buckets written
+# before a restart combine correctly with the rest of the bucket
+def merge_value(kind, old, new):
+    if kind == "sum":
+        return old + new
+    if kind == "min":
+        return new if old is None else min(old, new)
+    return new if old is None else max(old, new)
+
+# =============================================================================
+# ROLLUP STAGE
+# =============================================================================
+
+class Rollup:
+    # Maintains the open minute and hour buckets in memory. When a reading
+    # lands in a new bucket the finished one is upserted through the DB
+    # writer, so the aggregate tables cost one row per bucket. scope holds
+    # fixed key columns (e.g. {"room": "lab"}) when rollups share tables.
+    def __init__(self, writer, table_prefix, columns, scope=None):
+        self.writer = writer
+        self.columns = dict(columns)  # column name -> "sum" | "min" | "max"
+        self.scope = dict(scope or {})
+        self.tables = {name: f"{table_prefix}_{name}" for name, _ in GRANULARITIES}
+        self._open = {name: (None, None) for name, _ in GRANULARITIES}
+        self._lock = threading.Lock()
+
+        keys = list(self.scope) + ["bucket"]
+        self._upsert = {gran: writer.backend.upsert(table, keys, self.columns) for gran, table in self.tables.items()}
+
+    def flush(self):
+        # Write out the open buckets (e.g. on shutdown); later readings in
+        # the same bucket are merged by the upsert
+        with self._lock:
+            for gran, _ in GRANULARITIES:
+                start, agg = self._open[gran]
+                if agg is not None:
+                    self._emit(gran, start, agg)
+                self._open[gran] = (None, None)
+
+    def _bucket(self, gran, ts):
+        start = bucket_start(ts, gran)
+        current, agg = self._open[gran]
+        if current != start:
+            if agg is not None:
+                self._emit(gran, current, agg)
+            agg = dict.fromkeys(self.columns)
+            for name, kind in self.columns.items():
+                if kind == "sum":
+                    agg[name] = 0
+            self._open[gran] = (start, agg)
+        return agg
+
+    def _update(self, agg, values):
+        for name, value in values.items():
+            agg[name] = merge_value(self.columns[name], agg[name], value)
+
+    def _emit(self, gran, start, agg):
+        row = list(self.scope.values()) + [start] + [agg[name] for name in self.columns]
+        self.writer.submit(self._upsert[gran], tuple(row))
+
+class SensorRollup(Rollup):
+    # Minute/hour min, max and average of light and temperature, plus the
+    # fraction of samples where sound was loud (loud_samples / samples)
+    COLUMNS = {
+        "samples": "sum",
+        "light_min": "min", "light_max": "max", "light_sum": "sum",
+        "temp_min": "min", "temp_max": "max", "temp_sum": "sum",
+        "loud_samples": "sum",
+    }
+
+    def __init__(self, writer, table_prefix="sensor_rollup", scope=None):
+        super().__init__(writer, table_prefix, self.COLUMNS, scope)
+
+    def add(self, ts, light, temp, loud):
+        values = {
+            "samples": 1,
+            "light_min": light, "light_max": light, "light_sum": light,
+            "temp_min": temp, "temp_max": temp, "temp_sum": temp,
+            "loud_samples": 1 if loud else 0,
+        }
+        with self._lock:
+            for gran, _ in GRANULARITIES:
+                self._update(self._bucket(gran, ts), values)
+
+class ActuatorRollup(Rollup):
+    # Minute/hour seconds spent in each active state and transition counts.
+    # The state reported by a frame is assumed to hold until the next frame,
+    # up to max_gap seconds so outages are not counted as time in a state.
+    ACTUATORS = ("led", "fan", "door", "mode")
+    ACTIVE = {"led": "on", "fan": "on", "door": "open", "mode": "manual"}
+    COLUMNS = {
+        "samples": "sum",
+        "observed_s": "sum",
+        "led_on_s": "sum", "fan_on_s": "sum", "door_open_s": "sum", "mode_manual_s": "sum",
+        "led_changes": "sum", "fan_changes": "sum", "door_changes": "sum", "mode_changes": "sum",
+    }
+    DURATION_COLUMNS = {"led": "led_on_s", "fan": "fan_on_s", "door": "door_open_s", "mode": "mode_manual_s"}
+
+    def __init__(self, writer, table_prefix="actuator_rollup", max_gap=30.0, scope=None):
+        super().__init__(writer, table_prefix, self.COLUMNS, scope)
+        self.max_gap = timedelta(seconds=max_gap)
+        self._prev_time = None
+        self._prev_state = None
+
+    def add(self, ts, state):
+        # state: {"led": "on", "fan": "off", "door": "close", "mode": "auto"}
+        with self._lock:
+            if self._prev_state is not None:
+                self._add_durations(self._prev_time, min(ts, self._prev_time + self.max_gap))
+
+            values = {"samples": 1}
+            if self._prev_state is not None:
+                for name in self.ACTUATORS:
+                    if state[name] != self._prev_state[name]:
+                        values[f"{name}_changes"] = 1
+            for gran, _ in GRANULARITIES:
+                self._update(self._bucket(gran, ts), values)
+
+            self._prev_time = ts
+            self._prev_state = state
+
+    def _add_durations(self, start, end):
+        # Split the interval at bucket boundaries for each granularity
+        for gran, width in GRANULARITIES:
+            t = start
+            while t < end:
+                piece_end = min(bucket_start(t, gran) + width, end)
+                seconds = (piece_end - t).total_seconds()
+                values = {"observed_s": seconds}
+                for name, column in self.DURATION_COLUMNS.items():
+                    if self._prev_state[name] == self.ACTIVE[name]:
+                        values[column] = seconds
+                self._update(self._bucket(gran, t), values)
+                t = piece_end
+
+# =============================================================================
+# RETENTION
+# =============================================================================
+
+class RetentionJob:
+    # Deletes expired rows in bounded chunks, committing after each chunk
+    # and pausing between them so no delete holds table locks for long.
+    # policies: [(table, time_column, keep_days), ...]
+    def __init__(self, pool, policies, chunk_size=1000, pause=0.1, name="Retention", backend=None):
+        self.pool = pool
+        self.backend = backend or MySQLBackend()
+        self.policies = list(policies)
+        self.chunk_size = chunk_size
+        self.pause = pause
+        self.name = name
+
+    def run(self):
+        for table, column, keep_days in self.policies:
+            cutoff = datetime.now() - timedelta(days=keep_days)
+            try:
+                deleted = self.prune(table, column, cutoff)
+                if deleted:
+                    LOG.info("%s: deleted %d rows from %s older than %s", self.name, deleted, table, f"{cutoff:%Y-%m-%d %H:%M}")
+            except Exception as e:
+                LOG.error("%s %s: %s", self.name, table, e)
+
+    def prune(self, table, column, cutoff):
+        deleted = 0
+        while True:
+            with self.pool.connection() as conn:
+                cur = conn.cursor()
+                cur.execute(self.backend.delete_oldest(table, column), (cutoff, self.chunk_size))
+                count = cur.rowcount
+                conn.commit()
+                cur.close()
+            deleted += count
+            if count < self.chunk_size:
+                return deleted
+            time.sleep(self.pause)
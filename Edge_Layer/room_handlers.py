@@ -0,0 +1,391 @@
+import time
+from datetime import datetime
+from command_queue import CommandQueue
+from daily_summary import DailySummary
+from history import HistoryRing, HistoryStore
+from log import get_logger
+from report_analytics import DayAnalytics, actuator_report_lines, sensor_report_lines
+from rollup import ActuatorRollup, SensorRollup
+
+# =============================================================================
+# ROOM HANDLERS
+# =============================================================================
+
+# What happens to each reading, status frame and MQTT message of one room,
+# shared by the single-room scripts (one handler each, edge/outside/...
+# topics and unscoped tables) and the edge daemon (one handler per device,
+# room topics and tables keyed by room). The caller owns the serial port
+# and the MQTT client and passes in how to reach them:
+#   publish(topic, message, spooled=True)  message is a dict; spooled data
+#                                          survives a broker outage
+#   send(line, kind)                       a line for the Arduino; kind is
+#                                          "command", "threshold" or "sensor"
+#   alert(message)                         a Discord alert
+# handle() and on_message() touch separate state, so the scripts call them
+# from their serial and MQTT threads; the daemon calls both on its loop.
+
+# Numeric form of each row, shared by the history API and the reports
+SENSOR_COLUMNS = {"light": "light", "temperature": "temperature", "loud": "sound = 'Yes'"}
+ACTUATOR_COLUMNS = {"led": "led = 'on'", "fan": "fan = 'on'", "door": "door = 'open'", "manual": "mode = 'manual'"}
+
+LOG = get_logger("room")
+
+def _insert_sql(table, scope, columns):
+    columns = [*scope, *columns]
+    return f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})"
+
+class OutsideRoom:
+    # Readings from an outside Arduino: alerts, report counters, rollups
+    # and history see every reading; only readings that pass the deadband
+    # are stored as raw rows and published on data_topic. Handles the
+    # inside Arduino's sensor status and cloud weather suggestions.
+    def __init__(self, writer, publish, send, alert, alerts, deadband, data_topic, status_topic, suggestion_topic,
+                 name="outside", label=None, scope=None, raw_table="logs", summary_table="daily_summary",
+                 rollup_prefix="sensor_rollup", history_name="sensors", history_capacity=86400,
+                 light_threshold=800, temp_threshold=30.0, checkpoint_interval=60.0, chunk_rows=5000,
+                 max_gap=30.0, window_minutes=15, z_limit=3.0):
+        self.writer = writer
+        self.publish = publish
+        self.send = send
+        self.alert = alert
+        self.alerts = alerts
+        self.deadband = deadband
+        self.data_topic = data_topic
+        self.status_topic = status_topic
+        self.suggestion_topic = suggestion_topic
+        self.name = name
+        self.label = label  # Shown in report headings (the room in the daemon)
+        self.light_threshold = light_threshold
+        self.temp_threshold = temp_threshold
+        self.default_temp_threshold = temp_threshold
+
+        self.alert_slot = alerts.slot(label or name)
+        self.scope = dict(scope or {})
+        self._scope_values = tuple(self.scope.values())
+        self.insert_sql = _insert_sql(raw_table, self.scope, ("time", "light", "sound", "temperature"))
+
+        # Report counters kept up to date as readings arrive
+        self.summary = DailySummary(
+            writer,
+            summary_table,
+            ["total", "light_high", "sound_high", "temp_high"],
+            checkpoint_interval=checkpoint_interval,
+            scope=self.scope
+        )
+
+        # Minute/hour aggregates
+        self.rollup = SensorRollup(writer, rollup_prefix, scope=self.scope)
+
+        # Range queries for dashboards: the newest readings never touch the database
+        self.history = HistoryStore(
+            history_name,
+            HistoryRing(tuple(SENSOR_COLUMNS), history_capacity),
+            writer,
+            raw_table,
+            SENSOR_COLUMNS,
+            scope=self.scope
+        )
+
+        # Percentiles, moving averages, time above threshold and anomalies per day
+        self.analytics = DayAnalytics(
+            writer,
+            raw_table,
+            SENSOR_COLUMNS,
+            bins={"light": (0, 6000, 5), "temperature": (-40, 85, 1)},  # calculateLux() maps to 0-6000 lux
+            scope=self.scope,
+            chunk_rows=chunk_rows,
+            max_gap=max_gap,
+            window_minutes=window_minutes,
+            z_limit=z_limit
+        )
+
+    def topics(self):
+        return [self.status_topic, self.suggestion_topic]
+
+    def handle(self, received_at, reading):
+        light, sound, temp = reading
+        now = datetime.fromtimestamp(received_at)
+
+        # Alerts: rules with hysteresis, debounce and rate of change
+        loud = sound.strip().lower() == "yes"
+        for message in self.alerts.evaluate(self.alert_slot, (light, temp, 1 if loud else 0), received_at):
+            self.alert(message)
+
+        # Update today's report counters and the rollups incrementally
+        self.summary.add(
+            now.date(),
+            total=1,
+            light_high=light > self.light_threshold,
+            sound_high=loud,
+            temp_high=temp > self.temp_threshold
+        )
+        self.rollup.add(now, light, temp, loud)
+        self.history.add(received_at, (light, temp, 1 if loud else 0))
+
+        # Store and publish only readings that changed (or the heartbeat)
+        (light, sound, temp), changed = self.deadband.update((light, sound, temp), received_at)
+        if not changed:
+            return
+        self.writer.submit(self.insert_sql, (*self._scope_values, now, light, sound, temp))
+        self.publish(self.data_topic, {
+            "timestamp": now.isoformat(),
+            "light": light,
+            "sound": sound,
+            "temperature": temp
+        })
+
+    def on_message(self, topic, payload):
+        # Sensor status from the inside Arduino
+        if topic == self.status_topic:
+            self.send(f"status:{payload['sensors']}", "command")
+
+        # Cloud weather suggestion: new thresholds or rules take effect
+        # before the next reading
+        elif topic.endswith("/suggestion"):
+            self.temp_threshold = payload.get("temp threshold", self.default_temp_threshold)
+            # The daemon applies a suggestion for every room to all slots once
+            if topic == self.suggestion_topic:
+                self.alerts.apply_suggestion(payload, self.alert_slot)
+
+    def load(self, conn, history_seconds):
+        # Resume today's counters and recent history after a restart
+        self.summary.load(conn)
+        self.history.load_recent(conn, history_seconds)
+
+    def build_report(self, conn, start_day=None, end_day=None):
+        # Defaults to today; counters come from the per-day summary table.
+        # Returns (title, text)
+        start_day = start_day or datetime.now().date()
+        end_day = end_day or start_day
+        totals = self.summary.totals(conn, start_day, end_day)
+        suffix = f" - {self.label}" if self.label else ""
+
+        report = f"**SENSORS DAILY REPORT{suffix}**\n"
+        if end_day != start_day:
+            report += f"From {start_day} to {end_day}\n"
+        total = totals["total"]
+        if total == 0:
+            report += "No sensor data recorded today.\n"
+        else:
+            report += f"Total records: {total}\n"
+            report += f"Light > {self.light_threshold} lux: {totals['light_high'] / total * 100:.2f}% of time\n"
+            report += f"Loud noise: {totals['sound_high'] / total * 100:.2f}% of time\n"
+            report += f"Temperature > {self.temp_threshold}°C: {totals['temp_high'] / total * 100:.2f}% of time\n"
+
+            # Detailed statistics for single-day reports
+            if end_day == start_day:
+                stats = self.analytics.analyze(
+                    conn, start_day, {"light": self.light_threshold, "temperature": self.temp_threshold, "loud": 0.5})
+                report += sensor_report_lines(stats, self.light_threshold, self.temp_threshold)
+        return f"📊 Daily Sensor Report{suffix}", report
+
+    def flush(self):
+        # Counters and aggregates not yet written (shutdown, reports)
+        self.summary.checkpoint()
+        self.rollup.flush()
+
+class InsideRoom:
+    # Status frames and command acknowledgements from an inside Arduino,
+    # and the control, suggestion and outside-reading messages for it.
+    # Commands go through a CommandQueue (self.commands): threaded callers
+    # start() it, the daemon calls expire() from its loop.
+    def __init__(self, writer, publish, send, alert, outside_topic, status_topic, data_topic, control_prefix,
+                 ack_topic, suggestion_topic, name="inside", label=None, scope=None, raw_table="logs",
+                 summary_table="daily_summary", rollup_prefix="actuator_rollup", history_name="actuators",
+                 history_capacity=28800, checkpoint_interval=60.0, chunk_rows=5000, max_gap=30.0,
+                 ack_timeout=2.0, forward_refresh=60.0):
+        self.writer = writer
+        self.publish = publish
+        self.send = send
+        self.alert = alert
+        self.outside_topic = outside_topic
+        self.status_topic = status_topic
+        self.data_topic = data_topic
+        self.control_prefix = control_prefix  # + actuator name (mode, led, fan, door)
+        self.ack_topic = ack_topic
+        self.suggestion_topic = suggestion_topic
+        self.name = name
+        self.label = label
+        self.forward_refresh = forward_refresh
+
+        # Control mode as last commanded (the sketch starts in auto)
+        self.current_mode = "auto"
+
+        # Last commanded states, previous status frame for transition
+        # counting, and the last outside reading line sent and when
+        self.last_state = {"led": None, "door": None, "fan": None}
+        self.prev_status = {"led": None, "fan": None, "door": None, "mode": None}
+        self.last_forwarded = (None, 0.0)
+
+        self.scope = dict(scope or {})
+        self._scope_values = tuple(self.scope.values())
+        self.insert_sql = _insert_sql(raw_table, self.scope, ("time", "led", "fan", "door", "mode"))
+
+        # Coalescing command path to the Arduino, acknowledged end to end
+        self.commands = CommandQueue(
+            send,
+            self.publish_command_result,
+            ack_timeout=ack_timeout,
+            name=f"Commands {name}"
+        )
+
+        # Report counters kept up to date as status frames arrive
+        self.summary = DailySummary(
+            writer,
+            summary_table,
+            ["total", "led_on", "door_open", "fan_on", "mode_manual"],
+            checkpoint_interval=checkpoint_interval,
+            scope=self.scope
+        )
+
+        # Minute/hour aggregates
+        self.rollup = ActuatorRollup(writer, rollup_prefix, max_gap=max_gap, scope=self.scope)
+
+        # Range queries for dashboards
+        self.history = HistoryStore(
+            history_name,
+            HistoryRing(tuple(ACTUATOR_COLUMNS), history_capacity),
+            writer,
+            raw_table,
+            ACTUATOR_COLUMNS,
+            scope=self.scope
+        )
+
+        # Duty cycles and switch-on counts per day
+        self.analytics = DayAnalytics(
+            writer,
+            raw_table,
+            ACTUATOR_COLUMNS,
+            scope=self.scope,
+            chunk_rows=chunk_rows,
+            max_gap=max_gap
+        )
+
+    def topics(self):
+        return [self.outside_topic, self.control_prefix + "#", self.suggestion_topic]
+
+    def handle(self, received_at, record):
+        kind, values = record
+        if kind == "ACTUATORS":
+            mode, led, fan, door = values
+            self.current_mode = mode  # The mode the sketch reports is the one in force
+            now = datetime.fromtimestamp(received_at)
+
+            # Queue status for the batched database writer
+            self.writer.submit(self.insert_sql, (*self._scope_values, now, led, fan, door, mode))
+
+            # Update today's report counters and the rollups incrementally
+            status = {"led": led.strip(), "fan": fan.strip(), "door": door.strip(), "mode": mode.strip()}
+            self.count_transitions(now.date(), status)
+            self.rollup.add(now, status)
+            self.history.add(received_at, (
+                status["led"] == "on", status["fan"] == "on", status["door"] == "open", status["mode"] == "manual"
+            ))
+
+            self.publish(self.data_topic, {
+                "time": now.isoformat(),
+                "led": led,
+                "fan": fan,
+                "door": door,
+                "mode": mode
+            })
+
+        elif kind == "SENSORS":
+            self.publish(self.status_topic, {"sensors": values}, spooled=False)
+
+        elif kind == "ACK":
+            # The sketch applied a command: answer its sender now
+            sequence, mode, led, fan, door = values
+            self.commands.ack(sequence, {"mode": mode, "led": led, "fan": fan, "door": door})
+
+    def count_transitions(self, day, status):
+        # Count transitions into the reported states
+        prev = self.prev_status
+        self.summary.add(
+            day,
+            total=1,
+            led_on=prev["led"] == "off" and status["led"] == "on",
+            door_open=prev["door"] not in (None, "open") and status["door"] == "open",
+            fan_on=prev["fan"] == "off" and status["fan"] == "on",
+            mode_manual=prev["mode"] == "auto" and status["mode"] == "manual"
+        )
+        self.prev_status = status
+
+    def publish_command_result(self, command_id, result):
+        # Sent straight away: a result replayed after an outage is useless
+        if command_id is None:
+            return
+        self.publish(self.ack_topic, {"id": command_id, **result}, spooled=False)
+
+    def on_message(self, topic, payload):
+        # Forward outside sensor data to the Arduino unless it already has it
+        if topic == self.outside_topic:
+            line = f"sensor:outside,temp:{payload['temperature']},light:{payload['light']},sound:{payload['sound']}"
+            now = time.monotonic()
+            if line != self.last_forwarded[0] or now - self.last_forwarded[1] >= self.forward_refresh:
+                self.send(line, "sensor")
+                self.last_forwarded = (line, now)
+
+        # Handle mode control commands
+        elif topic == self.control_prefix + "mode":
+            new_mode = payload.get("mode", "").lower()
+            if new_mode in ["auto", "manual"]:
+                self.current_mode = new_mode
+                self.alert(f"⚙️⚙️ CONTROL MODE changed to {self.current_mode.upper()} ⚙️⚙️")
+            self.commands.submit("mode", self.current_mode, payload.get("id"))
+
+        # Handle actuator control commands
+        elif topic.startswith(self.control_prefix):
+            actuator = topic.split("/")[-1]
+            value = str(payload.get(actuator, "")).lower()
+            if self.current_mode == "auto":
+                LOG.info("%s ignoring actuator command in AUTO mode.", self.name)
+                self.alert("⚠️⚠️ WARING: SYSTEM in AUTO MODE, IGNORED COMMAND ⚠️⚠️")
+                self.publish_command_result(payload.get("id"), {"status": "ignored", "actuator": actuator, "value": value})
+                return
+
+            # Queue command for the Arduino (newer commands replace waiting ones)
+            self.commands.submit(actuator, value, payload.get("id"))
+            if actuator in self.last_state and self.last_state[actuator] != value:
+                self.alert(f"🔄🔄 ACTUATOR '{actuator.upper()}' CHANGED TO: {value.upper()} 🔄🔄")
+                self.last_state[actuator] = value
+
+        # Handle cloud weather suggestions: alert and update the temperature threshold
+        elif topic.endswith("/suggestion"):
+            self.alert(f"🌤️🌤️ MESSAGE FROM CLOUD: {payload.get('message', '')}🌤️🌤️")
+            self.send(f"threshold:{payload.get('temp threshold', 30.0)}", "threshold")
+
+    def load(self, conn, history_seconds):
+        # Resume today's counters and recent history after a restart
+        self.summary.load(conn)
+        self.history.load_recent(conn, history_seconds)
+
+    def build_report(self, conn, start_day=None, end_day=None):
+        # Defaults to today; counters come from the per-day summary table.
+        # Returns (title, text)
+        start_day = start_day or datetime.now().date()
+        end_day = end_day or start_day
+        totals = self.summary.totals(conn, start_day, end_day)
+        suffix = f" - {self.label}" if self.label else ""
+
+        report = f"**ACTUATORS REPORT{suffix}**\n"
+        if end_day != start_day:
+            report += f"From {start_day} to {end_day}\n"
+        if totals["total"] == 0:
+            report += "No actuator activity recorded today.\n"
+        else:
+            report += f"LED turned ON: {totals['led_on']} times\n"
+            report += f"Door opened: {totals['door_open']} times\n"
+            report += f"Fan turned ON: {totals['fan_on']} times\n"
+            report += f"Mode changed to MANUAL: {totals['mode_manual']} times\n"
+
+            # Detailed statistics for single-day reports
+            if end_day == start_day:
+                stats = self.analytics.analyze(conn, start_day, dict.fromkeys(ACTUATOR_COLUMNS, 0.5))
+                report += actuator_report_lines(stats)
+        return f"⚙️ Daily Actuator Report{suffix}", report
+
+    def flush(self):
+        # Counters and aggregates not yet written (shutdown, reports)
+        self.summary.checkpoint()
+        self.rollup.flush()
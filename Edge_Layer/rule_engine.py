@@ -0,0 +1,238 @@
+from array import array
+from collections import deque
+from time import perf_counter
+from log import get_logger
+from metrics import stage
+
+LOG = get_logger("rules")
+
+# =============================================================================
+# RULE DEFINITIONS
+# =============================================================================
+
+# A rule is a plain dict, e.g.
+#   {"name": "temp_high", "sensor": "temperature", "above": 30.0, "band": 1.0,
+#    "debounce": 5.0, "param": "temp threshold",
+#    "message": "TEMPERATURE {value} °C, EXCEEDED {threshold:g} °C"}
+#
+#   sensor    one of the engine's sensor names
+#   above     fires when the value rises above this ...
+#   below     ... or falls below this (exactly one of the two)
+#   band      hysteresis: once fired, the rule clears only when the value is
+#             back by more than band (default 0: clears as soon as it is back)
+#   debounce  seconds the condition must hold before the rule fires
+#   hold      seconds a fired rule stays fired at least (for on/off sensors,
+#             where a band cannot stop flapping)
+#   rate      compare the change per this many seconds instead of the value,
+#             measured over windows of the same length (rate-of-change rule)
+#   param     suggestion key whose value replaces the threshold at run time
+#   message   alert text; {value}, {threshold} and {room} are filled in
+#
+# An alert is sent only when a rule goes from clear to fired.
+
+RULE_KEYS = {"name", "sensor", "above", "below", "band", "debounce", "hold", "rate", "param", "message"}
+
+def compile_rules(rules, sensors):
+    # Validates the definitions and turns each one into a tuple:
+    # (name, sensor index, sign, threshold, band, debounce, hold, rate window, param, message)
+    compiled = []
+    names = set()
+    for rule in rules:
+        unknown = set(rule) - RULE_KEYS
+        if unknown:
+            raise ValueError(f"rule {rule.get('name')!r} has unknown keys {sorted(unknown)}")
+        name = rule["name"]
+        if name in names:
+            raise ValueError(f"duplicate rule {name!r}")
+        names.add(name)
+        if rule["sensor"] not in sensors:
+            raise ValueError(f"rule {name!r} uses unknown sensor {rule['sensor']!r}")
+        if ("above" in rule) == ("below" in rule):
+            raise ValueError(f"rule {name!r} needs exactly one of 'above' or 'below'")
+
+        # "below" rules are evaluated on the negated value so every rule
+        # uses the same comparison
+        sign = 1.0 if "above" in rule else -1.0
+        threshold = float(rule["above"] if "above" in rule else rule["below"])
+        band = float(rule.get("band", 0.0))
+        debounce = float(rule.get("debounce", 0.0))
+        hold = float(rule.get("hold", 0.0))
+        rate = float(rule.get("rate", 0.0))
+        if min(band, debounce, hold, rate) < 0:
+            raise ValueError(f"rule {name!r} has a negative band, debounce, hold or rate")
+        compiled.append((
+            name, sensors.index(rule["sensor"]), sign, threshold, band, debounce, hold, rate,
+            rule.get("param"), rule.get("message", f"{name}: {{value}}")
+        ))
+    return tuple(compiled)
+
+# =============================================================================
+# RULE ENGINE
+# =============================================================================
+
+class RuleEngine:
+    # Evaluates compiled rules against each reading in O(number of rules).
+    # State for every (slot, rule) pair lives in flat arrays indexed by
+    # slot * rules + rule, where a slot is one room (or one device). Rule
+    # swaps and threshold changes may come from any thread: they are
+    # queued and applied by the evaluating thread before its next reading,
+    # so evaluation never sees a half-installed rule set.
+    def __init__(self, sensors, rules, name="Rules"):
+        self.sensors = tuple(sensors)
+        self.name = name
+        self.slots = {}          # slot key (e.g. room) -> slot index
+        self._keys = []          # slot index -> slot key
+        self._params = []        # per slot: suggestion parameters applied so far
+        self._shared_params = {} # parameters sent to every slot, for slots added later
+        self._updates = deque()  # callables applied on the evaluating thread
+        self._stage = stage(name.lower().replace(" ", ".") + ".evaluate")
+        self._install(compile_rules(rules, self.sensors))
+
+    def slot(self, key):
+        # Slot index for a room; create every slot before evaluation starts
+        index = self.slots.get(key)
+        if index is None:
+            index = self.slots[key] = len(self._keys)
+            self._keys.append(key)
+            self._params.append({})
+            self._grow()
+            self._apply_params(self._shared_params, index)
+        return index
+
+    # ---------- configuration (any thread) ----------
+
+    def replace_rules(self, rules):
+        # Compiled here so a bad definition is rejected in the caller's
+        # thread; installed before the next evaluation
+        compiled = compile_rules(rules, self.sensors)
+        self._updates.append(lambda: self._install(compiled))
+
+    def set_params(self, params, slot=None):
+        # Threshold overrides by "param" key, for one slot or all of them
+        params = dict(params)
+        self._updates.append(lambda: self._apply_params(params, slot))
+
+    def apply_suggestion(self, payload, slot=None):
+        # cloud/suggestion: optional "alert rules" list plus any rule params
+        rules = payload.get("alert rules")
+        if rules is not None:
+            try:
+                self.replace_rules(rules)
+                LOG.info("%s: %d alert rules received", self.name, len(rules))
+            except (KeyError, TypeError, ValueError) as e:
+                LOG.error("%s: rejected alert rules: %s", self.name, e)
+        self.set_params({key: value for key, value in payload.items() if key != "alert rules"}, slot)
+
+    # ---------- evaluation (one thread) ----------
+
+    def evaluate(self, slot, values, ts):
+        # values: one number per sensor, in the engine's sensor order.
+        # Returns the alert messages of rules that fired on this reading.
+        start = perf_counter()
+        updates = self._updates
+        while updates:
+            updates.popleft()()
+
+        alerts = []
+        rules = self._rules
+        base = slot * len(rules)
+        active, since, set_at, clear_at = self._active, self._since, self._set_at, self._clear_at
+        for i, (name, sensor, sign, _, _, debounce, hold, rate, _, message) in enumerate(rules):
+            k = base + i
+            value = values[sensor]
+
+            if rate:
+                # Change per `rate` seconds over at least `rate` seconds
+                ref_ts = self._ref_ts[k]
+                if not ref_ts:
+                    self._ref_ts[k], self._ref_value[k] = ts, value
+                    continue
+                elapsed = ts - ref_ts
+                if elapsed < rate:
+                    continue
+                value = (value - self._ref_value[k]) / elapsed * rate
+                self._ref_ts[k], self._ref_value[k] = ts, values[sensor]
+
+            # since[k]: when the condition started (clear) or when it fired
+            x = sign * value
+            if active[k]:
+                # Hysteresis: stay fired until back past the clear level
+                if x <= clear_at[k] and ts - since[k] >= hold:
+                    active[k] = 0
+                    since[k] = 0.0
+            elif x > set_at[k]:
+                if debounce:
+                    if not since[k]:
+                        since[k] = ts
+                    if ts - since[k] < debounce:
+                        continue
+                active[k] = 1
+                since[k] = ts
+                alerts.append(message.format(value=value, threshold=sign * set_at[k], room=self._keys[slot]))
+            else:
+                since[k] = 0.0
+
+        self._stage.observe(perf_counter() - start)
+        return alerts
+
+    # ---------- internals ----------
+
+    def _install(self, rules):
+        # Carry state over for rules that keep their name so a swap does not
+        # re-fire alerts that are already active
+        old_rules = getattr(self, "_rules", ())
+        old_index = getattr(self, "_index", {})
+        old = (getattr(self, "_active", None), getattr(self, "_since", None),
+               getattr(self, "_ref_ts", None), getattr(self, "_ref_value", None))
+
+        self._rules = rules
+        self._index = {rule[0]: i for i, rule in enumerate(rules)}
+        size = len(self._keys) * len(rules)
+        self._active = array('b', bytes(size))
+        self._since = array('d', bytes(8 * size))
+        self._ref_ts = array('d', bytes(8 * size))
+        self._ref_value = array('d', bytes(8 * size))
+        self._set_at = array('d', bytes(8 * size))
+        self._clear_at = array('d', bytes(8 * size))
+
+        for slot in range(len(self._keys)):
+            base, old_base = slot * len(rules), slot * len(old_rules)
+            for i, rule in enumerate(rules):
+                self._set_threshold(base + i, rule, rule[3])
+                j = old_index.get(rule[0])
+                if j is not None and old[0] is not None:
+                    for new_array, old_array in zip((self._active, self._since, self._ref_ts, self._ref_value), old):
+                        new_array[base + i] = old_array[old_base + j]
+            self._apply_params(self._params[slot], slot)
+
+    def _grow(self):
+        # Room for one more slot, with the rules' default thresholds
+        n = len(self._rules)
+        self._active.extend(bytes(n))
+        for values in (self._since, self._ref_ts, self._ref_value, self._set_at, self._clear_at):
+            values.extend([0.0] * n)
+        base = (len(self._keys) - 1) * n
+        for i, rule in enumerate(self._rules):
+            self._set_threshold(base + i, rule, rule[3])
+
+    def _set_threshold(self, k, rule, threshold):
+        sign, band = rule[2], rule[4]
+        self._set_at[k] = sign * threshold
+        self._clear_at[k] = sign * threshold - band
+
+    def _apply_params(self, params, slot):
+        if slot is None:
+            self._shared_params.update(params)
+        slots = range(len(self._keys)) if slot is None else (slot,)
+        for s in slots:
+            for i, rule in enumerate(self._rules):
+                param = rule[8]
+                if param is None or param not in params:
+                    continue
+                try:
+                    threshold = float(params[param])
+                except (TypeError, ValueError):
+                    LOG.error("%s: bad value for %r: %r", self.name, param, params[param])
+                    continue
+                self._set_threshold(s * len(self._rules) + i, rule, threshold)
+                self._params[s][param] = params[param]
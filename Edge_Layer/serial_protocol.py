@@ -0,0 +1,222 @@
+import logging
+import struct
+
+LOG = logging.getLogger("serial")  # stdlib only: the benchmark's fake Arduino imports this without Common
+
+# =============================================================================
+# PROTOCOL CONSTANTS
+# =============================================================================
+
+# Framed mode (FRAMED_PROTOCOL 1 in the sketches):
+#   0xA5 0x5A | LEN | TYPE | PAYLOAD | CRC16 (little-endian)
+# LEN counts TYPE + PAYLOAD. The CRC is CRC-16/CCITT-FALSE over LEN..PAYLOAD.
+FRAME_SYNC = b'\xa5\x5a'
+FRAME_OVERHEAD = 5  # sync (2) + len (1) + crc (2)
+
+FRAME_SENSORS = 0x01    # Outside Arduino: light lux, temperature °C, sound flag
+FRAME_ACTUATORS = 0x02  # Inside Arduino: mode/light/fan/door bit flags
+FRAME_ACK = 0x03        # Inside Arduino: sensor acknowledgment status
+FRAME_COMMAND_ACK = 0x04  # Inside Arduino: command ID and actuator flags after applying it
+
+SENSORS_LAYOUT = struct.Struct('<HhB')  # light, temperature, sound
+FLAGS_LAYOUT = struct.Struct('<B')
+COMMAND_ACK_LAYOUT = struct.Struct('<IB')  # command ID, actuator flags
+
+# Actuator flag bits
+FLAG_MANUAL = 0x01
+FLAG_LIGHT = 0x02
+FLAG_FAN = 0x04
+FLAG_DOOR = 0x08
+
+def _crc16_table():
+    table = []
+    for byte in range(256):
+        crc = byte << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x1021) if crc & 0x8000 else (crc << 1)
+        table.append(crc & 0xFFFF)
+    return table
+
+CRC16_TABLE = _crc16_table()
+
+def crc16(data, start=0, end=None):
+    crc = 0xFFFF
+    table = CRC16_TABLE
+    for i in range(start, len(data) if end is None else end):
+        crc = ((crc << 8) & 0xFFFF) ^ table[(crc >> 8) ^ data[i]]
+    return crc
+
+def encode_frame(frame_type, payload):
+    body = bytes([len(payload) + 1, frame_type]) + payload
+    return FRAME_SYNC + body + crc16(body).to_bytes(2, 'little')
+
+# =============================================================================
+# TEXT FORMAT (FALLBACK)
+# =============================================================================
+
+def _fields(text):
+    # "Light:512, Sound:No, Temperature:24" -> {"light": "512", ...}
+    fields = {}
+    for part in text.split(','):
+        key, sep, value = part.partition(':')
+        if sep:
+            fields[key.strip().lower()] = value.strip()
+    return fields
+
+def parse_sensor_text(line):
+    # Outside Arduino: "Light:512, Sound:No, Temperature:24"
+    if not line:
+        return None
+    fields = _fields(line)
+    return int(fields["light"]), fields["sound"], int(fields["temperature"])
+
+def parse_inside_text(line):
+    # Inside Arduino: "ACTUATORS|Mode: auto, Light: on, Fan: off, Door: close"
+    if line.startswith("ACTUATORS|"):
+        fields = _fields(line[len("ACTUATORS|"):])
+        return "ACTUATORS", (fields["mode"], fields["light"], fields["fan"], fields["door"])
+
+    # Inside Arduino: "SENSORS|status: active"
+    elif line.startswith("SENSORS|"):
+        fields = _fields(line[len("SENSORS|"):])
+        return "SENSORS", fields["status"]
+
+    # Inside Arduino: "ACK|id: 17, Mode: manual, Light: on, Fan: off, Door: close"
+    elif line.startswith("ACK|"):
+        fields = _fields(line[len("ACK|"):])
+        return "ACK", (int(fields["id"]), fields["mode"], fields["light"], fields["fan"], fields["door"])
+
+    return None
+
+# =============================================================================
+# FRAMED FORMAT
+# =============================================================================
+
+def _sensor_record(values):
+    light, temp, sound = values
+    return light, "Yes" if sound else "No", temp
+
+def _flag_states(flags):
+    return (
+        "manual" if flags & FLAG_MANUAL else "auto",
+        "on" if flags & FLAG_LIGHT else "off",
+        "on" if flags & FLAG_FAN else "off",
+        "open" if flags & FLAG_DOOR else "close",
+    )
+
+def _actuator_record(values):
+    (flags,) = values
+    return "ACTUATORS", _flag_states(flags)
+
+def _command_ack_record(values):
+    command_id, flags = values
+    return "ACK", (command_id,) + _flag_states(flags)
+
+def _ack_record(values):
+    (status,) = values
+    return "SENSORS", "active" if status else "inactive"
+
+# Frame type -> (payload layout, record builder). Records have the same
+# shape as the text parsers so the logging threads do not care which
+# protocol is in use.
+SENSOR_FRAMES = {FRAME_SENSORS: (SENSORS_LAYOUT, _sensor_record)}
+INSIDE_FRAMES = {
+    FRAME_ACTUATORS: (FLAGS_LAYOUT, _actuator_record),
+    FRAME_ACK: (FLAGS_LAYOUT, _ack_record),
+    FRAME_COMMAND_ACK: (COMMAND_ACK_LAYOUT, _command_ack_record),
+}
+
+# =============================================================================
+# STREAM DECODERS
+# =============================================================================
+
+class LineDecoder:
+    # Text mode: splits the byte stream into lines and parses each one
+    def __init__(self, parse, name="Serial"):
+        self.parse = parse
+        self.name = name
+        self.errors = 0
+        self._buffer = bytearray()
+
+    def feed(self, data):
+        records = []
+        self._buffer += data
+        while True:
+            end = self._buffer.find(b'\n')
+            if end < 0:
+                return records
+            line = self._buffer[:end].decode(errors='replace').strip()
+            del self._buffer[:end + 1]
+            try:
+                record = self.parse(line)
+            except Exception as e:
+                self.errors += 1
+                LOG.warning("%s could not parse %r: %s", self.name, line, e)
+                continue
+            if record is not None:
+                records.append(record)
+
+class FrameDecoder:
+    # Framed mode: finds frames in a reusable buffer, checks the CRC and
+    # unpacks payloads in place with struct. Corrupt frames are counted and
+    # the decoder resynchronises on the next sync marker.
+    def __init__(self, layouts, name="Serial", max_buffer=1024):
+        self.layouts = layouts
+        self.name = name
+        self.max_buffer = max_buffer
+        self.errors = 0
+        self._buffer = bytearray()
+
+        # Longest valid LEN (type byte + payload); anything longer is a
+        # corrupt length or a false sync, rejected without waiting for it
+        self.max_length = max(layout.size for layout, _ in layouts.values()) + 1
+
+    def feed(self, data):
+        buf = self._buffer
+        buf += data
+        records = []
+        pos = 0
+
+        while True:
+            start = buf.find(FRAME_SYNC, pos)
+            if start < 0:
+                # Keep a trailing first sync byte, drop everything else
+                pos = len(buf) - 1 if buf.endswith(FRAME_SYNC[:1]) else len(buf)
+                break
+            if len(buf) - start < 4:
+                pos = start
+                break
+
+            length = buf[start + 2]
+            if length == 0 or length > self.max_length:
+                self.errors += 1
+                pos = start + 1
+                continue
+            end = start + 3 + length + 2
+            if len(buf) < end:
+                pos = start
+                break
+
+            crc = buf[end - 2] | (buf[end - 1] << 8)
+            if crc16(buf, start + 2, end - 2) != crc:
+                self.errors += 1
+                pos = start + 1
+                continue
+
+            pos = end
+            layout = self.layouts.get(buf[start + 3])
+            if layout is None or layout[0].size != length - 1:
+                self.errors += 1
+                continue
+            records.append(layout[1](layout[0].unpack_from(buf, start + 4)))
+
+        del buf[:pos]
+        if len(buf) > self.max_buffer:
+            self.errors += 1
+            del buf[:]
+        return records
+
+def make_decoder(protocol, text_parse, frame_layouts, name="Serial"):
+    if protocol == "framed":
+        return FrameDecoder(frame_layouts, name=name)
+    return LineDecoder(text_parse, name=name)
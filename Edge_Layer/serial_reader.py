@@ -0,0 +1,96 @@
+import queue
+import threading
+import time
+from log import get_logger
+from metrics import stage
+
+LOG = get_logger("serial")
+
+# =============================================================================
+# EVENT-DRIVEN SERIAL READER
+# =============================================================================
+
+class SerialReader:
+    # Blocks on the serial port instead of polling it. Incoming bytes go to a
+    # decoder (text lines or binary frames, see serial_protocol.py); every
+    # complete record is handed to the consumer through a bounded queue as
+    # (received_at, record).
+    def __init__(self, port, decoder, max_queue=1000, name="Serial"):
+        self.port = port
+        self.decoder = decoder
+        self.name = name
+        self.records = queue.Queue(maxsize=max_queue)
+
+        self._stop = threading.Event()
+        self._thread = None
+        self._stage = stage(name.lower().replace(" ", ".") + ".decode")
+
+        # Statistics
+        self.received = 0
+        self.dropped = 0
+        self.last_record_us = 0.0
+        self.max_record_us = 0.0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name=f"{self.name}-reader", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=2.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def get(self, timeout=None):
+        return self.records.get(timeout=timeout)
+
+    def stats(self):
+        return {
+            "received": self.received,
+            "decode_errors": self.decoder.errors,
+            "dropped": self.dropped,
+            "queue_depth": self.records.qsize(),
+            "last_record_us": self.last_record_us,
+            "max_record_us": self.max_record_us,
+        }
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                # Block until at least one byte arrives (or the port timeout
+                # expires), then take everything already buffered by the OS
+                data = self.port.read(self.port.in_waiting or 1)
+            except Exception as e:
+                LOG.error("%s read failed: %s", self.name, e)
+                self._stop.wait(1)
+                continue
+
+            if data:
+                self.feed(data)
+
+    def feed(self, data):
+        received_at = time.time()
+        start = time.perf_counter()
+
+        # Decode every complete record currently buffered
+        records = self.decoder.feed(data)
+        for record in records:
+            try:
+                self.records.put_nowait((received_at, record))
+            except queue.Full:
+                # Keep the newest data: discard the oldest pending record
+                try:
+                    self.records.get_nowait()
+                except queue.Empty:
+                    pass
+                self.records.put_nowait((received_at, record))
+                self.dropped += 1
+
+        elapsed = time.perf_counter() - start
+        self._stage.observe(elapsed)
+        if records:
+            self.received += len(records)
+            elapsed_us = elapsed * 1e6 / len(records)
+            self.last_record_us = elapsed_us
+            if elapsed_us > self.max_record_us:
+                self.max_record_us = elapsed_us
@@ -0,0 +1,117 @@
+import threading
+import time
+from collections import deque
+from log import get_logger
+from metrics import counter, gauge, stage
+
+LOG = get_logger("serial")
+
+ERROR_LOG_INTERVAL = 10.0  # Seconds between "write failed" lines (every failure is counted)
+
+# =============================================================================
+# PRIORITY SERIAL WRITER
+# =============================================================================
+
+# Line classes, highest priority first. Commands (actuators and mode) are
+# sent in order and never dropped; a pending threshold or sensor forward is
+# replaced by a newer one, since the sketch only needs the latest value.
+KINDS = ("command", "threshold", "sensor")
+COALESCED_KINDS = ("threshold", "sensor")
+
+class SerialWriter:
+    # Only this writer's thread writes to the port, so lines from the MQTT,
+    # serial and timeout threads never interleave and a burst of sensor
+    # forwards cannot hold up a command: whenever the port is free the
+    # highest-priority pending line goes next. The time each line waits is
+    # exported per class as "<name>.queue.<kind>".
+    def __init__(self, port, name="Serial"):
+        self.port = port
+        self.name = name
+
+        self._cond = threading.Condition()
+        self._commands = deque()  # (line, queued_at); bounded by the command queue's one-per-actuator
+        self._latest = {}         # kind -> (line, queued_at)
+        self._stop = False
+        self._thread = None
+
+        # Statistics
+        self.sent = dict.fromkeys(KINDS, 0)
+        self.coalesced = dict.fromkeys(COALESCED_KINDS, 0)
+        self.errors = 0
+        self._errors_logged = 0
+        self._error_logged_at = float("-inf")
+
+        label = name.lower().replace(" ", ".")
+        self._stages = {kind: stage(f"{label}.queue.{kind}") for kind in KINDS}
+        for kind in KINDS:
+            counter("serial_lines_total", "Lines written to the Arduino by class",
+                    lambda kind=kind: self.sent[kind], writer=label, line=kind)
+        for kind in COALESCED_KINDS:
+            counter("serial_coalesced_total", "Pending lines replaced by a newer one before being written",
+                    lambda kind=kind: self.coalesced[kind], writer=label, line=kind)
+        gauge("serial_pending", "Lines waiting for the serial port", self.pending, writer=label)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name=f"{self.name}-writer", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=2.0):
+        # Lines already queued are still written
+        with self._cond:
+            self._stop = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def send(self, line, kind="command"):
+        # Non-blocking; safe from any thread
+        now = time.perf_counter()
+        with self._cond:
+            if kind == "command":
+                self._commands.append((line, now))
+            else:
+                if kind in self._latest:
+                    self.coalesced[kind] += 1
+                self._latest[kind] = (line, now)
+            self._cond.notify()
+
+    def pending(self):
+        return len(self._commands) + len(self._latest)
+
+    def _next_locked(self):
+        if self._commands:
+            return ("command",) + self._commands.popleft()
+        for kind in COALESCED_KINDS:
+            if kind in self._latest:
+                return (kind,) + self._latest.pop(kind)
+        return None
+
+    def _run(self):
+        while True:
+            with self._cond:
+                item = self._next_locked()
+                while item is None and not self._stop:
+                    self._cond.wait()
+                    item = self._next_locked()
+            if item is None:
+                return  # Stopped with nothing left to write
+            kind, line, queued_at = item
+            self._stages[kind].observe(time.perf_counter() - queued_at)
+            try:
+                # Blocks for the line's time on the wire once the OS buffer is full
+                self.port.write((line + '\n').encode())
+                self.sent[kind] += 1
+            except Exception as e:
+                self.errors += 1
+                self._stages[kind].error()
+                self._log_error(e)
+
+    def _log_error(self, error):
+        # An unplugged port fails every queued line: one line per interval
+        now = time.monotonic()
+        if now - self._error_logged_at < ERROR_LOG_INTERVAL:
+            return
+        count, self._errors_logged = self.errors - self._errors_logged, self.errors
+        self._error_logged_at = now
+        LOG.error("%s write failed (%d since the last line): %s", self.name, count, error)
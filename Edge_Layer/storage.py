@@ -0,0 +1,240 @@
+import sqlite3
+from datetime import date, datetime
+from functools import lru_cache
+
+# =============================================================================
+# STORAGE BACKENDS
+# =============================================================================
+
+# Both backends take the same SQL with %s placeholders and return
+# connections with the pymysql interface the pool and the writer use
+# (cursor, commit, rollback, ping, close). The few statements that differ
+# between MySQL and SQLite (upserts, chunked deletes, index creation, epoch
+# and bucket arithmetic) are built by the backend instead of hard-coded,
+# and is_transient() tells a lost connection from a row the database refuses.
+
+# Merge of an upserted value into the existing row. "set" overwrites,
+# the others combine partial aggregates (see rollup.py)
+MYSQL_MERGE = {
+    "set": "{c} = VALUES({c})",
+    "sum": "{c} = {c} + VALUES({c})",
+    "min": "{c} = LEAST({c}, VALUES({c}))",
+    "max": "{c} = GREATEST({c}, VALUES({c}))",
+}
+
+SQLITE_MERGE = {
+    "set": "{c} = excluded.{c}",
+    "sum": "{c} = {c} + excluded.{c}",
+    "min": "{c} = MIN({c}, excluded.{c})",
+    "max": "{c} = MAX({c}, excluded.{c})",
+}
+
+class MySQLBackend:
+    name = "mysql"
+
+    def __init__(self, host="localhost", user="root", password="", database=None):
+        self.host = host
+        self.user = user
+        self.password = password
+        self.database = database
+
+    def connect(self):
+        # Imported here so SQLite-only boards do not need the driver
+        import pymysql
+        return pymysql.connect(host=self.host, user=self.user, password=self.password, database=self.database)
+
+    def stream_cursor(self, conn):
+        # Unbuffered cursor: fetchmany() pulls rows from the server as it goes
+        import pymysql.cursors
+        return conn.cursor(pymysql.cursors.SSCursor)
+
+    def upsert(self, table, keys, merges):
+        # keys: primary key columns; merges: column -> "set" | "sum" | "min" | "max"
+        columns = list(keys) + list(merges)
+        placeholders = ", ".join(["%s"] * len(columns))
+        updates = ", ".join(MYSQL_MERGE[kind].format(c=c) for c, kind in merges.items())
+        return (f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders}) "
+                f"ON DUPLICATE KEY UPDATE {updates}")
+
+    def delete_oldest(self, table, column):
+        # Parameters: (cutoff, chunk size)
+        return f"DELETE FROM {table} WHERE {column} < %s ORDER BY {column} LIMIT %s"
+
+    def delete_range(self, table, column):
+        # Parameters: (start, end, chunk size)
+        return f"DELETE FROM {table} WHERE {column} >= %s AND {column} < %s ORDER BY {column} LIMIT %s"
+
+    def ensure_index(self, cur, table, columns, index):
+        cur.execute(f"SHOW INDEX FROM {table} WHERE Key_name = %s", (index,))
+        if not cur.fetchall():
+            cur.execute(f"CREATE INDEX {index} ON {table} ({', '.join(columns)})")
+
+    def epoch(self, column):
+        # DATETIME column as Unix seconds (stored times are local)
+        return f"UNIX_TIMESTAMP({column})"
+
+    def floor(self, expression):
+        return f"FLOOR({expression})"
+
+    def is_transient(self, exc):
+        # Lost or refused connections, lock timeouts and deadlocks: the same
+        # rows can be written later. Errors about the rows themselves (bad
+        # value, data too long, constraint, unknown column) cannot
+        from pymysql import err
+        from pymysql.constants import ER
+        if isinstance(exc, err.OperationalError):
+            return exc.args[0] != ER.CONSTRAINT_FAILED
+        if isinstance(exc, err.InternalError):
+            return exc.args[0] == ER.LOCK_WAIT_TIMEOUT
+        return isinstance(exc, (err.InterfaceError, OSError))
+
+# SQLite stores DATETIME and DATE columns as ISO text, which sorts in time
+# order, and converts them back by declared type when reading
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(" "))
+sqlite3.register_adapter(date, lambda value: value.isoformat())
+sqlite3.register_converter("DATETIME", lambda text: datetime.fromisoformat(text.decode()))
+sqlite3.register_converter("DATE", lambda text: date.fromisoformat(text.decode()))
+
+@lru_cache(maxsize=256)
+def _qmark(sql):
+    # %s -> ? once per distinct statement; the identical text then hits
+    # sqlite3's per-connection prepared statement cache
+    return sql.replace("%s", "?")
+
+class SQLiteCursor:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, sql, params=()):
+        self._cursor.execute(_qmark(sql), params)
+        return self._cursor.rowcount
+
+    def executemany(self, sql, rows):
+        self._cursor.executemany(_qmark(sql), rows)
+        return self._cursor.rowcount
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchmany(self, size):
+        return self._cursor.fetchmany(size)
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    def close(self):
+        self._cursor.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class SQLiteConnection:
+    def __init__(self, conn):
+        self._conn = conn
+
+    def cursor(self):
+        return SQLiteCursor(self._conn.cursor())
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def ping(self, reconnect=True):
+        # Raises once the connection is closed so the pool replaces it
+        self._conn.execute("SELECT 1")
+
+    def close(self):
+        self._conn.close()
+
+class SQLiteBackend:
+    # Single-file database for boards without a MySQL server. WAL mode lets
+    # report and history queries read while the writer thread commits, and
+    # with synchronous=NORMAL a batch costs one WAL append instead of an
+    # fsync per row; only the last batches can be lost on power failure.
+    name = "sqlite"
+
+    def __init__(self, path, busy_timeout=5.0, synchronous="NORMAL", cached_statements=256):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self.synchronous = synchronous
+        self.cached_statements = cached_statements
+
+    def connect(self):
+        conn = sqlite3.connect(
+            self.path,
+            timeout=self.busy_timeout,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            cached_statements=self.cached_statements,
+            check_same_thread=False  # The pool hands each connection to one thread at a time
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA synchronous={self.synchronous}")
+        return SQLiteConnection(conn)
+
+    def stream_cursor(self, conn):
+        # sqlite3 cursors already step through results lazily
+        return conn.cursor()
+
+    def upsert(self, table, keys, merges):
+        columns = list(keys) + list(merges)
+        placeholders = ", ".join(["%s"] * len(columns))
+        updates = ", ".join(SQLITE_MERGE[kind].format(c=c) for c, kind in merges.items())
+        return (f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders}) "
+                f"ON CONFLICT ({', '.join(keys)}) DO UPDATE SET {updates}")
+
+    def delete_oldest(self, table, column):
+        # DELETE ... LIMIT needs a compile-time option, so pick the rows by rowid
+        return (f"DELETE FROM {table} WHERE rowid IN "
+                f"(SELECT rowid FROM {table} WHERE {column} < %s ORDER BY {column} LIMIT %s)")
+
+    def delete_range(self, table, column):
+        return (f"DELETE FROM {table} WHERE rowid IN (SELECT rowid FROM {table} "
+                f"WHERE {column} >= %s AND {column} < %s ORDER BY {column} LIMIT %s)")
+
+    def ensure_index(self, cur, table, columns, index):
+        cur.execute(f"CREATE INDEX IF NOT EXISTS {index} ON {table} ({', '.join(columns)})")
+
+    def epoch(self, column):
+        # The 'utc' modifier treats the stored local time like UNIX_TIMESTAMP
+        # does; rounded to ms because julianday() is a float day count
+        return f"ROUND((julianday({column}, 'utc') - 2440587.5) * 86400.0, 3)"
+
+    def floor(self, expression):
+        # Bucket arithmetic only sees non-negative values, where CAST truncation is floor
+        return f"CAST({expression} AS INTEGER)"
+
+    def is_transient(self, exc):
+        # Locked or busy database and I/O errors; constraint, type and
+        # parameter binding errors come from the rows themselves
+        return isinstance(exc, (sqlite3.OperationalError, OSError))
+
+def make_backend(kind, host="localhost", user="root", password="", database=None, path=None):
+    # kind: "mysql" or "sqlite" (path defaults to <database>.db)
+    if kind == "mysql":
+        return MySQLBackend(host, user, password, database)
+    if kind == "sqlite":
+        return SQLiteBackend(path or f"{database}.db")
+    raise ValueError(f"unknown database backend {kind!r}")
+
+# =============================================================================
+# SCHEMA HELPERS
+# =============================================================================
+
+def ensure_index(table, columns, index):
+    # Schema step for DBWriter: create an index unless it already exists
+    def step(cur, backend):
+        backend.ensure_index(cur, table, columns, index)
+    return step
@@ -6,6 +6,24 @@
 #define MOTORPIN 4
 #define SERVOPIN 9
 
+// ========== SERIAL PROTOCOL ==========
+// 0 = text lines (default), 1 = framed binary (must match SERIAL_PROTOCOL in inside_edge.py)
+// Frame: 0xA5 0x5A | LEN | TYPE | PAYLOAD | CRC16 (LEN counts TYPE + PAYLOAD)
+// Commands from the edge stay text in both modes. Actuator and mode commands
+// may end in ";id:<n>"; the sketch answers them with an ACK once applied.
+#define FRAMED_PROTOCOL 0
+#define FRAME_SYNC1 0xA5
+#define FRAME_SYNC2 0x5A
+#define FRAME_ACTUATORS 0x02
+#define FRAME_ACK 0x03
+#define FRAME_COMMAND_ACK 0x04
+
+// Actuator flag bits in FRAME_ACTUATORS
+#define FLAG_MANUAL 0x01
+#define FLAG_LIGHT 0x02
+#define FLAG_FAN 0x04
+#define FLAG_DOOR 0x08
+
 // ========== HARDWARE OBJECTS ==========
 Servo doorServo;
 
@@ -29,6 +47,7 @@ float tempLimit = 30.0;
 // ========== SYSTEM STATUS VARIABLES ==========
 bool ack = false;
 bool isManualMode = false;
+long commandId = 0; // ID of the command being applied (0 = none)
 
 // Actuator States
 bool isLightOn = false;
@@ -86,6 +105,11 @@ void loop() {
     previousMillis = currentMillis;
 
     // Send actuator status via serial
+#if FRAMED_PROTOCOL
+    uint8_t flags = (isManualMode ? FLAG_MANUAL : 0) | (isLightOn ? FLAG_LIGHT : 0) |
+                    (isFanOn ? FLAG_FAN : 0) | (isDoorOpen ? FLAG_DOOR : 0);
+    sendFrame(FRAME_ACTUATORS, &flags, 1);
+#else
     Serial.print("ACTUATORS|"); // Actuator header
     Serial.print("Mode: ");
     Serial.print(isManualMode ? "manual" : "auto");
@@ -95,6 +119,7 @@ void loop() {
     Serial.print(isFanOn ? "on" : "off");
     Serial.print(", Door: ");
     Serial.println(isDoorOpen ? "open" : "close");
+#endif
     
     // Update OLED display
     displayMessage(screenMessage);
@@ -104,14 +129,27 @@ void loop() {
   if (Serial.available() > 0) {
     // Acknowledge receipt of data
     ack = true;
+#if FRAMED_PROTOCOL
+    uint8_t status = ack ? 1 : 0;
+    sendFrame(FRAME_ACK, &status, 1);
+#else
     Serial.print("SENSORS|"); // Sensor header
     Serial.print("status: ");
     Serial.println(ack ? "active" : "inactive");
+#endif
 
     // Read incoming data
     input = Serial.readStringUntil('\n');
     input.trim(); // Remove whitespace
 
+    // Split off the command ID, e.g. "led:on;id:17"
+    commandId = 0;
+    int idSep = input.indexOf(";id:");
+    if (idSep != -1) {
+      commandId = input.substring(idSep + 4).toInt();
+      input = input.substring(0, idSep);
+    }
+
     // ========== COMMAND PARSING ==========
     // Parse different types of incoming commands
     if (input.startsWith("sensor:")) {
@@ -172,7 +210,9 @@ void loop() {
         if (isLightOn) screenMessage = lightMsg; 
         if (isFanOn) screenMessage = fanMsg;
         if (isDoorOpen) screenMessage = doorMsg;
+#if !FRAMED_PROTOCOL
         Serial.println();
+#endif
       }
     }
 
@@ -181,6 +221,11 @@ void loop() {
     digitalWrite(LEDPIN, isLightOn ? HIGH : LOW);
     digitalWrite(MOTORPIN, isFanOn ? HIGH : LOW);
     doorServo.write(isDoorOpen ? 90 : 0); // 90° = open, 0° = closed
+
+    // Confirm the command straight away with the resulting states
+    if (commandId > 0) {
+      sendCommandAck(commandId);
+    }
   }
 
   // Update display continuously (function handles change detection)
@@ -235,4 +280,58 @@ void parseSensorData(String data) {
 
     start = end + 1; // Move to next pair
   }
+}
+
+// ========== COMMAND ACKNOWLEDGEMENT ==========
+// Text: "ACK|id: 17, Mode: manual, Light: on, Fan: off, Door: close"
+// Framed: FRAME_COMMAND_ACK with the ID (uint32, little-endian) and actuator flags
+void sendCommandAck(long id) {
+#if FRAMED_PROTOCOL
+  uint8_t payload[5];
+  for (uint8_t i = 0; i < 4; i++) {
+    payload[i] = (id >> (8 * i)) & 0xFF;
+  }
+  payload[4] = (isManualMode ? FLAG_MANUAL : 0) | (isLightOn ? FLAG_LIGHT : 0) |
+               (isFanOn ? FLAG_FAN : 0) | (isDoorOpen ? FLAG_DOOR : 0);
+  sendFrame(FRAME_COMMAND_ACK, payload, 5);
+#else
+  Serial.print("ACK|id: ");
+  Serial.print(id);
+  Serial.print(", Mode: ");
+  Serial.print(isManualMode ? "manual" : "auto");
+  Serial.print(", Light: ");
+  Serial.print(isLightOn ? "on" : "off");
+  Serial.print(", Fan: ");
+  Serial.print(isFanOn ? "on" : "off");
+  Serial.print(", Door: ");
+  Serial.println(isDoorOpen ? "open" : "close");
+#endif
+}
+
+// ========== FRAME ENCODER ==========
+// CRC-16/CCITT-FALSE, same as crc16() in Edge_Layer/serial_protocol.py
+uint16_t crc16Update(uint16_t crc, uint8_t data) {
+  crc ^= (uint16_t)data << 8;
+  for (uint8_t i = 0; i < 8; i++) {
+    crc = (crc & 0x8000) ? (crc << 1) ^ 0x1021 : crc << 1;
+  }
+  return crc;
+}
+
+void sendFrame(uint8_t type, const uint8_t* payload, uint8_t length) {
+  uint16_t crc = 0xFFFF;
+  uint8_t frameLength = length + 1; // Type byte + payload
+
+  Serial.write(FRAME_SYNC1);
+  Serial.write(FRAME_SYNC2);
+  Serial.write(frameLength);
+  crc = crc16Update(crc, frameLength);
+  Serial.write(type);
+  crc = crc16Update(crc, type);
+  for (uint8_t i = 0; i < length; i++) {
+    Serial.write(payload[i]);
+    crc = crc16Update(crc, payload[i]);
+  }
+  Serial.write(crc & 0xFF);
+  Serial.write(crc >> 8);
 }
\ No newline at end of file
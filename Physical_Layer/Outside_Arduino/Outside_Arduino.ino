@@ -9,6 +9,14 @@
 // ========== SENSOR CONFIGURATION ==========
 #define DHTTYPE DHT22
 
+// ========== SERIAL PROTOCOL ==========
+// 0 = text lines (default), 1 = framed binary (must match SERIAL_PROTOCOL in outside_edge.py)
+// Frame: 0xA5 0x5A | LEN | TYPE | PAYLOAD | CRC16 (LEN counts TYPE + PAYLOAD)
+#define FRAMED_PROTOCOL 0
+#define FRAME_SYNC1 0xA5
+#define FRAME_SYNC2 0x5A
+#define FRAME_SENSORS 0x01
+
 // ========== SENSOR OBJECTS ==========
 DHT dht(DHTPIN, DHTTYPE);
 
@@ -58,6 +66,16 @@ void loop() {
     int temperature = round(dht.readTemperature());
 
     // ========== DATA TRANSMISSION ==========
+#if FRAMED_PROTOCOL
+    // Send sensor data as a binary frame: light (uint16), temperature (int16), sound (uint8)
+    uint8_t payload[5];
+    payload[0] = lux & 0xFF;
+    payload[1] = (lux >> 8) & 0xFF;
+    payload[2] = temperature & 0xFF;
+    payload[3] = (temperature >> 8) & 0xFF;
+    payload[4] = soundDetected ? 1 : 0;
+    sendFrame(FRAME_SENSORS, payload, sizeof(payload));
+#else
     // Send sensor data in comma-separated format
     Serial.print("Light:");
     Serial.print(lux);
@@ -65,6 +83,7 @@ void loop() {
     Serial.print(soundDetected ? "Yes" : "No");    
     Serial.print(", Temperature:");
     Serial.println(temperature);
+#endif
 
     // ========== RESET FLAGS ==========
     // Reset sound detection flag for next interval
@@ -98,3 +117,31 @@ int calculateLux(int analogValue) {
   float lux = analogValue * (6000.0 / 1023.0); 
   return round(lux); // Return rounded integer value
 }
+
+// ========== FRAME ENCODER ==========
+// CRC-16/CCITT-FALSE, same as crc16() in Edge_Layer/serial_protocol.py
+uint16_t crc16Update(uint16_t crc, uint8_t data) {
+  crc ^= (uint16_t)data << 8;
+  for (uint8_t i = 0; i < 8; i++) {
+    crc = (crc & 0x8000) ? (crc << 1) ^ 0x1021 : crc << 1;
+  }
+  return crc;
+}
+
+void sendFrame(uint8_t type, const uint8_t* payload, uint8_t length) {
+  uint16_t crc = 0xFFFF;
+  uint8_t frameLength = length + 1; // Type byte + payload
+
+  Serial.write(FRAME_SYNC1);
+  Serial.write(FRAME_SYNC2);
+  Serial.write(frameLength);
+  crc = crc16Update(crc, frameLength);
+  Serial.write(type);
+  crc = crc16Update(crc, type);
+  for (uint8_t i = 0; i < length; i++) {
+    Serial.write(payload[i]);
+    crc = crc16Update(crc, payload[i]);
+  }
+  Serial.write(crc & 0xFF);
+  Serial.write(crc >> 8);
+}
\ No newline at end of file
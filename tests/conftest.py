@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The modules import each other by name, as the scripts do after adding
+# these directories to sys.path
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'Edge_Layer'))
+sys.path.insert(0, os.path.join(ROOT, 'Common'))
@@ -0,0 +1,117 @@
+import json
+import pytest
+from payload_codec import (INSIDE_DATA_SCHEMA, MARKER_STRUCT, OUTSIDE_DATA_SCHEMA, TOPIC_SCHEMAS, PayloadCodec,
+                           Schema)
+
+# =============================================================================
+# HELPERS
+# =============================================================================
+
+# One value per field kind, at the edge of what the kind holds
+SAMPLE_VALUES = {
+    "time": "2026-10-17T12:34:56.123456",
+    "i32": -2 ** 31,
+    "u32": 2 ** 32 - 1,
+    "f64": 30.5,
+    "str": "Clear ☀",
+}
+
+def sample(fields):
+    # Enums take their last value so a wrong index cannot pass as the first
+    return {name: kind[-1] if isinstance(kind, tuple) else SAMPLE_VALUES[kind] for name, kind in fields}
+
+def concrete(topic_filter):
+    return topic_filter.replace("+", "lab")
+
+OUTSIDE_DATA = {"timestamp": "2026-10-17T08:00:00", "light": 512, "sound": "No", "temperature": 24}
+
+@pytest.fixture
+def codec():
+    return PayloadCodec("struct", name="Test")
+
+# =============================================================================
+# STRUCT ROUND TRIP
+# =============================================================================
+
+@pytest.mark.parametrize("topic_filter", sorted(TOPIC_SCHEMAS))
+def test_round_trip_every_schema(codec, topic_filter):
+    topic = concrete(topic_filter)
+    obj = sample(TOPIC_SCHEMAS[topic_filter])
+    raw = codec.encode(topic, obj)
+    assert isinstance(raw, bytes) and raw[0] == MARKER_STRUCT
+    decoded = codec.decode(topic, raw)
+    assert decoded == obj
+    assert list(decoded) == list(obj)  # Same key order as the JSON
+    assert codec.fallbacks == 0
+
+def test_struct_smaller_than_json(codec):
+    raw = codec.encode("edge/outside/data", OUTSIDE_DATA)
+    assert len(raw) < len(json.dumps(OUTSIDE_DATA))
+
+def test_time_without_microseconds(codec):
+    raw = codec.encode("edge/outside/data", OUTSIDE_DATA)
+    assert codec.decode("edge/outside/data", raw)["timestamp"] == OUTSIDE_DATA["timestamp"]
+
+# =============================================================================
+# JSON FALLBACK
+# =============================================================================
+
+@pytest.mark.parametrize("obj", [
+    dict(OUTSIDE_DATA, humidity=40),                                   # extra key
+    {k: v for k, v in OUTSIDE_DATA.items() if k != "sound"},           # missing key
+    dict(OUTSIDE_DATA, light=2 ** 31),                                 # i32 overflow
+    dict(OUTSIDE_DATA, temperature=24.5),                              # float for an int
+    dict(OUTSIDE_DATA, sound="Maybe"),                                 # not in the enum
+    dict(OUTSIDE_DATA, timestamp="yesterday"),                         # not ISO
+])
+def test_fallback_to_json(codec, obj):
+    raw = codec.encode("edge/outside/data", obj)
+    assert isinstance(raw, str)
+    assert codec.fallbacks == 1
+    assert codec.decode("edge/outside/data", raw) == obj
+
+def test_fallback_negative_command_id(codec):
+    obj = {"led": "on", "id": -1}
+    raw = codec.encode("cloud/control/led", obj)
+    assert isinstance(raw, str) and codec.fallbacks == 1
+    assert codec.decode("cloud/control/led", raw.encode()) == obj
+
+def test_topic_without_schema_is_json(codec):
+    raw = codec.encode("cloud/other", {"a": 1})
+    assert raw == '{"a": 1}'
+    assert codec.fallbacks == 0
+
+def test_json_codec_never_packs():
+    codec = PayloadCodec("json")
+    assert codec.encode("edge/outside/data", OUTSIDE_DATA) == json.dumps(OUTSIDE_DATA)
+
+def test_unknown_codec():
+    with pytest.raises(ValueError):
+        PayloadCodec("xml")
+
+# =============================================================================
+# DECODE ERRORS
+# =============================================================================
+
+def test_wrong_tag(codec):
+    raw = bytearray(codec.encode("edge/outside/data", OUTSIDE_DATA))
+    raw[1] ^= 0xFF
+    with pytest.raises(ValueError):
+        codec.decode("edge/outside/data", bytes(raw))
+
+def test_schema_of_another_topic():
+    assert Schema(OUTSIDE_DATA_SCHEMA).tag != Schema(INSIDE_DATA_SCHEMA).tag
+
+def test_trailing_bytes(codec):
+    raw = codec.encode("edge/outside/data", OUTSIDE_DATA) + b"\x00"
+    with pytest.raises(ValueError):
+        codec.decode("edge/outside/data", raw)
+
+def test_struct_on_topic_without_schema(codec):
+    raw = codec.encode("edge/outside/data", OUTSIDE_DATA)
+    with pytest.raises(ValueError):
+        codec.decode("cloud/other", raw)
+
+def test_json_from_older_publisher(codec):
+    payload = json.dumps(OUTSIDE_DATA).encode()
+    assert codec.decode("edge/outside/data", payload) == OUTSIDE_DATA
@@ -0,0 +1,131 @@
+import pytest
+from serial_protocol import (COMMAND_ACK_LAYOUT, FLAG_DOOR, FLAG_LIGHT, FLAG_MANUAL, FLAGS_LAYOUT, FRAME_ACK,
+                             FRAME_ACTUATORS, FRAME_COMMAND_ACK, FRAME_SENSORS, FRAME_SYNC, INSIDE_FRAMES,
+                             SENSOR_FRAMES, SENSORS_LAYOUT, FrameDecoder, LineDecoder, crc16, encode_frame,
+                             parse_sensor_text)
+
+# =============================================================================
+# HELPERS
+# =============================================================================
+
+def sensor_frame(light=512, temp=24, sound=0):
+    return encode_frame(FRAME_SENSORS, SENSORS_LAYOUT.pack(light, temp, sound))
+
+def sensor_record(light=512, temp=24, sound=0):
+    return light, "Yes" if sound else "No", temp
+
+# =============================================================================
+# CRC
+# =============================================================================
+
+def test_crc16_check_value():
+    # CRC-16/CCITT-FALSE check value, as in the sketches' crc16Update()
+    assert crc16(b"123456789") == 0x29B1
+
+def test_crc16_range():
+    data = b"xx123456789yy"
+    assert crc16(data, 2, 11) == crc16(b"123456789")
+
+# =============================================================================
+# FRAME DECODER
+# =============================================================================
+
+def test_single_frame():
+    decoder = FrameDecoder(SENSOR_FRAMES)
+    assert decoder.feed(sensor_frame(6000, -12, 1)) == [sensor_record(6000, -12, 1)]
+    assert decoder.errors == 0
+
+def test_inside_frames():
+    decoder = FrameDecoder(INSIDE_FRAMES)
+    data = (encode_frame(FRAME_ACTUATORS, FLAGS_LAYOUT.pack(FLAG_MANUAL | FLAG_LIGHT))
+            + encode_frame(FRAME_ACK, FLAGS_LAYOUT.pack(1))
+            + encode_frame(FRAME_COMMAND_ACK, COMMAND_ACK_LAYOUT.pack(17, FLAG_DOOR)))
+    assert decoder.feed(data) == [
+        ("ACTUATORS", ("manual", "on", "off", "close")),
+        ("SENSORS", "active"),
+        ("ACK", (17, "auto", "off", "off", "open")),
+    ]
+
+@pytest.mark.parametrize("split", range(1, 9))
+def test_frame_split_across_reads(split):
+    decoder = FrameDecoder(SENSOR_FRAMES)
+    frame = sensor_frame()
+    assert decoder.feed(frame[:split]) == []
+    assert decoder.feed(frame[split:]) == [sensor_record()]
+    assert decoder.errors == 0
+
+def test_frames_fed_byte_by_byte():
+    decoder = FrameDecoder(SENSOR_FRAMES)
+    data = sensor_frame(1) + sensor_frame(2) + sensor_frame(3)
+    records = []
+    for i in range(len(data)):
+        records += decoder.feed(data[i:i + 1])
+    assert records == [sensor_record(1), sensor_record(2), sensor_record(3)]
+    assert decoder.errors == 0
+
+def test_corrupt_crc_then_valid_frame():
+    decoder = FrameDecoder(SENSOR_FRAMES)
+    corrupt = bytearray(sensor_frame(100))
+    corrupt[-1] ^= 0xFF
+    assert decoder.feed(bytes(corrupt) + sensor_frame(200)) == [sensor_record(200)]
+    assert decoder.errors == 1
+
+def test_corrupt_payload_then_valid_frame():
+    decoder = FrameDecoder(SENSOR_FRAMES)
+    corrupt = bytearray(sensor_frame(100))
+    corrupt[5] ^= 0x01
+    assert decoder.feed(bytes(corrupt) + sensor_frame(200)) == [sensor_record(200)]
+    assert decoder.errors == 1
+
+def test_false_sync_overlapping_real_frame():
+    # A sync marker in line noise whose LEN spans the start of the real
+    # frame: the CRC fails and the decoder resyncs inside the span
+    decoder = FrameDecoder(SENSOR_FRAMES)
+    noise = FRAME_SYNC + bytes([SENSORS_LAYOUT.size + 1])
+    assert decoder.feed(b"\x00\x13" + noise + sensor_frame(300)) == [sensor_record(300)]
+    assert decoder.errors == 1
+
+def test_oversized_length_resyncs_immediately():
+    # LEN 255 would otherwise wait for 258 more bytes before the CRC check
+    decoder = FrameDecoder(SENSOR_FRAMES)
+    assert decoder.feed(FRAME_SYNC + b"\xff" + sensor_frame(400)) == [sensor_record(400)]
+    assert decoder.errors == 1
+
+def test_max_length_from_layouts():
+    assert FrameDecoder(SENSOR_FRAMES).max_length == SENSORS_LAYOUT.size + 1
+    assert FrameDecoder(INSIDE_FRAMES).max_length == COMMAND_ACK_LAYOUT.size + 1
+
+def test_zero_length_rejected():
+    decoder = FrameDecoder(SENSOR_FRAMES)
+    assert decoder.feed(FRAME_SYNC + b"\x00" + sensor_frame()) == [sensor_record()]
+    assert decoder.errors == 1
+
+def test_unknown_type_and_wrong_size_skipped():
+    decoder = FrameDecoder(SENSOR_FRAMES)
+    unknown = encode_frame(0x7F, SENSORS_LAYOUT.pack(1, 2, 0))
+    short = encode_frame(FRAME_SENSORS, b"\x01\x02")
+    assert decoder.feed(unknown + short + sensor_frame()) == [sensor_record()]
+    assert decoder.errors == 2
+
+def test_trailing_sync_byte_kept():
+    decoder = FrameDecoder(SENSOR_FRAMES)
+    frame = sensor_frame()
+    assert decoder.feed(b"noise" + frame[:1]) == []
+    assert decoder.feed(frame[1:]) == [sensor_record()]
+
+def test_noise_without_sync_is_dropped():
+    decoder = FrameDecoder(SENSOR_FRAMES, max_buffer=16)
+    assert decoder.feed(bytes(range(64))) == []
+    assert decoder.feed(sensor_frame()) == [sensor_record()]
+    assert decoder.errors == 0
+
+# =============================================================================
+# LINE DECODER
+# =============================================================================
+
+def test_line_decoder_split_and_bad_line():
+    decoder = LineDecoder(parse_sensor_text)
+    assert decoder.feed(b"Light:512, Sound:No, Temp") == []
+    assert decoder.feed(b"erature:24\ngarbage\nLight:7, Sound:Yes, Temperature:-3\n") == [
+        (512, "No", 24), (7, "Yes", -3)]
+    assert decoder.errors == 1